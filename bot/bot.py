@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import warnings
 from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
@@ -7,10 +9,22 @@ from telegram.ext import (
     CallbackQueryHandler,
     ConversationHandler,
     MessageHandler,
+    TypeHandler,
     filters,
 )
-from .handlers import admin_handlers, user_handlers, tournament_handlers
+from telegram.warnings import PTBUserWarning
+from .handlers import (
+    admin_handlers, user_handlers, tournament_handlers, console_handlers, throttle_handlers, transfer_handlers,
+)
 from .handlers.admin_handlers import is_admin
+from .data.database import open_database, close_database
+from .data.persistence import SQLitePersistence
+from .services.sender import RateLimiter
+from .services.outbox_worker import start_outbox_worker, stop_outbox_worker
+from .services.broadcaster import start_broadcaster, stop_broadcaster
+from .services.metrics import instrument_handlers, start_metrics, stop_metrics
+from .services.tournament_state import load_tournaments
+from .services.webhook import WebhookServer, run_webhook
 
 # Enable logging
 logging.basicConfig(
@@ -34,20 +48,34 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "*Доступные команды:*\n"
         "/start - Приветственное сообщение\n"
         "/help - Показать это сообщение\n"
-        "/register - Начать регистрацию на турнир\n"
-        "/my_status - Проверить свой статус и текущий матч\n"
-        "/bracket - Показать турнирную сетку"
+        "/tournaments - Список турниров\n"
+        "/register [ID] - Начать регистрацию на турнир\n"
+        "/my_status - Проверить свой статус и текущие матчи\n"
+        "/bracket [ID] - Показать турнирную сетку\n"
+        "/leaderboard - Рейтинг игроков по всем турнирам\n\n"
+        "ID турнира можно не указывать, если идет только один турнир."
     )
 
     admin_help_text = (
         "\n\n*Команды для администраторов:*\n"
-        "/broadcast <сообщение> - Отправить объявление всем участникам\n"
-        "/open_registration - Открыть регистрацию\n"
-        "/close_registration - Закрыть регистрацию\n"
-        "/set_mode_nickname - Установить режим 'только никнейм'\n"
-        "/set_mode_character - Установить режим 'никнейм и персонаж'\n"
-        "/start_tournament - Начать турнир\n"
-        "/reset_tournament - Сбросить турнир"
+        "/new_tournament <название> - Создать турнир\n"
+        "/broadcast <ID> [группа] <сообщение> - Отправить объявление участникам турнира "
+        "(группы: all, alive, unreported, round=N, character=Имя)\n"
+        "/cancel_broadcast [номер] - Отменить рассылку\n"
+        "/open_registration [ID] - Открыть регистрацию\n"
+        "/close_registration [ID] - Закрыть регистрацию\n"
+        "/set_mode_nickname [ID] - Установить режим 'только никнейм'\n"
+        "/set_mode_character [ID] - Установить режим 'никнейм и персонаж'\n"
+        "/set_format [ID] <single|double|swiss> [туры] - Выбрать формат турнира\n"
+        "/set_seeding [ID] <random|rating> - Случайный посев или посев по рейтингу\n"
+        "/start_tournament [ID] - Начать турнир\n"
+        "/console [ID] - Прислать панели управления матчами\n"
+        "/import [ID] - Зарегистрировать игроков из файла CSV или JSON (подпись к файлу)\n"
+        "/export [ID] <registrations|matches> [csv|json] - Выгрузить игроков или матчи в файл\n"
+        "/reset_tournament [ID] - Сбросить турнир (копия сохраняется)\n"
+        "/archive_tournament [ID] - Перенести завершенный турнир в архив\n"
+        "/snapshot [ID] - Сохранить снимок турнира\n"
+        "/restore <файл|ID> - Восстановить турнир из снимка"
     )
 
     if is_admin(user.id):
@@ -55,44 +83,141 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(user_help_text)
 
+async def post_init(application):
+    """Opens the shared database connection and starts background workers before the bot handles updates."""
+    await open_database()
+    await load_tournaments()
+    await start_outbox_worker(application.bot)
+    await start_broadcaster(application.bot)
+    await start_metrics(METRICS_LISTEN, METRICS_PORT, METRICS_LOG_INTERVAL)
+
+async def post_stop(application):
+    """Stops background workers while the bot can still send."""
+    await stop_broadcaster()
+    await stop_outbox_worker()
+    await stop_metrics()
+
+async def post_shutdown(application):
+    """Closes the shared database connection after the bot has stopped."""
+    await close_database()
+
+import config
 from config import TELEGRAM_TOKEN
 
-def main():
-    """Start the bot."""
-    if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11":
-        logger.error("TELEGRAM_TOKEN не настроен в файле config.py. Пожалуйста, укажите токен вашего бота.")
-        return
+# Optional settings; config.py files written before they existed keep working.
+UPDATE_MODE = getattr(config, "UPDATE_MODE", "polling")
+CONCURRENT_UPDATES = getattr(config, "CONCURRENT_UPDATES", 1)
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", "")
+WEBHOOK_LISTEN = getattr(config, "WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = getattr(config, "WEBHOOK_MAX_CONNECTIONS", 40)
+METRICS_LISTEN = getattr(config, "METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = getattr(config, "METRICS_PORT", 0)
+METRICS_LOG_INTERVAL = getattr(config, "METRICS_LOG_INTERVAL", 300)
+
+def build_application(token: str = TELEGRAM_TOKEN, request=None, concurrent_updates=CONCURRENT_UPDATES):
+    """Creates the Application with every handler registered.
+
+    request replaces the HTTP transport to the Bot API, e.g. with an offline stub in tools/.
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .rate_limiter(RateLimiter())
+        .concurrent_updates(concurrent_updates)
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
-    # Create the Application and pass it your bot's token.
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    # Runs before every other handler and drops floods
+    application.add_handler(TypeHandler(Update, throttle_handlers.throttle_update), group=-1)
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
 
     # Admin commands
+    application.add_handler(CommandHandler("new_tournament", admin_handlers.new_tournament))
     application.add_handler(CommandHandler("open_registration", admin_handlers.open_registration))
     application.add_handler(CommandHandler("close_registration", admin_handlers.close_registration))
     application.add_handler(CommandHandler("set_mode_nickname", admin_handlers.set_mode_nickname))
     application.add_handler(CommandHandler("set_mode_character", admin_handlers.set_mode_character))
+    application.add_handler(CommandHandler("set_format", admin_handlers.set_format))
+    application.add_handler(CommandHandler("set_seeding", admin_handlers.set_seeding))
     application.add_handler(CommandHandler("start_tournament", tournament_handlers.start_tournament))
     application.add_handler(CommandHandler("reset_tournament", tournament_handlers.reset_tournament))
+    application.add_handler(CommandHandler("archive_tournament", tournament_handlers.archive_tournament))
+    application.add_handler(CommandHandler("snapshot", tournament_handlers.snapshot_tournament))
+    application.add_handler(CommandHandler("restore", tournament_handlers.restore_tournament))
     application.add_handler(CommandHandler("broadcast", admin_handlers.broadcast))
+    application.add_handler(CommandHandler("cancel_broadcast", admin_handlers.cancel_broadcast))
+    application.add_handler(CommandHandler("console", console_handlers.show_console))
+    application.add_handler(CommandHandler("import", transfer_handlers.import_registrations))
+    # A file sent with /import as its caption
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/import(@\w+)?(\s|$)'), transfer_handlers.import_registrations
+    ))
+    application.add_handler(CommandHandler("export", transfer_handlers.export_data))
 
     # User commands
-    reg_handler = ConversationHandler(
-        entry_points=[CommandHandler("register", user_handlers.register_start)],
-        states={
-            user_handlers.NICKNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, user_handlers.received_nickname)],
-            user_handlers.CHARACTER: [MessageHandler(filters.TEXT & ~filters.COMMAND, user_handlers.received_character)],
-        },
-        fallbacks=[CommandHandler("cancel", user_handlers.cancel_registration)],
-    )
+    # The conversation mixes text messages and character buttons, so it is tracked per chat and
+    # user (per_message=False). PTB warns that its CallbackQueryHandlers are then not tracked per
+    # message; that is intended, as a player has a single character picker at a time. The warning
+    # is silenced only while this handler is built.
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=".*per_message=False.*", category=PTBUserWarning)
+        reg_handler = ConversationHandler(
+            entry_points=[CommandHandler("register", user_handlers.register_start)],
+            states={
+                user_handlers.NICKNAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, user_handlers.received_nickname)],
+                user_handlers.CHARACTER: [
+                    CallbackQueryHandler(user_handlers.received_character, pattern='^char_'),
+                    CallbackQueryHandler(user_handlers.character_page, pattern='^chpage_'),
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, user_handlers.character_text),
+                ],
+            },
+            fallbacks=[CommandHandler("cancel", user_handlers.cancel_registration)],
+            # Survives restarts: conversation states and user_data are stored in the database.
+            name="registration",
+            persistent=True,
+            per_message=False,
+        )
     application.add_handler(reg_handler)
+    # Buttons of a character picker whose registration is no longer in progress
+    application.add_handler(CallbackQueryHandler(user_handlers.registration_expired, pattern='^(char|chpage)_'))
+    application.add_handler(CommandHandler("tournaments", user_handlers.show_tournaments))
     application.add_handler(CommandHandler("my_status", user_handlers.my_status))
     application.add_handler(CommandHandler("bracket", user_handlers.display_bracket))
-    application.add_handler(CallbackQueryHandler(tournament_handlers.match_management_callback, pattern='^(win|dq)_'))
+    application.add_handler(CommandHandler("leaderboard", user_handlers.show_leaderboard))
+    application.add_handler(CallbackQueryHandler(user_handlers.bracket_page_callback, pattern='^bpage_'))
+    application.add_handler(CallbackQueryHandler(tournament_handlers.match_management_callback, pattern='^(win|dq)_', block=False))
+    application.add_handler(CallbackQueryHandler(console_handlers.console_callback, pattern='^(cpage|cpick)_'))
+
+    instrument_handlers(application)
+    return application
 
+def main():
+    """Start the bot."""
+    if not TELEGRAM_TOKEN or TELEGRAM_TOKEN == "123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11":
+        logger.error("TELEGRAM_TOKEN не настроен в файле config.py. Пожалуйста, укажите токен вашего бота.")
+        return
+
+    application = build_application()
+
+    if UPDATE_MODE == "webhook":
+        if not WEBHOOK_SECRET:
+            logger.error("Для режима webhook укажите WEBHOOK_SECRET в файле config.py.")
+            return
+        server = WebhookServer(application, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET)
+        asyncio.run(run_webhook(application, server, WEBHOOK_URL, WEBHOOK_MAX_CONNECTIONS))
+        return
 
     # Run the bot until the user presses Ctrl-C
     application.run_polling()
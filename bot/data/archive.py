@@ -0,0 +1,196 @@
+"""Per-tournament snapshot files for archiving, resetting and disaster recovery.
+
+A snapshot is a standalone SQLite file in ARCHIVE_DIR holding one tournament's rows: the
+tournament itself, its players' users, registrations, matches and standings, its rating
+changes and credits, plus a snapshot_info row. Archiving writes a snapshot and then removes the tournament's rows
+from the live tables; a reset writes one before it deletes anything. Restoring replaces
+whatever the live database has for that tournament with the snapshot's rows, keeping
+their ids. Match and registration ids are never reused, so a snapshot's ids cannot clash
+with rows created after it was taken.
+
+player_status is not stored; it is recomputed on restore. Archiving leaves the ratings as
+they are; restoring takes the tournament's current rating changes out of the ratings and
+puts the snapshot's back.
+
+The functions taking a connection run on the database thread; the snapshot file is
+written through its own connection.
+"""
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+import config
+from .migrations import get_schema_version
+from .player_status import delete_tournament, refresh_tournament
+from .ratings import restore_ratings, revert_tournament
+
+ARCHIVE_DIR = getattr(config, "ARCHIVE_DIR", "archive")
+
+# Tables copied into a snapshot, with the condition selecting the tournament's rows, in restore order.
+TABLES = [
+    ('tournaments', "id = :tournament_id"),
+    ('users', "id IN (SELECT user_id FROM registrations WHERE tournament_id = :tournament_id)"),
+    ('registrations', "tournament_id = :tournament_id"),
+    ('matches', "tournament_id = :tournament_id"),
+    ('standings', "tournament_id = :tournament_id"),
+]
+# Rating history copied into a snapshot; restored through ratings.restore_ratings.
+RATING_TABLES = [
+    ('rating_changes', "tournament_id = :tournament_id"),
+    ('rating_credits', "tournament_id = :tournament_id"),
+]
+FILE_NAME = re.compile(r'^tournament-(\d+)-\d{8}-\d{6}-\d{6}-[a-z]+\.db$')
+
+
+def _columns(conn, table: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def write_snapshot(conn, tournament_id: int, kind: str) -> str:
+    """Copies the tournament's rows into a new file in ARCHIVE_DIR and returns its name.
+
+    kind ('archive', 'snapshot', 'reset') only goes into the name and snapshot_info.
+    """
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    name = f"tournament-{tournament_id}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{kind}.db"
+    path = os.path.join(ARCHIVE_DIR, name)
+    temp_path = path + ".tmp"
+
+    target = sqlite3.connect(temp_path)
+    try:
+        target.execute("CREATE TABLE snapshot_info (tournament_id, kind, schema_version, created_at)")
+        target.execute(
+            "INSERT INTO snapshot_info VALUES (?, ?, ?, ?)",
+            (tournament_id, kind, get_schema_version(conn), time.time())
+        )
+        for table, condition in TABLES + RATING_TABLES:
+            columns = _columns(conn, table)
+            target.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+            rows = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE {condition}", {'tournament_id': tournament_id}
+            )
+            target.executemany(
+                f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", (tuple(row) for row in rows)
+            )
+        target.commit()
+    finally:
+        target.close()
+    os.replace(temp_path, path)
+    return name
+
+
+def discard_snapshot(name: str):
+    """Deletes a snapshot whose transaction failed after it was written, so that no file is
+    left for rows that were never removed.
+    """
+    os.remove(os.path.join(ARCHIVE_DIR, name))
+
+
+def clear_tournament(conn, tournament_id: int):
+    """Deletes the tournament's consoles, status rows, standings, matches and registrations.
+    The tournament row stays.
+    """
+    conn.execute("DELETE FROM admin_consoles WHERE tournament_id = ?", (tournament_id,))
+    delete_tournament(conn, tournament_id)
+    conn.execute("DELETE FROM standings WHERE tournament_id = ?", (tournament_id,))
+    conn.execute("UPDATE tournaments SET champion_id = NULL WHERE id = ?", (tournament_id,))
+    conn.execute("DELETE FROM matches WHERE tournament_id = ?", (tournament_id,))
+    conn.execute("DELETE FROM registrations WHERE tournament_id = ?", (tournament_id,))
+
+
+def archive_tournament(conn, tournament_id: int) -> str:
+    """Writes an archive snapshot, removes the tournament's rows and marks it archived."""
+    name = write_snapshot(conn, tournament_id, 'archive')
+    try:
+        clear_tournament(conn, tournament_id)
+        conn.execute(
+            "UPDATE tournaments SET status = 'archived', registration_open = 0 WHERE id = ?", (tournament_id,)
+        )
+    except BaseException:
+        discard_snapshot(name)
+        raise
+    return name
+
+
+def snapshot_path(name: str):
+    """The path of a snapshot file in ARCHIVE_DIR, or None if there is no such snapshot."""
+    if not FILE_NAME.match(name):
+        return None
+    path = os.path.join(ARCHIVE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def snapshot_tournament_id(name: str) -> int:
+    return int(FILE_NAME.match(name).group(1))
+
+
+def list_snapshots(tournament_id=None) -> list:
+    """Snapshot file names, newest first, optionally only those of one tournament."""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    names = [
+        name for name in os.listdir(ARCHIVE_DIR)
+        if FILE_NAME.match(name) and (tournament_id is None or snapshot_tournament_id(name) == tournament_id)
+    ]
+    # The timestamp follows the tournament id, so names of one tournament sort by time.
+    return sorted(names, key=lambda name: (name.split('-', 2)[2], name), reverse=True)
+
+
+def restore_snapshot(conn, path: str) -> int:
+    """Replaces the live rows of the snapshot's tournament with the snapshot's rows and returns
+    the tournament id. Columns missing on either side are skipped, so snapshots taken before
+    a migration still restore; one taken before rating history was saved restores without it.
+    """
+    source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    source.row_factory = sqlite3.Row
+    try:
+        tournament_id = source.execute("SELECT tournament_id FROM snapshot_info").fetchone()[0]
+        revert_tournament(conn, tournament_id)
+        clear_tournament(conn, tournament_id)
+        # Matches point at each other; check the references once everything is in.
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+
+        user_ids = {}
+        for user in source.execute("SELECT id, telegram_id, username FROM users"):
+            conn.execute(
+                "INSERT INTO users (telegram_id, username) VALUES (?, ?) ON CONFLICT (telegram_id) DO NOTHING",
+                (user['telegram_id'], user['username'])
+            )
+            user_ids[user['id']] = conn.execute(
+                "SELECT id FROM users WHERE telegram_id = ?", (user['telegram_id'],)
+            ).fetchone()['id']
+
+        for table, _ in TABLES[2:]:
+            columns = [c for c in _columns(source, table) if c in set(_columns(conn, table))]
+            rows = [dict(row) for row in source.execute(f"SELECT {', '.join(columns)} FROM {table}")]
+            if table == 'registrations':
+                for row in rows:
+                    row['user_id'] = user_ids.get(row['user_id'])
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})", rows
+            )
+
+        tournament = dict(source.execute("SELECT * FROM tournaments").fetchone())
+        columns = [c for c in _columns(conn, 'tournaments') if c in tournament]
+        conn.execute(
+            f"INSERT INTO tournaments ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)}) "
+            f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns if c != 'id')}",
+            tournament
+        )
+
+        history = {}
+        for table, _ in RATING_TABLES:
+            columns = [c for c in _columns(source, table) if c != 'id']
+            rows = [dict(row) for row in source.execute(f"SELECT {', '.join(columns)} FROM {table}")] if columns else []
+            for row in rows:
+                for column in ('user_id', 'opponent_user_id'):
+                    if column in row:
+                        row[column] = user_ids.get(row[column])
+            history[table] = [row for row in rows if None not in row.values()]
+        restore_ratings(conn, tournament_id, history['rating_changes'], history['rating_credits'])
+    finally:
+        source.close()
+    refresh_tournament(conn, tournament_id)
+    return tournament_id
@@ -0,0 +1,141 @@
+"""Broadcast jobs: a message to one segment of a tournament's players, sent in the background.
+
+A job is a row in broadcasts. Its recipients are read from the segment's query QUEUE_CHUNK
+registrations at a time, in registration id order, and queued in the outbox, which the
+outbox worker drains. Each chunk is queued in the same transaction that advances the job's
+last_registration_id, so after a restart queueing continues where it stopped, and the
+outbox dedupe key (job and chat) makes queueing a chunk twice harmless.
+
+Statuses: 'queueing' -> 'sending' -> 'done', or 'cancelled' from either of the first two,
+or 'failed' when queueing breaks off with an error. Cancelling or failing drops the job's
+messages that are still waiting in the outbox.
+"""
+import time
+
+from .outbox import enqueue
+
+QUEUE_CHUNK = 1000
+
+# Segment -> condition on the registration r and its player_status row s. :arg is the
+# segment's argument: the round number or the character name.
+SEGMENTS = {
+    'all': "1",
+    'alive': "s.state IN ('registered', 'ready', 'waiting', 'champion')",
+    'unreported': "s.state = 'ready'",
+    # One EXISTS per side, so each is a lookup on the player's match index.
+    'round': (
+        "EXISTS (SELECT 1 FROM matches m WHERE m.player1_id = r.id AND m.round = :arg) "
+        "OR EXISTS (SELECT 1 FROM matches m WHERE m.player2_id = r.id AND m.round = :arg)"
+    ),
+    'character': "r.character_name = :arg",
+}
+
+RECIPIENTS_SQL = (
+    "FROM registrations r "
+    "JOIN users u ON r.user_id = u.id "
+    "LEFT JOIN player_status s ON s.registration_id = r.id "
+    "WHERE r.tournament_id = :tournament_id AND ({condition}) "
+)
+
+
+def count_recipients(conn, tournament_id: int, segment: str, arg) -> int:
+    return conn.execute(
+        "SELECT COUNT(*) " + RECIPIENTS_SQL.format(condition=SEGMENTS[segment]),
+        {'tournament_id': tournament_id, 'arg': arg}
+    ).fetchone()[0]
+
+
+def create_broadcast(conn, job: str, tournament_id: int, segment: str, arg, text: str, chat_id: int):
+    """Creates a job and returns its id, or None if a job with this key already exists."""
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO broadcasts (job, tournament_id, segment, segment_arg, text, chat_id, total, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (job, tournament_id, segment, arg, text, chat_id, count_recipients(conn, tournament_id, segment, arg),
+         time.time())
+    )
+    return cursor.lastrowid if cursor.rowcount else None
+
+
+def set_progress_message(conn, broadcast_id: int, message_id: int):
+    conn.execute("UPDATE broadcasts SET progress_message_id = ? WHERE id = ?", (message_id, broadcast_id))
+
+
+def queue_chunk(conn, broadcast_id: int) -> bool:
+    """Queues the next chunk of a job's recipients. Returns whether there is more to queue."""
+    broadcast = conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+    if broadcast['status'] != 'queueing':
+        return False
+    rows = conn.execute(
+        "SELECT r.id, u.telegram_id " + RECIPIENTS_SQL.format(condition=SEGMENTS[broadcast['segment']])
+        + "AND r.id > :after ORDER BY r.id LIMIT :limit",
+        {'tournament_id': broadcast['tournament_id'], 'arg': broadcast['segment_arg'],
+         'after': broadcast['last_registration_id'], 'limit': QUEUE_CHUNK}
+    ).fetchall()
+    job = broadcast['job']
+    queued = enqueue(
+        conn, ((row['telegram_id'], broadcast['text'], None, f"{job}:{row['telegram_id']}") for row in rows), job
+    )
+    more = len(rows) == QUEUE_CHUNK
+    conn.execute(
+        "UPDATE broadcasts SET last_registration_id = ?, queued = queued + ?, status = ? WHERE id = ?",
+        (rows[-1]['id'] if rows else broadcast['last_registration_id'], queued, 'queueing' if more else 'sending',
+         broadcast_id)
+    )
+    return more
+
+
+def progress(conn, broadcast_id: int) -> dict:
+    """The job's row with its title and how many of its messages are delivered, failed or still
+    waiting. Finishes a job whose messages have all been sent.
+    """
+    counts = dict(conn.execute(
+        "SELECT status, COUNT(*) FROM outbox WHERE job = (SELECT job FROM broadcasts WHERE id = ?) GROUP BY status",
+        (broadcast_id,)
+    ).fetchall())
+    waiting = counts.get('pending', 0) + counts.get('sending', 0)
+    if not waiting:
+        conn.execute(
+            "UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ? AND status = 'sending'",
+            (time.time(), broadcast_id)
+        )
+    broadcast = conn.execute(
+        "SELECT b.*, t.title FROM broadcasts b JOIN tournaments t ON b.tournament_id = t.id WHERE b.id = ?",
+        (broadcast_id,)
+    ).fetchone()
+    return {
+        **dict(broadcast), 'delivered': counts.get('delivered', 0), 'failed': counts.get('failed', 0),
+        'waiting': waiting,
+    }
+
+
+def _stop(conn, broadcast_id: int, status: str) -> bool:
+    if not conn.execute(
+        "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status IN ('queueing', 'sending')",
+        (status, time.time(), broadcast_id)
+    ).rowcount:
+        return False
+    conn.execute(
+        "DELETE FROM outbox WHERE job = (SELECT job FROM broadcasts WHERE id = ?) AND status = 'pending'",
+        (broadcast_id,)
+    )
+    return True
+
+
+def cancel_broadcast(conn, broadcast_id: int) -> bool:
+    """Stops a job and drops its messages that have not been sent yet. Returns False if the
+    job does not exist or is already over.
+    """
+    return _stop(conn, broadcast_id, 'cancelled')
+
+
+def fail_broadcast(conn, broadcast_id: int) -> bool:
+    """Marks a job whose queueing broke off as failed and drops its messages that have not been sent yet."""
+    return _stop(conn, broadcast_id, 'failed')
+
+
+def active_broadcasts(conn) -> list:
+    """Jobs that are still queueing or sending, oldest first."""
+    return conn.execute(
+        "SELECT b.id, b.segment, b.segment_arg, b.total, b.queued, t.title FROM broadcasts b "
+        "JOIN tournaments t ON b.tournament_id = t.id WHERE b.status IN ('queueing', 'sending') ORDER BY b.id"
+    ).fetchall()
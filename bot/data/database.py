@@ -1,70 +1,161 @@
+import asyncio
+import logging
 import sqlite3
-import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .migrations import apply_migrations
+from ..services import metrics
+
+logger = logging.getLogger(__name__)
 
 DB_FILE = "tournament.db"
 
+# Connection tuning applied once when the shared connection is opened.
+STATEMENT_CACHE_SIZE = 512
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+BUSY_TIMEOUT_MS = 5000
+# Start of the message of an IntegrityError raised by a UNIQUE constraint, followed by its columns.
+UNIQUE_FAILED = "UNIQUE constraint failed: "
+
+# All SQL runs on this single worker thread so the event loop never blocks on SQLite.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+# Long-lived connection owned by the database thread.
+_connection = None
+# Statements executed on the shared connection, for the metrics.
+_statements = 0
+
 def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
+    """Opens a new tuned connection to the SQLite database in autocommit mode."""
+    conn = sqlite3.connect(DB_FILE, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     return conn
 
-def initialize_database():
-    """Initializes the database and creates tables if they don't exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Table for users
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id BIGINT UNIQUE NOT NULL,
-        username TEXT
-    )
-    """)
-
-    # Table for admins
-    # Table for tournament status
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS tournament_status (
-        id INTEGER PRIMARY KEY,
-        registration_open BOOLEAN DEFAULT 0,
-        mode TEXT DEFAULT 'nickname'
-    )
-    """)
-    # Ensure there's always one row in tournament_status
-    cursor.execute("INSERT OR IGNORE INTO tournament_status (id) VALUES (1)")
-
-
-    # Table for registrations
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS registrations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        nickname TEXT UNIQUE NOT NULL,
-        character_name TEXT,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )
-    """)
-
-    # Table for matches
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS matches (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        round INTEGER NOT NULL,
-        player1_id INTEGER,
-        player2_id INTEGER,
-        winner_id INTEGER,
-        is_bye BOOLEAN DEFAULT 0,
-        FOREIGN KEY (player1_id) REFERENCES registrations(id),
-        FOREIGN KEY (player2_id) REFERENCES registrations(id),
-        FOREIGN KEY (winner_id) REFERENCES registrations(id)
-    )
-    """)
+def unique_columns(error: sqlite3.IntegrityError) -> set:
+    """The table.column names of the UNIQUE constraint a write broke, e.g. {'registrations.tournament_id',
+    'registrations.nickname'}, or an empty set if it broke another constraint.
+    """
+    message = str(error)
+    if not message.startswith(UNIQUE_FAILED):
+        return set()
+    return set(message[len(UNIQUE_FAILED):].split(", "))
+
+def _count_statement(sql):
+    global _statements
+    _statements += 1
 
+def _get_connection():
+    """Returns the shared connection, opening it on first use. Must be called on the database thread."""
+    global _connection
+    if _connection is None:
+        _connection = get_db_connection()
+        _connection.set_trace_callback(_count_statement)
+    return _connection
+
+def _close_connection():
+    """Closes the shared connection. Must be called on the database thread."""
+    global _connection
+    if _connection is not None:
+        _connection.execute("PRAGMA optimize")
+        _connection.close()
+        _connection = None
+
+def _run_transaction(func, *args):
+    """Runs func(conn, *args) in a transaction. Must be called on the database thread."""
+    conn = _get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        result = func(conn, *args)
+    except BaseException:
+        conn.rollback()
+        raise
     conn.commit()
-    conn.close()
+    return result
+
+def _run_query(func, *args):
+    """Runs func(conn, *args) outside of an explicit transaction. Must be called on the database thread."""
+    return func(_get_connection(), *args)
+
+def _measured(run, func, args):
+    """Calls run(func, *args) on the database thread. Returns (result, error, statements, seconds)."""
+    before = _statements
+    started = time.perf_counter()
+    try:
+        result, error = run(func, *args), None
+    except Exception as e:
+        result, error = None, e
+    return result, error, _statements - before, time.perf_counter() - started
+
+async def _run_on_db_thread(run, func, args):
+    # The handler name is read here: the database thread does not see the caller's context.
+    handler = metrics.current_handler.get()
+    loop = asyncio.get_running_loop()
+    result, error, statements, seconds = await loop.run_in_executor(_executor, _measured, run, func, args)
+    metrics.observe_sql(handler, statements, seconds)
+    if error is not None:
+        raise error
+    return result
 
-if __name__ == '__main__':
-    initialize_database()
-    print("Database initialized.")
+async def run_transaction(func, *args):
+    """Runs func(conn, *args) on the database thread and commits it as one transaction."""
+    return await _run_on_db_thread(_run_transaction, func, args)
+
+async def run_query(func, *args):
+    """Runs a read-only func(conn, *args) on the database thread."""
+    return await _run_on_db_thread(_run_query, func, args)
+
+def _enable_incremental_vacuum(conn):
+    """Switches the file to incremental auto-vacuum, so space freed by archiving can be returned
+    with reclaim_space(). An existing file needs one full VACUUM for that.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    logger.info("Switching %s to incremental auto-vacuum; this rewrites the file once.", DB_FILE)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def _reclaim_space(conn):
+    # execute() steps this pragma once, freeing one page; executescript() runs it to completion.
+    conn.executescript("PRAGMA incremental_vacuum;")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+async def open_database():
+    """Opens the shared connection and applies pending migrations. Called once at startup."""
+    await run_query(apply_migrations)
+    await run_query(_enable_incremental_vacuum)
+
+async def reclaim_space():
+    """Returns the free pages left by deleted rows to the file system and truncates the WAL."""
+    await run_query(_reclaim_space)
+
+async def close_database():
+    """Closes the shared connection. Called once at shutdown."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _close_connection)
+
+async def fetch_one(sql: str, params=()):
+    """Runs a query on the database thread and returns the first row or None."""
+    return await run_query(lambda conn: conn.execute(sql, params).fetchone())
+
+async def fetch_all(sql: str, params=()):
+    """Runs a query on the database thread and returns all rows."""
+    return await run_query(lambda conn: conn.execute(sql, params).fetchall())
+
+async def execute(sql: str, params=()) -> int:
+    """Runs a single write statement on the database thread and returns the affected row count."""
+    return await run_transaction(lambda conn: conn.execute(sql, params).rowcount)
+
+def initialize_database() -> list:
+    """Initializes the database by applying pending migrations. Returns the applied versions."""
+    conn = get_db_connection()
+    try:
+        return apply_migrations(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,42 @@
+"""Command-line entry point for schema migrations.
+
+Usage:
+    python -m bot.data.migrate            # apply pending migrations
+    python -m bot.data.migrate --status   # show current version and pending migrations
+"""
+import argparse
+
+from . import database
+from .migrations import apply_migrations, get_schema_version, pending_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or inspect database schema migrations.")
+    parser.add_argument("--db", default=database.DB_FILE, help="path to the SQLite database file")
+    parser.add_argument("--status", action="store_true", help="only show the schema version and pending migrations")
+    args = parser.parse_args()
+
+    database.DB_FILE = args.db
+    conn = database.get_db_connection()
+    try:
+        if args.status:
+            print(f"Schema version: {get_schema_version(conn)}")
+            pending = pending_migrations(conn)
+            if not pending:
+                print("No pending migrations.")
+            for version, description, _ in pending:
+                print(f"Pending: {version} - {description}")
+            return
+
+        applied = apply_migrations(conn)
+        if applied:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+        else:
+            print("Database is up to date.")
+        print(f"Schema version: {get_schema_version(conn)}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,581 @@
+"""Numbered schema migrations, applied in order and recorded in schema_migrations."""
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+
+def _baseline_schema(conn):
+    """Creates the original tables if they don't exist."""
+    # Table for users
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id BIGINT UNIQUE NOT NULL,
+        username TEXT
+    )
+    """)
+
+    # Table for tournament status
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tournament_status (
+        id INTEGER PRIMARY KEY,
+        registration_open BOOLEAN DEFAULT 0,
+        mode TEXT DEFAULT 'nickname'
+    )
+    """)
+    # Ensure there's always one row in tournament_status
+    conn.execute("INSERT OR IGNORE INTO tournament_status (id) VALUES (1)")
+
+    # Table for registrations
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        nickname TEXT UNIQUE NOT NULL,
+        character_name TEXT,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+
+    # Table for matches. A match where both players were disqualified has
+    # double_dq = 1 and no winner.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS matches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        round INTEGER NOT NULL,
+        player1_id INTEGER,
+        player2_id INTEGER,
+        winner_id INTEGER,
+        is_bye BOOLEAN DEFAULT 0,
+        double_dq BOOLEAN DEFAULT 0,
+        FOREIGN KEY (player1_id) REFERENCES registrations(id),
+        FOREIGN KEY (player2_id) REFERENCES registrations(id),
+        FOREIGN KEY (winner_id) REFERENCES registrations(id)
+    )
+    """)
+
+    # Databases created before migrations were introduced marked a double
+    # disqualification with winner_id = -1, which foreign-key enforcement rejects.
+    columns = [row['name'] for row in conn.execute("PRAGMA table_info(matches)")]
+    if 'double_dq' not in columns:
+        conn.execute("ALTER TABLE matches ADD COLUMN double_dq BOOLEAN DEFAULT 0")
+        conn.execute("UPDATE matches SET winner_id = NULL, double_dq = 1 WHERE winner_id = -1")
+
+
+def _hot_query_indexes(conn):
+    """Adds covering indexes for round scans, player lookups and registration checks."""
+    # Round completion counts, round listings and winner lookups per round.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_matches_round_result "
+        "ON matches (round, winner_id, double_dq, is_bye)"
+    )
+    # Open-match lookups for /my_status on either side of the pairing.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_matches_player1_open "
+        "ON matches (player1_id, winner_id, double_dq)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_matches_player2_open "
+        "ON matches (player2_id, winner_id, double_dq)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_registrations_user "
+        "ON registrations (user_id, nickname, character_name)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_registrations_character "
+        "ON registrations (character_name)"
+    )
+    conn.execute("ANALYZE")
+
+
+def _outbox(conn):
+    """Adds the persistent outbox drained by the background delivery worker."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        reply_markup TEXT,
+        job TEXT NOT NULL,
+        dedupe_key TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        delivered_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+
+
+def _admin_consoles(conn):
+    """Tracks the single match-control message each admin gets per round."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS admin_consoles (
+        admin_id BIGINT NOT NULL,
+        round INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        page INTEGER NOT NULL DEFAULT 0,
+        selected_match_id INTEGER,
+        PRIMARY KEY (admin_id, round)
+    )
+    """)
+
+
+def _unique_characters(conn):
+    """Makes the database reject a second registration with the same character.
+
+    Duplicates that slipped in before the constraint existed keep the character only on the
+    earliest registration.
+    """
+    conn.execute(
+        "UPDATE registrations SET character_name = NULL "
+        "WHERE character_name IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM registrations WHERE character_name IS NOT NULL GROUP BY character_name)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_registrations_character")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_registrations_character_unique "
+        "ON registrations (character_name) WHERE character_name IS NOT NULL"
+    )
+
+
+def _bracket_tree(conn):
+    """Links every match to the match its winner advances to."""
+    conn.execute("ALTER TABLE matches ADD COLUMN next_match_id INTEGER REFERENCES matches(id)")
+    conn.execute("ALTER TABLE matches ADD COLUMN next_slot INTEGER")
+    conn.execute("ALTER TABLE matches ADD COLUMN pending_feeders INTEGER NOT NULL DEFAULT 0")
+
+
+def _tournaments(conn):
+    """Adds tournament entities and keys registrations, matches and consoles by tournament.
+
+    An existing single-event database becomes tournament 1. registrations is rebuilt
+    because its nickname column was unique across the whole database.
+    """
+    conn.execute("""
+    CREATE TABLE tournaments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        registration_open BOOLEAN NOT NULL DEFAULT 0,
+        mode TEXT NOT NULL DEFAULT 'nickname',
+        status TEXT NOT NULL DEFAULT 'registration',
+        created_at REAL NOT NULL
+    )
+    """)
+    has_matches = conn.execute("SELECT 1 FROM matches LIMIT 1").fetchone() is not None
+    has_registrations = conn.execute("SELECT 1 FROM registrations LIMIT 1").fetchone() is not None
+    status = conn.execute("SELECT registration_open, mode FROM tournament_status WHERE id = 1").fetchone()
+    if has_matches or has_registrations or (status and status['registration_open']):
+        conn.execute(
+            "INSERT INTO tournaments (id, title, registration_open, mode, status, created_at) VALUES (1, ?, ?, ?, ?, ?)",
+            ("Турнир 1", status['registration_open'] if status else 0, status['mode'] if status else 'nickname',
+             'running' if has_matches else 'registration', time.time())
+        )
+    conn.execute("DROP TABLE tournament_status")
+
+    conn.execute("""
+    CREATE TABLE registrations_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tournament_id INTEGER NOT NULL,
+        user_id INTEGER,
+        nickname TEXT NOT NULL,
+        character_name TEXT,
+        UNIQUE (tournament_id, nickname),
+        FOREIGN KEY (tournament_id) REFERENCES tournaments(id),
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )
+    """)
+    conn.execute(
+        "INSERT INTO registrations_new (id, tournament_id, user_id, nickname, character_name) "
+        "SELECT id, 1, user_id, nickname, character_name FROM registrations"
+    )
+    conn.execute("DROP TABLE registrations")
+    conn.execute("ALTER TABLE registrations_new RENAME TO registrations")
+    conn.execute(
+        "CREATE INDEX idx_registrations_user "
+        "ON registrations (user_id, tournament_id, nickname, character_name)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_registrations_character_unique "
+        "ON registrations (tournament_id, character_name) WHERE character_name IS NOT NULL"
+    )
+
+    conn.execute("ALTER TABLE matches ADD COLUMN tournament_id INTEGER REFERENCES tournaments(id)")
+    conn.execute("UPDATE matches SET tournament_id = 1")
+    conn.execute("DROP INDEX IF EXISTS idx_matches_round_result")
+    conn.execute(
+        "CREATE INDEX idx_matches_tournament_round "
+        "ON matches (tournament_id, round, winner_id, double_dq, is_bye)"
+    )
+
+    conn.execute("""
+    CREATE TABLE admin_consoles_new (
+        tournament_id INTEGER NOT NULL,
+        admin_id BIGINT NOT NULL,
+        round INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        page INTEGER NOT NULL DEFAULT 0,
+        selected_match_id INTEGER,
+        PRIMARY KEY (tournament_id, admin_id, round)
+    )
+    """)
+    if has_matches:
+        conn.execute(
+            "INSERT INTO admin_consoles_new (tournament_id, admin_id, round, message_id, page, selected_match_id) "
+            "SELECT 1, admin_id, round, message_id, page, selected_match_id FROM admin_consoles"
+        )
+    conn.execute("DROP TABLE admin_consoles")
+    conn.execute("ALTER TABLE admin_consoles_new RENAME TO admin_consoles")
+    conn.execute("ANALYZE")
+
+
+def _persistence(conn):
+    """Stores conversation states and user_data so restarts don't interrupt conversations."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS persistent_conversations (
+        name TEXT NOT NULL,
+        conversation_key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (name, conversation_key)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS persistent_user_data (
+        user_id BIGINT PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    """)
+
+
+def _player_status_v9(player_id: int, matches: list) -> tuple:
+    """Derives (state, match_id, round, opponent, path) as player_status did when migration 9 was written."""
+    path = []
+    for match in matches:
+        opponent = match['p2_nick'] if match['player1_id'] == player_id else match['p1_nick']
+        if match['double_dq']:
+            path.append([match['round'], 'dq', opponent])
+            return 'eliminated', None, None, None, path
+        if match['winner_id'] is None:
+            state = 'waiting' if match['pending_feeders'] or opponent is None else 'ready'
+            return state, match['id'], match['round'], opponent, path
+        if match['is_bye']:
+            path.append([match['round'], 'bye', None])
+        elif match['winner_id'] == player_id:
+            path.append([match['round'], 'win', opponent])
+        else:
+            path.append([match['round'], 'loss', opponent])
+            return 'eliminated', None, None, None, path
+        if match['next_match_id'] is None:
+            return 'champion', None, None, None, path
+    return 'registered', None, None, None, path
+
+
+def _player_status(conn):
+    """Adds the materialized per-player status read by /my_status and fills it for existing tournaments."""
+    conn.execute("""
+    CREATE TABLE player_status (
+        registration_id INTEGER PRIMARY KEY REFERENCES registrations(id),
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+        telegram_id BIGINT NOT NULL,
+        tournament_title TEXT NOT NULL,
+        nickname TEXT NOT NULL,
+        character_name TEXT,
+        state TEXT NOT NULL,
+        match_id INTEGER,
+        round INTEGER,
+        opponent TEXT,
+        path TEXT NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_player_status_telegram ON player_status (telegram_id, tournament_id)")
+
+    players = conn.execute(
+        "SELECT r.id, r.tournament_id, r.nickname, r.character_name, u.telegram_id, t.title "
+        "FROM registrations r JOIN users u ON r.user_id = u.id JOIN tournaments t ON r.tournament_id = t.id"
+    ).fetchall()
+    by_player = {player['id']: [] for player in players}
+    for match in conn.execute(
+        "SELECT m.id, m.round, m.player1_id, m.player2_id, m.winner_id, m.double_dq, m.is_bye, "
+        "m.pending_feeders, m.next_match_id, p1.nickname AS p1_nick, p2.nickname AS p2_nick "
+        "FROM matches m "
+        "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
+        "LEFT JOIN registrations p2 ON m.player2_id = p2.id"
+    ):
+        for column in ('player1_id', 'player2_id'):
+            if match[column] in by_player:
+                by_player[match[column]].append(match)
+    rows = []
+    for player in players:
+        matches = sorted(by_player[player['id']], key=lambda m: m['round'])
+        state, match_id, round_num, opponent, path = _player_status_v9(player['id'], matches)
+        rows.append((
+            player['id'], player['tournament_id'], player['telegram_id'], player['title'], player['nickname'],
+            player['character_name'], state, match_id, round_num, opponent, json.dumps(path, ensure_ascii=False)
+        ))
+    conn.executemany(
+        "INSERT INTO player_status (registration_id, tournament_id, telegram_id, tournament_title, nickname, "
+        "character_name, state, match_id, round, opponent, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+
+def _formats(conn):
+    """Adds per-tournament formats: double-elimination loser edges, Swiss standings and the stored champion.
+
+    Existing tournaments are all single elimination, whose player_status rows migration 9
+    already filled; only their champion is backfilled.
+    """
+    conn.execute("ALTER TABLE tournaments ADD COLUMN format TEXT NOT NULL DEFAULT 'single'")
+    conn.execute("ALTER TABLE tournaments ADD COLUMN swiss_rounds INTEGER")
+    conn.execute("ALTER TABLE tournaments ADD COLUMN champion_id INTEGER REFERENCES registrations(id)")
+    conn.execute("ALTER TABLE matches ADD COLUMN bracket TEXT NOT NULL DEFAULT 'winners'")
+    conn.execute("ALTER TABLE matches ADD COLUMN loser_next_match_id INTEGER REFERENCES matches(id)")
+    conn.execute("ALTER TABLE matches ADD COLUMN loser_next_slot INTEGER")
+    conn.execute("""
+    CREATE TABLE standings (
+        registration_id INTEGER PRIMARY KEY REFERENCES registrations(id),
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+        seed INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        byes INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    conn.execute("CREATE INDEX idx_standings_rank ON standings (tournament_id, points DESC, seed)")
+    conn.execute(
+        "UPDATE tournaments SET champion_id = ("
+        "SELECT winner_id FROM matches WHERE matches.tournament_id = tournaments.id AND next_match_id IS NULL "
+        "ORDER BY round DESC LIMIT 1) WHERE status = 'finished'"
+    )
+
+
+def _ratings(conn):
+    """Adds cross-tournament ratings and rating-based seeding, and rates the matches already played.
+
+    Past matches are replayed in id order. A win by disqualification cannot be told from a
+    reported win in old rows, so both are rated.
+    """
+    conn.execute("ALTER TABLE tournaments ADD COLUMN seeding TEXT NOT NULL DEFAULT 'random'")
+    conn.execute("""
+    CREATE TABLE player_ratings (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id),
+        name TEXT NOT NULL,
+        rating REAL NOT NULL,
+        matches INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        tournaments INTEGER NOT NULL DEFAULT 0,
+        titles INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_player_ratings_rating ON player_ratings (rating DESC) WHERE matches > 0")
+    conn.execute("""
+    CREATE TABLE rating_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+        match_id INTEGER NOT NULL,
+        opponent_user_id INTEGER NOT NULL REFERENCES users(id),
+        won BOOLEAN NOT NULL,
+        rating_before REAL NOT NULL,
+        rating_after REAL NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_rating_changes_user ON rating_changes (user_id, id)")
+
+    # The rating rules of this version, frozen: everyone starts at 1500 and a match moves at most 32 points.
+    now = time.time()
+    conn.execute(
+        "INSERT INTO player_ratings (user_id, name, rating, tournaments, updated_at) "
+        "SELECT user_id, nickname, 1500, tournaments, ? FROM ("
+        "SELECT r.user_id, r.nickname, MIN(r.tournament_id), COUNT(*) AS tournaments FROM registrations r "
+        "JOIN tournaments t ON r.tournament_id = t.id "
+        "WHERE t.status != 'registration' AND r.user_id IS NOT NULL GROUP BY r.user_id)",
+        (now,)
+    )
+    matches = conn.execute(
+        "SELECT m.id, m.tournament_id, w.user_id AS winner, w.nickname AS winner_name, "
+        "l.user_id AS loser, l.nickname AS loser_name FROM matches m "
+        "JOIN registrations w ON w.id = m.winner_id "
+        "JOIN registrations l ON l.id = CASE WHEN m.winner_id = m.player1_id THEN m.player2_id ELSE m.player1_id END "
+        "WHERE m.winner_id IS NOT NULL AND m.player2_id IS NOT NULL AND m.is_bye = 0 "
+        "AND w.user_id IS NOT NULL AND l.user_id IS NOT NULL ORDER BY m.id"
+    ).fetchall()
+    for match in matches:
+        conn.executemany(
+            "INSERT OR IGNORE INTO player_ratings (user_id, name, rating, updated_at) VALUES (?, ?, 1500, ?)",
+            [(match['winner'], match['winner_name'], now), (match['loser'], match['loser_name'], now)]
+        )
+        winner_before, loser_before = (
+            conn.execute("SELECT rating FROM player_ratings WHERE user_id = ?", (user_id,)).fetchone()[0]
+            for user_id in (match['winner'], match['loser'])
+        )
+        change = 32 * (1 - 1 / (1 + 10 ** ((loser_before - winner_before) / 400)))
+        conn.executemany(
+            "UPDATE player_ratings SET rating = rating + ?, name = ?, matches = matches + 1, "
+            "wins = wins + ?, losses = losses + ?, updated_at = ? WHERE user_id = ?",
+            [(change, match['winner_name'], 1, 0, now, match['winner']),
+             (-change, match['loser_name'], 0, 1, now, match['loser'])]
+        )
+        conn.executemany(
+            "INSERT INTO rating_changes (user_id, tournament_id, match_id, opponent_user_id, won, rating_before, "
+            "rating_after, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(match['winner'], match['tournament_id'], match['id'], match['loser'], 1, winner_before,
+              winner_before + change, now),
+             (match['loser'], match['tournament_id'], match['id'], match['winner'], 0, loser_before,
+              loser_before - change, now)]
+        )
+    conn.execute(
+        "UPDATE player_ratings SET titles = (SELECT COUNT(*) FROM tournaments t "
+        "JOIN registrations r ON r.id = t.champion_id WHERE r.user_id = player_ratings.user_id)"
+    )
+
+
+def _broadcasts(conn):
+    """Adds broadcast jobs, which queue a segment's players into the outbox chunk by chunk."""
+    conn.execute("""
+    CREATE TABLE broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job TEXT UNIQUE NOT NULL,
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+        segment TEXT NOT NULL,
+        segment_arg TEXT,
+        text TEXT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        progress_message_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'queueing',
+        last_registration_id INTEGER NOT NULL DEFAULT 0,
+        total INTEGER NOT NULL DEFAULT 0,
+        queued INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        finished_at REAL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_outbox_job ON outbox (job, status)")
+
+
+def _rating_credits(conn):
+    """Records which tournaments and titles the rating totals count, so a reset or restore can
+    take a tournament back out of them. Credits are backfilled from the live tournaments;
+    archived ones have no rows left to read them from.
+    """
+    conn.execute("""
+    CREATE TABLE rating_credits (
+        tournament_id INTEGER NOT NULL REFERENCES tournaments(id),
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        kind TEXT NOT NULL,
+        PRIMARY KEY (tournament_id, user_id, kind)
+    )
+    """)
+    conn.execute("CREATE INDEX idx_rating_changes_tournament ON rating_changes (tournament_id)")
+    conn.execute(
+        "INSERT OR IGNORE INTO rating_credits (tournament_id, user_id, kind) "
+        "SELECT r.tournament_id, r.user_id, 'tournament' FROM registrations r "
+        "JOIN tournaments t ON r.tournament_id = t.id WHERE t.status != 'registration' AND r.user_id IS NOT NULL"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO rating_credits (tournament_id, user_id, kind) "
+        "SELECT t.id, r.user_id, 'title' FROM tournaments t "
+        "JOIN registrations r ON r.id = t.champion_id WHERE r.user_id IS NOT NULL"
+    )
+
+
+
+def _unique_registrations(conn):
+    """Makes the database reject a second registration of the same account in a tournament.
+
+    Duplicates that slipped in before the constraint existed keep the account only on the
+    earliest registration; the later ones stay in the bracket without it.
+    """
+    conn.execute(
+        "UPDATE registrations SET user_id = NULL "
+        "WHERE user_id IS NOT NULL AND id NOT IN ("
+        "SELECT MIN(id) FROM registrations WHERE user_id IS NOT NULL GROUP BY tournament_id, user_id)"
+    )
+    conn.execute(
+        "CREATE UNIQUE INDEX idx_registrations_user_unique "
+        "ON registrations (tournament_id, user_id) WHERE user_id IS NOT NULL"
+    )
+
+
+# (version, description, function). Append new migrations; never renumber or edit applied ones.
+MIGRATIONS = [
+    (1, "baseline schema", _baseline_schema),
+    (2, "indexes for hot queries", _hot_query_indexes),
+    (3, "notification outbox", _outbox),
+    (4, "admin match consoles", _admin_consoles),
+    (5, "one registration per character", _unique_characters),
+    (6, "single-elimination bracket tree", _bracket_tree),
+    (7, "multiple tournaments", _tournaments),
+    (8, "conversation and user_data persistence", _persistence),
+    (9, "materialized player status", _player_status),
+    (10, "Swiss and double-elimination formats", _formats),
+    (11, "cross-tournament ratings", _ratings),
+    (12, "segmented broadcast jobs", _broadcasts),
+    (13, "rating credits per tournament", _rating_credits),
+    (14, "one registration per account and tournament", _unique_registrations),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+
+
+def get_schema_version(conn) -> int:
+    """Returns the highest applied migration version, or 0 for an empty database."""
+    _ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_migrations").fetchone()
+    return row['version'] or 0
+
+
+def pending_migrations(conn) -> list:
+    """Returns the migrations that have not been applied yet."""
+    current = get_schema_version(conn)
+    return [m for m in MIGRATIONS if m[0] > current]
+
+
+def apply_migrations(conn) -> list:
+    """Applies pending migrations, each in its own transaction, and returns their versions.
+
+    The connection must be in autocommit mode (isolation_level=None). Foreign keys are
+    switched off while migrating so tables can be rebuilt, and every migration is checked
+    for violations before it commits.
+    """
+    applied = []
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, description, migrate in pending_migrations(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(conn)
+                violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError(
+                        f"Migration {version} leaves {len(violations)} foreign key violations, e.g. {tuple(violations[0])}"
+                    )
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now(timezone.utc).isoformat())
+                )
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            applied.append(version)
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    return applied
@@ -0,0 +1,67 @@
+"""Persistent queue of outgoing messages.
+
+Handlers call enqueue() inside the same transaction that changes tournament data, so a
+message is queued if and only if the change is committed. The background worker in
+bot/services/outbox_worker.py claims due rows, sends them and records the outcome.
+Each row may carry a dedupe_key; enqueueing the same key twice is a no-op.
+
+Statuses: 'pending' -> 'sending' -> 'delivered' or 'failed' (or back to 'pending' for a retry).
+"""
+import time
+
+# Delivered rows are kept this long so dedupe keys keep protecting against re-enqueueing.
+DELIVERED_RETENTION = 7 * 24 * 3600
+
+
+def enqueue(conn, messages, job: str) -> int:
+    """Queues (chat_id, text, reply_markup_json, dedupe_key) messages and returns how many were new."""
+    now = time.time()
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT OR IGNORE INTO outbox (chat_id, text, reply_markup, job, dedupe_key, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((chat_id, text, reply_markup, job, dedupe_key, now) for chat_id, text, reply_markup, dedupe_key in messages)
+    )
+    return conn.total_changes - before
+
+
+def claim_batch(conn, limit: int, now: float) -> list:
+    """Marks up to `limit` due messages as being sent and returns them."""
+    rows = conn.execute(
+        "SELECT id, chat_id, text, reply_markup, job, attempts FROM outbox "
+        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (now, limit)
+    ).fetchall()
+    conn.executemany(
+        "UPDATE outbox SET status = 'sending', attempts = attempts + 1 WHERE id = ?",
+        ((row['id'],) for row in rows)
+    )
+    return rows
+
+
+def record_results(conn, delivered: list, retries: list, failed: list, now: float):
+    """Stores the outcome of a batch.
+
+    delivered: ids; retries: (id, error, retry_at); failed: (id, error).
+    """
+    conn.executemany(
+        "UPDATE outbox SET status = 'delivered', delivered_at = ?, last_error = NULL WHERE id = ?",
+        ((now, outbox_id) for outbox_id in delivered)
+    )
+    conn.executemany(
+        "UPDATE outbox SET status = 'pending', last_error = ?, next_attempt_at = ? WHERE id = ?",
+        ((error, retry_at, outbox_id) for outbox_id, error, retry_at in retries)
+    )
+    conn.executemany(
+        "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+        ((error, outbox_id) for outbox_id, error in failed)
+    )
+
+
+def requeue_interrupted(conn) -> int:
+    """Returns messages left in 'sending' by a crash to the queue and purges old delivered rows."""
+    conn.execute(
+        "DELETE FROM outbox WHERE status = 'delivered' AND delivered_at < ?",
+        (time.time() - DELIVERED_RETENTION,)
+    )
+    return conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'").rowcount
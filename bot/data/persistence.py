@@ -0,0 +1,159 @@
+"""PTB persistence backed by the bot's SQLite database.
+
+Stores the states of persistent ConversationHandlers and user_data, so a user who is
+halfway through /register continues where they left off after a restart or redeploy.
+
+The Application hands over everything that changed every FLUSH_INTERVAL seconds, all at
+once. The update_* calls only buffer the changes; one write per batch then stores them in
+a single transaction on the database thread. flush() writes whatever is left when the
+Application shuts down, before the database is closed.
+"""
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .database import open_database, run_query, run_transaction
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two batches. A restart loses at most this much conversation progress.
+FLUSH_INTERVAL = 5
+
+
+def _read_all(conn):
+    conversations = conn.execute("SELECT name, conversation_key, state FROM persistent_conversations").fetchall()
+    user_data = conn.execute("SELECT user_id, data FROM persistent_user_data").fetchall()
+    return conversations, user_data
+
+
+def _write(conn, conversations: dict, user_data: dict):
+    """Upserts or deletes the buffered rows. A value of None means delete."""
+    conn.executemany(
+        "DELETE FROM persistent_conversations WHERE name = ? AND conversation_key = ?",
+        [key for key, state in conversations.items() if state is None]
+    )
+    conn.executemany(
+        "INSERT INTO persistent_conversations (name, conversation_key, state) VALUES (?, ?, ?) "
+        "ON CONFLICT (name, conversation_key) DO UPDATE SET state = excluded.state",
+        [(*key, state) for key, state in conversations.items() if state is not None]
+    )
+    conn.executemany(
+        "DELETE FROM persistent_user_data WHERE user_id = ?",
+        [(user_id,) for user_id, data in user_data.items() if data is None]
+    )
+    conn.executemany(
+        "INSERT INTO persistent_user_data (user_id, data) VALUES (?, ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data",
+        [(user_id, data) for user_id, data in user_data.items() if data is not None]
+    )
+
+
+class SQLitePersistence(BasePersistence):
+    """Persists conversations and user_data; chat_data, bot_data and callback data are not stored."""
+
+    def __init__(self, update_interval: float = FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._conversations = None
+        self._user_data = None
+        self._load_lock = asyncio.Lock()
+        # Changes not written yet, keyed like the tables; None marks a deletion.
+        self._pending_conversations = {}
+        self._pending_user_data = {}
+        self._write_task = None
+
+    async def _load(self):
+        # The Application loads persistence before post_init opens the database, so make
+        # sure the tables exist first.
+        async with self._load_lock:
+            if self._conversations is not None:
+                return
+            await open_database()
+            conversations, user_data = await run_query(_read_all)
+            self._conversations = {}
+            for row in conversations:
+                key = tuple(json.loads(row['conversation_key']))
+                self._conversations.setdefault(row['name'], {})[key] = json.loads(row['state'])
+            self._user_data = {row['user_id']: json.loads(row['data']) for row in user_data}
+
+    def _schedule_write(self):
+        # The Application calls all update_* methods of one batch together; a task started
+        # now runs after all of them have buffered their changes.
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        while self._pending_conversations or self._pending_user_data:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            try:
+                await run_transaction(_write, conversations, user_data)
+            except Exception:
+                logger.exception("Failed to write persistence batch; keeping it for the next one")
+                # Newer changes buffered meanwhile win over the failed ones.
+                self._pending_conversations = {**conversations, **self._pending_conversations}
+                self._pending_user_data = {**user_data, **self._pending_user_data}
+                return
+
+    async def get_conversations(self, name: str) -> dict:
+        await self._load()
+        return dict(self._conversations.get(name, {}))
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))] = (
+            None if new_state is None else json.dumps(new_state)
+        )
+        self._schedule_write()
+
+    async def get_user_data(self) -> dict:
+        await self._load()
+        return {user_id: dict(data) for user_id, data in self._user_data.items()}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._pending_user_data[user_id] = json.dumps(data) if data else None
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+
+    # chat_data, bot_data and callback data are not stored.
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
@@ -0,0 +1,130 @@
+"""Materialized per-player status behind /my_status.
+
+player_status has one row per registration, keyed for lookup by Telegram id. It holds the
+player's current match, round and opponent, whether they are still in the tournament,
+and their path through the bracket so far. Everything that changes the bracket refreshes
+the rows of the players it touched, in the same transaction, so /my_status is a single
+indexed read.
+
+States: 'registered' (no bracket yet), 'ready' (opponent known), 'waiting' (opponent
+not decided yet, or in Swiss the next round not paired yet, with no match), 'eliminated',
+'finished' (a Swiss tournament is over) and 'champion'.
+Path entries are [round, result, opponent], result being 'win', 'loss', 'bye' or 'dq'.
+"""
+import json
+
+PLAYERS_SQL = (
+    "SELECT r.id, r.tournament_id, r.nickname, r.character_name, u.telegram_id, t.title, "
+    "t.format, t.status, t.champion_id "
+    "FROM registrations r "
+    "JOIN users u ON r.user_id = u.id "
+    "JOIN tournaments t ON r.tournament_id = t.id "
+)
+
+MATCHES_SQL = (
+    "SELECT m.id, m.round, m.bracket, m.player1_id, m.player2_id, m.winner_id, m.double_dq, m.is_bye, "
+    "m.pending_feeders, p1.nickname AS p1_nick, p2.nickname AS p2_nick "
+    "FROM matches m "
+    "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
+    "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
+)
+
+
+def _status(player, matches: list) -> tuple:
+    """Derives (state, match_id, round, opponent, path) from the player's matches in round order.
+
+    The first undecided match is the current one. In double elimination a loss is not the
+    end, so the whole path is walked; whether the player is out follows from the format.
+    """
+    path = []
+    for match in matches:
+        if match['player1_id'] == player['id']:
+            opponent = match['p2_nick']
+        else:
+            opponent = match['p1_nick']
+
+        if match['double_dq']:
+            path.append([match['round'], 'dq', opponent])
+        elif match['winner_id'] is None:
+            state = 'waiting' if match['pending_feeders'] or opponent is None else 'ready'
+            return state, match['id'], match['round'], opponent, path
+        elif match['is_bye']:
+            # A double-elimination reset that was not needed is not part of the path.
+            if match['bracket'] != 'reset':
+                path.append([match['round'], 'bye', None])
+        elif match['winner_id'] == player['id']:
+            path.append([match['round'], 'win', opponent])
+        else:
+            path.append([match['round'], 'loss', opponent])
+
+    if not matches:
+        state = 'registered'
+    elif player['champion_id'] == player['id']:
+        state = 'champion'
+    elif player['format'] == 'swiss' and path[-1][1] != 'dq':
+        # A double DQ takes a Swiss player out of the later rounds.
+        state = 'finished' if player['status'] == 'finished' else 'waiting'
+    else:
+        state = 'eliminated'
+    return state, None, None, None, path
+
+
+def _store(conn, players: list, matches):
+    by_player = {player['id']: [] for player in players}
+    for match in matches:
+        for column in ('player1_id', 'player2_id'):
+            if match[column] in by_player:
+                by_player[match[column]].append(match)
+
+    rows = []
+    for player in players:
+        player_matches = sorted(by_player[player['id']], key=lambda m: (m['round'], m['id']))
+        state, match_id, round_num, opponent, path = _status(player, player_matches)
+        rows.append((
+            player['id'], player['tournament_id'], player['telegram_id'], player['title'], player['nickname'],
+            player['character_name'], state, match_id, round_num, opponent, json.dumps(path, ensure_ascii=False)
+        ))
+    conn.executemany(
+        "INSERT INTO player_status (registration_id, tournament_id, telegram_id, tournament_title, nickname, "
+        "character_name, state, match_id, round, opponent, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (registration_id) DO UPDATE SET state = excluded.state, match_id = excluded.match_id, "
+        "round = excluded.round, opponent = excluded.opponent, path = excluded.path",
+        rows
+    )
+
+
+def refresh_players(conn, registration_ids):
+    """Recomputes the status of the given registrations from their matches."""
+    ids = json.dumps(sorted(set(i for i in registration_ids if i is not None)))
+    players = conn.execute(PLAYERS_SQL + "WHERE r.id IN (SELECT value FROM json_each(?))", (ids,)).fetchall()
+    if not players:
+        return
+    matches = conn.execute(
+        MATCHES_SQL + "WHERE m.player1_id IN (SELECT value FROM json_each(?)) "
+        "UNION " + MATCHES_SQL + "WHERE m.player2_id IN (SELECT value FROM json_each(?))",
+        (ids, ids)
+    ).fetchall()
+    _store(conn, players, matches)
+
+
+def refresh_tournament(conn, tournament_id: int):
+    """Recomputes the status of every player of a tournament, e.g. after its bracket was built."""
+    players = conn.execute(PLAYERS_SQL + "WHERE r.tournament_id = ?", (tournament_id,)).fetchall()
+    if not players:
+        return
+    matches = conn.execute(MATCHES_SQL + "WHERE m.tournament_id = ?", (tournament_id,)).fetchall()
+    _store(conn, players, matches)
+
+
+def refresh_matches(conn, match_ids):
+    """Recomputes the status of everyone playing in the given matches."""
+    rows = conn.execute(
+        "SELECT player1_id, player2_id FROM matches WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(sorted(match_ids)),)
+    ).fetchall()
+    refresh_players(conn, [player for row in rows for player in row])
+
+
+def delete_tournament(conn, tournament_id: int):
+    """Removes the status rows of a tournament, before its registrations are deleted."""
+    conn.execute("DELETE FROM player_status WHERE tournament_id = ?", (tournament_id,))
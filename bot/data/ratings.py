@@ -0,0 +1,180 @@
+"""Permanent Elo ratings and career statistics across tournaments.
+
+player_ratings has one row per user (users.id, so per Telegram account) with their
+rating and pre-aggregated totals: rated matches, wins, losses, tournaments started and
+titles. rating_changes keeps every rating change with its match, and rating_credits the
+tournaments and titles the totals count. Neither table references matches or
+registrations, so the history outlives an archived tournament.
+
+Only matches decided by a reported win are rated; byes and disqualifications change
+nothing. Every function runs inside the transaction that records the result. A reset or
+a restore replaces a tournament's results, so it first takes the tournament's changes and
+credits back out of the totals with revert_tournament; a restore then puts the snapshot's
+back with restore_ratings. Other tournaments' matches rated since keep their changes.
+/leaderboard is a single read of the rating index.
+"""
+import json
+import time
+
+INITIAL_RATING = 1500
+K_FACTOR = 32
+
+# rating_credits kind -> the player_ratings total it counts.
+CREDIT_COLUMNS = {'tournament': 'tournaments', 'title': 'titles'}
+
+PLAYERS_SQL = (
+    "SELECT r.id, r.user_id, r.nickname FROM registrations r "
+    "WHERE r.id IN (?, ?) AND r.user_id IS NOT NULL"
+)
+
+
+def expected_score(rating: float, opponent_rating: float) -> float:
+    """Probability of winning against the opponent under the Elo model."""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+def _ensure(conn, rows):
+    """Creates rating rows for (user_id, name) that don't have one yet."""
+    conn.executemany(
+        "INSERT INTO player_ratings (user_id, name, rating, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (user_id) DO NOTHING",
+        [(user_id, name, INITIAL_RATING, time.time()) for user_id, name in rows]
+    )
+
+
+def _credit(conn, tournament_id: int, kind: str, user_ids):
+    """Counts the tournament in the kind's total of each user, once per tournament."""
+    column = CREDIT_COLUMNS[kind]
+    for user_id in user_ids:
+        if conn.execute(
+            "INSERT INTO rating_credits (tournament_id, user_id, kind) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+            (tournament_id, user_id, kind)
+        ).rowcount:
+            conn.execute(f"UPDATE player_ratings SET {column} = {column} + 1 WHERE user_id = ?", (user_id,))
+
+
+def _add_totals(conn, tournament_id: int, sign: int):
+    """Adds (sign 1) or subtracts (sign -1) the tournament's rating changes and credits in player_ratings."""
+    conn.execute(
+        "UPDATE player_ratings SET rating = rating + :sign * c.change, matches = matches + :sign * c.played, "
+        "wins = wins + :sign * c.won, losses = losses + :sign * (c.played - c.won), updated_at = :now "
+        "FROM (SELECT user_id, SUM(rating_after - rating_before) AS change, COUNT(*) AS played, SUM(won) AS won "
+        "FROM rating_changes WHERE tournament_id = :tournament_id GROUP BY user_id) AS c "
+        "WHERE player_ratings.user_id = c.user_id",
+        {'sign': sign, 'now': time.time(), 'tournament_id': tournament_id}
+    )
+    for kind, column in CREDIT_COLUMNS.items():
+        conn.execute(
+            f"UPDATE player_ratings SET {column} = {column} + ? "
+            "WHERE user_id IN (SELECT user_id FROM rating_credits WHERE tournament_id = ? AND kind = ?)",
+            (sign, tournament_id, kind)
+        )
+
+
+def record_match(conn, tournament_id: int, match_id: int, winner_id: int, loser_id: int):
+    """Updates both players' ratings and totals after winner_id beat loser_id (registration ids)."""
+    players = {row['id']: row for row in conn.execute(PLAYERS_SQL, (winner_id, loser_id))}
+    if len(players) < 2:
+        return
+    winner, loser = players[winner_id], players[loser_id]
+    _ensure(conn, [(winner['user_id'], winner['nickname']), (loser['user_id'], loser['nickname'])])
+    ratings = {
+        row['user_id']: row['rating'] for row in conn.execute(
+            "SELECT user_id, rating FROM player_ratings WHERE user_id IN (?, ?)", (winner['user_id'], loser['user_id'])
+        )
+    }
+    winner_before, loser_before = ratings[winner['user_id']], ratings[loser['user_id']]
+    change = K_FACTOR * (1 - expected_score(winner_before, loser_before))
+
+    now = time.time()
+    conn.executemany(
+        "UPDATE player_ratings SET rating = rating + ?, name = ?, matches = matches + 1, "
+        "wins = wins + ?, losses = losses + ?, updated_at = ? WHERE user_id = ?",
+        [
+            (change, winner['nickname'], 1, 0, now, winner['user_id']),
+            (-change, loser['nickname'], 0, 1, now, loser['user_id']),
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO rating_changes (user_id, tournament_id, match_id, opponent_user_id, won, rating_before, "
+        "rating_after, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (winner['user_id'], tournament_id, match_id, loser['user_id'], 1, winner_before, winner_before + change, now),
+            (loser['user_id'], tournament_id, match_id, winner['user_id'], 0, loser_before, loser_before - change, now),
+        ]
+    )
+
+
+def record_participation(conn, tournament_id: int):
+    """Counts a started tournament for every registered player."""
+    rows = conn.execute(
+        "SELECT user_id, nickname FROM registrations WHERE tournament_id = ? AND user_id IS NOT NULL", (tournament_id,)
+    ).fetchall()
+    _ensure(conn, [(row['user_id'], row['nickname']) for row in rows])
+    _credit(conn, tournament_id, 'tournament', [row['user_id'] for row in rows])
+
+
+def record_title(conn, champion_id):
+    """Counts a tournament win for the champion's user."""
+    if champion_id is None:
+        return
+    champion = conn.execute(
+        "SELECT tournament_id, user_id FROM registrations WHERE id = ? AND user_id IS NOT NULL", (champion_id,)
+    ).fetchone()
+    if champion:
+        _credit(conn, champion['tournament_id'], 'title', [champion['user_id']])
+
+
+def revert_tournament(conn, tournament_id: int):
+    """Takes the tournament's rating changes, participation and title back out of the totals
+    and deletes their rows.
+    """
+    _add_totals(conn, tournament_id, -1)
+    conn.execute("DELETE FROM rating_changes WHERE tournament_id = ?", (tournament_id,))
+    conn.execute("DELETE FROM rating_credits WHERE tournament_id = ?", (tournament_id,))
+
+
+def restore_ratings(conn, tournament_id: int, changes: list, credits: list):
+    """Puts a restored tournament's rating changes and credits (dicts of their columns, with
+    live user ids) back and adds them to the totals. Expects revert_tournament to have run.
+    """
+    rows = conn.execute(
+        "SELECT user_id, nickname FROM registrations WHERE tournament_id = ? AND user_id IS NOT NULL", (tournament_id,)
+    ).fetchall()
+    _ensure(conn, [(row['user_id'], row['nickname']) for row in rows])
+    conn.executemany(
+        "INSERT INTO rating_changes (user_id, tournament_id, match_id, opponent_user_id, won, rating_before, "
+        "rating_after, created_at) VALUES (:user_id, :tournament_id, :match_id, :opponent_user_id, :won, "
+        ":rating_before, :rating_after, :created_at)",
+        changes
+    )
+    conn.executemany(
+        "INSERT INTO rating_credits (tournament_id, user_id, kind) VALUES (:tournament_id, :user_id, :kind) "
+        "ON CONFLICT DO NOTHING",
+        credits
+    )
+    _add_totals(conn, tournament_id, 1)
+
+
+def order_by_rating(conn, player_ids: list) -> list:
+    """Sorts registration ids by their user's rating, best first. Unrated players count as
+    INITIAL_RATING; the sort is stable, so ties keep their incoming (shuffled) order.
+    """
+    ratings = {
+        row['id']: row['rating'] for row in conn.execute(
+            "SELECT r.id, COALESCE(p.rating, ?) AS rating FROM registrations r "
+            "LEFT JOIN player_ratings p ON p.user_id = r.user_id "
+            "WHERE r.id IN (SELECT value FROM json_each(?))",
+            (INITIAL_RATING, json.dumps(player_ids))
+        )
+    }
+    return sorted(player_ids, key=lambda player_id: -ratings.get(player_id, INITIAL_RATING))
+
+
+def leaderboard(conn, limit: int) -> list:
+    """The top rated players with their totals."""
+    return conn.execute(
+        "SELECT name, rating, matches, wins, losses, tournaments, titles FROM player_ratings "
+        "WHERE matches > 0 ORDER BY rating DESC LIMIT ?",
+        (limit,)
+    ).fetchall()
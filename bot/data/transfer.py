@@ -0,0 +1,276 @@
+"""Bulk import of registrations and export of registrations and match results, as CSV or JSON.
+
+Both directions stream. An import reads the file one row at a time and writes
+IMPORT_BATCH rows per transaction; an export reads EXPORT_BATCH rows per query, paging by
+id, and writes them out straight away. A file is never held in memory as a whole.
+
+Imported rows follow the rules of the /register conversation:
+- the tournament has not started
+- a nickname is unique within the tournament
+- a Telegram account registers once
+- in character mode every player needs a free character from config.CHARACTERS; in
+  nickname mode the character column is ignored
+A row that breaks a rule is skipped and reported with its number; the others are imported.
+
+Import columns: telegram_id, nickname, character (or character_name), optionally username.
+CSV files need a header row; JSON files hold an array of objects or one object per line.
+
+Usage (with the bot stopped, as the running bot does not see rows added behind its back;
+while it runs use /import):
+    python -m bot.data.transfer import <tournament_id> players.csv
+    python -m bot.data.transfer export <tournament_id> matches [--format json] [-o matches.json]
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+
+from config import CHARACTERS
+from . import database
+from .player_status import refresh_players
+
+IMPORT_BATCH = 1000
+EXPORT_BATCH = 1000
+FORMATS = ('csv', 'json')
+# Read size of the JSON parser; a row never needs more than one chunk and one object in memory.
+JSON_CHUNK = 64 * 1024
+# Characters between the JSON objects of an array or of JSON Lines.
+JSON_SEPARATORS = " \t\r\n,"
+
+EXPORTS = {
+    'registrations': (
+        ['id', 'telegram_id', 'username', 'nickname', 'character'],
+        "SELECT r.id, u.telegram_id, u.username, r.nickname, r.character_name FROM registrations r "
+        "LEFT JOIN users u ON r.user_id = u.id "
+        "WHERE r.tournament_id = ? AND r.id > ? ORDER BY r.id LIMIT ?"
+    ),
+    'matches': (
+        ['id', 'round', 'bracket', 'player1', 'player2', 'winner', 'status'],
+        "SELECT m.id, m.round, m.bracket, p1.nickname, p2.nickname, w.nickname, "
+        "CASE WHEN m.is_bye THEN 'bye' WHEN m.winner_id IS NOT NULL THEN 'finished' "
+        "WHEN m.double_dq THEN 'double_dq' WHEN m.pending_feeders > 0 THEN 'waiting' ELSE 'ready' END "
+        "FROM matches m "
+        "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
+        "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
+        "LEFT JOIN registrations w ON m.winner_id = w.id "
+        "WHERE m.tournament_id = ? AND m.id > ? ORDER BY m.id LIMIT ?"
+    ),
+}
+
+
+class TransferError(ValueError):
+    """An import that cannot go on: the tournament is missing or has started, or the file is not JSON."""
+
+
+def _json_rows(stream):
+    """Yields the objects of a JSON array or of JSON Lines, reading the stream in chunks."""
+    decoder = json.JSONDecoder()
+    buffer, position = "", 0
+    started = False
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_SEPARATORS:
+            position += 1
+        if position == len(buffer):
+            buffer, position = stream.read(JSON_CHUNK), 0
+            if not buffer:
+                return
+            continue
+        # The brackets of a top-level array; anything after its end is ignored.
+        if buffer[position] == '[' and not started:
+            started = True
+            position += 1
+            continue
+        if buffer[position] == ']':
+            return
+        started = True
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as e:
+            chunk = stream.read(JSON_CHUNK)
+            if not chunk:
+                raise TransferError(f"Файл не является JSON: {e.msg}.") from None
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield value
+
+
+def read_rows(stream, file_format: str):
+    """Yields (number, row) for every row of a CSV or JSON text stream. The number is the
+    line of a CSV row and the position of a JSON object.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        yield from enumerate(_json_rows(stream), start=1)
+
+
+def _registration(row, mode: str) -> tuple:
+    """Validates one imported row. Returns (telegram_id, username, nickname, character_name)
+    or raises ValueError with the reason.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("ожидался объект с полями telegram_id и nickname")
+    telegram_id = str(row.get('telegram_id') or '').strip()
+    if not telegram_id.isdigit():
+        raise ValueError("нет telegram_id или это не число")
+    nickname = str(row.get('nickname') or '').strip()
+    if not nickname:
+        raise ValueError("нет никнейма")
+    username = str(row.get('username') or '').strip().lstrip('@') or None
+
+    character_name = None
+    if mode == 'character':
+        character_name = str(row.get('character') or row.get('character_name') or '').strip()
+        if not character_name:
+            raise ValueError("нет персонажа")
+        if character_name not in CHARACTERS:
+            raise ValueError(f"персонажа «{character_name}» нет в списке")
+    return int(telegram_id), username, nickname, character_name
+
+
+def import_batch(conn, tournament_id: int, rows: list) -> tuple:
+    """Registers one batch of (number, row). Returns (imported, [(number, reason)] for the skipped rows).
+
+    Must run in a transaction; raises TransferError if the tournament is missing or has started.
+    """
+    tournament = conn.execute("SELECT status, mode FROM tournaments WHERE id = ?", (tournament_id,)).fetchone()
+    if tournament is None:
+        raise TransferError(f"Турнир с ID {tournament_id} не найден.")
+    if tournament['status'] != 'registration':
+        raise TransferError("Импортировать игроков можно только до начала турнира.")
+
+    errors = []
+    registered = []
+    for number, row in rows:
+        try:
+            telegram_id, username, nickname, character_name = _registration(row, tournament['mode'])
+        except ValueError as e:
+            errors.append((number, str(e)))
+            continue
+        conn.execute("INSERT OR IGNORE INTO users (telegram_id, username) VALUES (?, ?)", (telegram_id, username))
+        user_id = conn.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()['id']
+        try:
+            cursor = conn.execute(
+                "INSERT INTO registrations (tournament_id, user_id, nickname, character_name) VALUES (?, ?, ?, ?)",
+                (tournament_id, user_id, nickname, character_name)
+            )
+        except sqlite3.IntegrityError as e:
+            columns = database.unique_columns(e)
+            if 'registrations.user_id' in columns:
+                reason = "этот игрок уже зарегистрирован"
+            elif 'registrations.character_name' in columns:
+                reason = "персонаж уже занят"
+            elif 'registrations.nickname' in columns:
+                reason = "никнейм уже занят"
+            else:
+                raise
+            errors.append((number, reason))
+            continue
+        registered.append(cursor.lastrowid)
+    refresh_players(conn, registered)
+    return len(registered), errors
+
+
+def export_batch(conn, kind: str, tournament_id: int, after_id: int) -> list:
+    """The next EXPORT_BATCH rows of an export after the row with after_id, as tuples starting with the id."""
+    return [tuple(row) for row in conn.execute(EXPORTS[kind][1], (tournament_id, after_id, EXPORT_BATCH))]
+
+
+class ExportWriter:
+    """Writes exported rows to a text stream as CSV or as a JSON array of objects."""
+
+    def __init__(self, stream, kind: str, file_format: str):
+        self.stream = stream
+        self.columns = EXPORTS[kind][0]
+        self.file_format = file_format
+        self.count = 0
+        if file_format == 'csv':
+            self.csv = csv.writer(stream)
+            self.csv.writerow(self.columns)
+        else:
+            stream.write("[")
+
+    def write(self, rows: list):
+        for row in rows:
+            if self.file_format == 'csv':
+                self.csv.writerow(row)
+            else:
+                self.stream.write(",\n" if self.count else "\n")
+                json.dump(dict(zip(self.columns, row)), self.stream, ensure_ascii=False)
+            self.count += 1
+
+    def close(self):
+        if self.file_format == 'json':
+            self.stream.write("\n]\n" if self.count else "]\n")
+
+
+def _import_file(conn, tournament_id: int, path: str, file_format: str):
+    imported = skipped = 0
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        rows = read_rows(stream, file_format)
+        while True:
+            batch = [row for _, row in zip(range(IMPORT_BATCH), rows)]
+            if not batch:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                count, batch_errors = import_batch(conn, tournament_id, batch)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            imported += count
+            skipped += len(batch_errors)
+            for number, reason in batch_errors:
+                print(f"Skipped {number}: {reason}")
+    print(f"Imported {imported} registrations, skipped {skipped}.")
+
+
+def _export_file(conn, tournament_id: int, kind: str, file_format: str, stream):
+    writer = ExportWriter(stream, kind, file_format)
+    after_id = 0
+    while rows := export_batch(conn, kind, tournament_id, after_id):
+        writer.write(rows)
+        after_id = rows[-1][0]
+    writer.close()
+    return writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import registrations or export registrations and matches.")
+    parser.add_argument("--db", default=database.DB_FILE, help="path to the SQLite database file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="register players from a CSV or JSON file")
+    import_parser.add_argument("tournament_id", type=int)
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=FORMATS, help="file format; by default taken from the extension")
+    export_parser = commands.add_parser("export", help="write registrations or matches as CSV or JSON")
+    export_parser.add_argument("tournament_id", type=int)
+    export_parser.add_argument("kind", choices=list(EXPORTS))
+    export_parser.add_argument("--format", choices=FORMATS, default='csv')
+    export_parser.add_argument("-o", "--output", help="output file; standard output by default")
+    args = parser.parse_args()
+
+    database.DB_FILE = args.db
+    conn = database.get_db_connection()
+    try:
+        if args.command == 'import':
+            file_format = args.format or ('json' if args.file.lower().endswith(('.json', '.jsonl')) else 'csv')
+            _import_file(conn, args.tournament_id, args.file, file_format)
+        elif args.output:
+            with open(args.output, 'w', encoding='utf-8', newline='') as stream:
+                count = _export_file(conn, args.tournament_id, args.kind, args.format, stream)
+            print(f"Exported {count} {args.kind} to {args.output}.")
+        else:
+            _export_file(conn, args.tournament_id, args.kind, args.format, sys.stdout)
+    except TransferError as e:
+        raise SystemExit(str(e))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
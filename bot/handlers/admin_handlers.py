@@ -1,9 +1,16 @@
-import asyncio
+import time
 from functools import wraps
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from ..data.database import get_db_connection
-from config import ADMIN_IDS
+from ..data.broadcasts import (
+    SEGMENTS, active_broadcasts, cancel_broadcast as cancel_job, count_recipients, create_broadcast, progress,
+    set_progress_message,
+)
+from ..data.database import execute, run_query, run_transaction
+from ..services.broadcaster import progress_text, run_broadcast, segment_label
+from ..services.formats import FORMATS
+from ..services.tournament_state import add_tournament, get_tournament, resolve_tournament
+from config import ADMIN_IDS, CHARACTERS
 
 def is_admin(telegram_id: int) -> bool:
     """Checks if a user is an admin by checking against the ADMIN_IDS list in config.py."""
@@ -20,95 +27,222 @@ def admin_required(func):
         return await func(update, context, *args, **kwargs)
     return wrapped
 
+def tournament_command(command: str):
+    """Decorator that resolves the target tournament from the command arguments.
+
+    The handler is called with the TournamentState as a third argument.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            tournament, error = resolve_tournament(context.args, command)
+            if error:
+                await update.message.reply_text(error)
+                return
+            return await func(update, context, tournament, *args, **kwargs)
+        return wrapped
+    return decorator
+
+def _create_tournament(conn, title: str) -> int:
+    return conn.execute(
+        "INSERT INTO tournaments (title, created_at) VALUES (?, ?)", (title, time.time())
+    ).lastrowid
+
+@admin_required
+async def new_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Creates a new tournament."""
+    title = " ".join(context.args)
+    if not title:
+        await update.message.reply_text("Использование: /new_tournament <название>")
+        return
+
+    tournament_id = await run_transaction(_create_tournament, title)
+    add_tournament(tournament_id, title)
+    await update.message.reply_text(
+        f"Турнир «{title}» создан. ID турнира: {tournament_id}.\n"
+        f"Откройте регистрацию командой /open_registration {tournament_id}"
+    )
+
 @admin_required
-async def open_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@tournament_command("open_registration")
+async def open_registration(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
     """Opens tournament registration."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
+    if tournament.status == 'archived':
+        await update.message.reply_text(
+            f"Турнир «{tournament.title}» в архиве. Верните его командой /restore {tournament.id}."
+        )
         return
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tournament_status SET registration_open = 1 WHERE id = 1")
-    conn.commit()
-    cursor.close()
-    conn.close()
-    await update.message.reply_text("Регистрация на турнир открыта.")
+    await execute("UPDATE tournaments SET registration_open = 1 WHERE id = ?", (tournament.id,))
+    tournament.registration_open = True
+    await update.message.reply_text(f"Регистрация на турнир «{tournament.title}» открыта.")
 
 @admin_required
-async def close_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@tournament_command("close_registration")
+async def close_registration(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
     """Closes tournament registration."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tournament_status SET registration_open = 0 WHERE id = 1")
-    conn.commit()
-    cursor.close()
-    conn.close()
-    await update.message.reply_text("Регистрация на турнир закрыта.")
+    await execute("UPDATE tournaments SET registration_open = 0 WHERE id = ?", (tournament.id,))
+    tournament.registration_open = False
+    await update.message.reply_text(f"Регистрация на турнир «{tournament.title}» закрыта.")
 
 @admin_required
-async def set_mode_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@tournament_command("set_mode_nickname")
+async def set_mode_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
     """Sets the registration mode to nickname only."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tournament_status SET mode = 'nickname' WHERE id = 1")
-    conn.commit()
-    cursor.close()
-    conn.close()
-    await update.message.reply_text("Режим регистрации изменен: только никнейм.")
+    await execute("UPDATE tournaments SET mode = 'nickname' WHERE id = ?", (tournament.id,))
+    tournament.mode = 'nickname'
+    await update.message.reply_text(f"Режим регистрации турнира «{tournament.title}» изменен: только никнейм.")
 
 @admin_required
-async def set_mode_character(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@tournament_command("set_mode_character")
+async def set_mode_character(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
     """Sets the registration mode to nickname and character."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
+    await execute("UPDATE tournaments SET mode = 'character' WHERE id = ?", (tournament.id,))
+    tournament.mode = 'character'
+    await update.message.reply_text(f"Режим регистрации турнира «{tournament.title}» изменен: никнейм и персонаж.")
+
+@admin_required
+@tournament_command("set_format")
+async def set_format(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Sets the tournament format; Swiss takes an optional number of rounds."""
+    args = context.args[1:] if context.args and context.args[0].isdigit() else context.args
+    valid = bool(args) and args[0] in FORMATS and len(args) <= 2
+    if valid and len(args) == 2:
+        valid = args[0] == 'swiss' and args[1].isdigit() and int(args[1]) >= 1
+    if not valid:
+        await update.message.reply_text(
+            "Использование: /set_format [ID] <single|double|swiss> [число туров]\n"
+            + "\n".join(f"{key} - {f.label}" for key, f in FORMATS.items())
+        )
         return
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tournament_status SET mode = 'character' WHERE id = 1")
-    conn.commit()
-    cursor.close()
-    conn.close()
-    await update.message.reply_text("Режим регистрации изменен: никнейм и персонаж.")
+    if tournament.status != 'registration':
+        await update.message.reply_text("Формат можно изменить только до начала турнира.")
+        return
+
+    tournament_format = args[0]
+    swiss_rounds = int(args[1]) if len(args) == 2 else None
+    await execute(
+        "UPDATE tournaments SET format = ?, swiss_rounds = ? WHERE id = ? AND status = 'registration'",
+        (tournament_format, swiss_rounds, tournament.id)
+    )
+    tournament.format = tournament_format
+    tournament.swiss_rounds = swiss_rounds
+    text = f"Формат турнира «{tournament.title}» изменен: {FORMATS[tournament_format].label}"
+    if tournament_format == 'swiss':
+        text += f", туров: {swiss_rounds}" if swiss_rounds else ", число туров по количеству игроков"
+    await update.message.reply_text(text + ".")
+
+SEEDING_LABELS = {
+    'random': "случайный посев",
+    'rating': "посев по рейтингу",
+}
+
+@admin_required
+@tournament_command("set_seeding")
+async def set_seeding(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Chooses random or rating-based seeding for the tournament's start."""
+    args = context.args[1:] if context.args and context.args[0].isdigit() else context.args
+    if len(args) != 1 or args[0] not in SEEDING_LABELS:
+        await update.message.reply_text("Использование: /set_seeding [ID] <random|rating>")
+        return
+    if tournament.status != 'registration':
+        await update.message.reply_text("Посев можно изменить только до начала турнира.")
+        return
+
+    await execute(
+        "UPDATE tournaments SET seeding = ? WHERE id = ? AND status = 'registration'", (args[0], tournament.id)
+    )
+    tournament.seeding = args[0]
+    await update.message.reply_text(f"Турнир «{tournament.title}»: {SEEDING_LABELS[args[0]]}.")
+
+BROADCAST_USAGE = (
+    "Использование: /broadcast <ID турнира> [группа] <сообщение>\n"
+    "Группы: all - все участники (по умолчанию), alive - оставшиеся в турнире, "
+    "unreported - с матчем без результата, round=N - игроки раунда N, "
+    "character=Имя - игроки за персонажа (пробелы в имени можно заменить на _)"
+)
+
+def _parse_segment(word: str):
+    """Reads a segment from the word after the tournament ID. Returns (segment, arg), (None, None)
+    if the word is not a segment, or raises ValueError for a malformed one.
+    """
+    name, _, arg = word.partition('=')
+    if name not in SEGMENTS or bool(arg) != (name in ('round', 'character')):
+        return None, None
+    if name == 'round':
+        if not arg.isdigit():
+            raise ValueError("Номер раунда должен быть числом.")
+        return name, int(arg)
+    if name == 'character':
+        character = next((c for c in CHARACTERS if c.lower() in (arg.lower(), arg.replace('_', ' ').lower())), None)
+        if character is None:
+            raise ValueError(f"Персонаж «{arg}» не найден.")
+        return name, character
+    return name, None
 
 @admin_required
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Sends a message to all registered participants."""
-    message_text = " ".join(context.args)
-    if not message_text:
-        await update.message.reply_text("Использование: /broadcast <сообщение>")
+    """Sends a message to all participants of a tournament, or to one segment of them, in the background."""
+    if len(context.args) < 2 or not context.args[0].isdigit():
+        await update.message.reply_text(BROADCAST_USAGE)
         return
+    tournament = get_tournament(int(context.args[0]))
+    if tournament is None:
+        await update.message.reply_text(f"Турнир с ID {context.args[0]} не найден. Список турниров: /tournaments")
+        return
+    try:
+        segment, arg = _parse_segment(context.args[1])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\n{BROADCAST_USAGE}")
+        return
+    words = context.args[2:] if segment else context.args[1:]
+    if not words:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    segment = segment or 'all'
 
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
+    if not await run_query(count_recipients, tournament.id, segment, arg):
+        await update.message.reply_text(
+            f"Нет участников для отправки сообщения ({segment_label(segment, arg)})."
+        )
         return
-    cursor = conn.cursor()
 
-    cursor.execute("SELECT u.telegram_id FROM users u JOIN registrations r ON u.id = r.user_id")
-    user_ids = [row['telegram_id'] for row in cursor.fetchall()]
+    text = f"📢 Объявление от администратора турнира «{tournament.title}»:\n\n{' '.join(words)}"
+    # Keyed by the command message, so a redelivered update does not start a second job.
+    job = f"broadcast:{update.effective_chat.id}:{update.message.message_id}"
+    broadcast_id = await run_transaction(
+        create_broadcast, job, tournament.id, segment, arg, text, update.effective_chat.id
+    )
+    if broadcast_id is None:
+        return
 
-    cursor.close()
-    conn.close()
+    try:
+        status = await run_transaction(progress, broadcast_id)
+        message = await update.message.reply_text(progress_text(status))
+        await run_transaction(set_progress_message, broadcast_id, message.message_id)
+    finally:
+        # The job is sent even if its progress message could not be posted.
+        run_broadcast(broadcast_id)
 
-    if not user_ids:
-        await update.message.reply_text("Нет зарегистрированных участников для отправки сообщения.")
+@admin_required
+async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancels a running broadcast; without a number, lists the running ones."""
+    if len(context.args) != 1 or not context.args[0].isdigit():
+        jobs = await run_query(active_broadcasts)
+        lines = ["Использование: /cancel_broadcast <номер рассылки>"]
+        if jobs:
+            lines.append("Идущие рассылки:")
+            lines += [
+                f"#{job['id']}: «{job['title']}», {segment_label(job['segment'], job['segment_arg'])}, "
+                f"получателей: {job['queued']} из {job['total']}"
+                for job in jobs
+            ]
+        else:
+            lines.append("Сейчас нет идущих рассылок.")
+        await update.message.reply_text("\n".join(lines))
         return
 
-    sent_count = 0
-    failed_count = 0
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=f"📢 Объявление от администратора:\n\n{message_text}")
-            sent_count += 1
-        except Exception as e:
-            failed_count += 1
-            print(f"Failed to send message to {user_id}: {e}")
-        await asyncio.sleep(0.1)  # Avoid hitting rate limits
-
-    await update.message.reply_text(f"Сообщение отправлено.\nУспешно: {sent_count}\nНе удалось: {failed_count}")
+    broadcast_id = int(context.args[0])
+    if not await run_transaction(cancel_job, broadcast_id):
+        await update.message.reply_text(f"Рассылка #{broadcast_id} не найдена или уже завершена.")
+        return
+    await update.message.reply_text(f"Рассылка #{broadcast_id} отменена. Уже отправленные сообщения не отзываются.")
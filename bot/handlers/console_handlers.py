@@ -0,0 +1,279 @@
+"""The admin match-control console.
+
+Each admin gets one message per tournament round listing the open matches page by page.
+It is posted when the first match of the round becomes playable. Picking a
+match shows the winner/DQ buttons handled by tournament_handlers.match_management_callback.
+Every result re-renders all admins' copies in place, so the number of messages per round
+does not depend on the number of matches.
+"""
+import asyncio
+import logging
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from ..data.database import fetch_one, fetch_all, run_query, run_transaction
+from ..services.tournament_state import get_tournament, list_tournaments
+from .admin_handlers import admin_required, is_admin
+from config import ADMIN_IDS
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 10
+
+# (tournament_id, round) -> lock; dropped by forget_rounds once the tournament no longer needs them.
+_round_locks = {}
+
+OPEN_MATCHES_SQL = (
+    "SELECT m.id, p1.id as p1_id, p1.nickname as p1_nick, p2.id as p2_id, p2.nickname as p2_nick "
+    "FROM matches m "
+    "JOIN registrations p1 ON m.player1_id = p1.id "
+    "JOIN registrations p2 ON m.player2_id = p2.id "
+    "WHERE m.tournament_id = ? AND m.round = ? "
+    "AND m.is_bye = 0 AND m.winner_id IS NULL AND m.double_dq = 0 AND m.pending_feeders = 0 "
+)
+
+
+def _match_keyboard(match, tournament_id: int, round_num: int, page: int) -> list:
+    """Winner/DQ buttons for one match plus a way back to the list."""
+    match_id = match['id']
+    p1_id, p1_nick = match['p1_id'], match['p1_nick']
+    p2_id, p2_nick = match['p2_id'], match['p2_nick']
+    return [
+        [
+            InlineKeyboardButton(f"👑 Победил {p1_nick}", callback_data=f"win_{match_id}_{p1_id}"),
+            InlineKeyboardButton(f"👑 Победил {p2_nick}", callback_data=f"win_{match_id}_{p2_id}")
+        ],
+        [
+            InlineKeyboardButton(f"❌ ДК {p1_nick}", callback_data=f"dq_{match_id}_{p1_id}"),
+            InlineKeyboardButton(f"❌ ДК {p2_nick}", callback_data=f"dq_{match_id}_{p2_id}")
+        ],
+        [
+            InlineKeyboardButton("❌ ДК Обоим", callback_data=f"dq_{match_id}_both")
+        ],
+        [
+            InlineKeyboardButton("⬅️ К списку матчей", callback_data=f"cpage_{tournament_id}_{round_num}_{page}")
+        ]
+    ]
+
+
+def _render_console(conn, tournament_id: int, title: str, round_num: int, page: int, selected_match_id=None, note=None):
+    """Builds the console text and keyboard for one admin's view. Returns (text, markup, page)."""
+    header = f"🎮 {title}: управление матчами, раунд {round_num}"
+    if note:
+        header = f"{note}\n\n{header}"
+
+    if selected_match_id is not None:
+        match = conn.execute(
+            OPEN_MATCHES_SQL + "AND m.id = ?", (tournament_id, round_num, selected_match_id)
+        ).fetchone()
+        if match:
+            text = f"{header}\n\nМатч {match['id']}: {match['p1_nick']} vs {match['p2_nick']}\nВыберите результат:"
+            return text, InlineKeyboardMarkup(_match_keyboard(match, tournament_id, round_num, page)), page
+
+    open_count = conn.execute(
+        "SELECT COUNT(*) as open_count FROM matches "
+        "WHERE tournament_id = ? AND round = ? "
+        "AND is_bye = 0 AND winner_id IS NULL AND double_dq = 0 AND pending_feeders = 0",
+        (tournament_id, round_num)
+    ).fetchone()['open_count']
+    if open_count == 0:
+        return f"{header}\n\nВсе матчи раунда сыграны.", None, 0
+
+    pages = (open_count + PAGE_SIZE - 1) // PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    matches = conn.execute(
+        OPEN_MATCHES_SQL + "ORDER BY m.id LIMIT ? OFFSET ?",
+        (tournament_id, round_num, PAGE_SIZE, page * PAGE_SIZE)
+    ).fetchall()
+
+    keyboard = [
+        [InlineKeyboardButton(
+            f"⚔️ {m['id']}: {m['p1_nick']} vs {m['p2_nick']}",
+            callback_data=f"cpick_{tournament_id}_{round_num}_{m['id']}"
+        )]
+        for m in matches
+    ]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=f"cpage_{tournament_id}_{round_num}_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=f"cpage_{tournament_id}_{round_num}_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    text = f"{header}\nОткрытых матчей: {open_count}. Страница {page + 1} из {pages}.\nВыберите матч:"
+    return text, InlineKeyboardMarkup(keyboard), page
+
+
+def _save_console(conn, tournament_id: int, admin_id: int, round_num: int, message_id: int):
+    conn.execute(
+        "INSERT INTO admin_consoles (tournament_id, admin_id, round, message_id) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (tournament_id, admin_id, round) "
+        "DO UPDATE SET message_id = excluded.message_id, page = 0, selected_match_id = NULL",
+        (tournament_id, admin_id, round_num, message_id)
+    )
+
+
+def _set_view(conn, tournament_id: int, admin_id: int, round_num: int, page: int, selected_match_id):
+    conn.execute(
+        "UPDATE admin_consoles SET page = ?, selected_match_id = ? "
+        "WHERE tournament_id = ? AND admin_id = ? AND round = ?",
+        (page, selected_match_id, tournament_id, admin_id, round_num)
+    )
+
+
+def _render_all(conn, tournament_id: int, title: str, round_num: int, note):
+    """Renders every admin's console for a round. Returns (admin_id, message_id, text, markup) rows."""
+    consoles = conn.execute(
+        "SELECT admin_id, message_id, page, selected_match_id FROM admin_consoles "
+        "WHERE tournament_id = ? AND round = ?",
+        (tournament_id, round_num)
+    ).fetchall()
+    return [
+        (c['admin_id'], c['message_id'])
+        + _render_console(conn, tournament_id, title, round_num, c['page'], c['selected_match_id'], note)[:2]
+        for c in consoles
+    ]
+
+
+async def _edit(bot, chat_id: int, message_id: int, text: str, reply_markup):
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            logger.warning("Failed to update console %s for admin %s: %s", message_id, chat_id, e)
+
+
+async def post_console(bot, tournament, admin_id: int, round_num: int):
+    """Sends a fresh console for a round to one admin and remembers its message."""
+    text, reply_markup, _ = await run_query(_render_console, tournament.id, tournament.title, round_num, 0)
+    message = await bot.send_message(chat_id=admin_id, text=text, reply_markup=reply_markup)
+    await run_transaction(_save_console, tournament.id, admin_id, round_num, message.message_id)
+
+
+async def post_consoles(bot, tournament, round_num: int):
+    """Sends the console for a new round to every admin."""
+    async def post(admin_id):
+        try:
+            await post_console(bot, tournament, admin_id, round_num)
+        except Exception as e:
+            logger.warning(
+                "Failed to send console for tournament %s round %s to admin %s: %s", tournament.id, round_num, admin_id, e
+            )
+
+    await asyncio.gather(*(post(admin_id) for admin_id in ADMIN_IDS))
+
+
+def _round_lock(tournament_id: int, round_num: int) -> asyncio.Lock:
+    """Serializes posting and re-rendering the consoles of one round."""
+    return _round_locks.setdefault((tournament_id, round_num), asyncio.Lock())
+
+
+def forget_rounds(tournament_id: int):
+    """Drops the round locks of a tournament that finished or whose matches were reset, archived or restored.
+
+    A lock that is held right now stays, so that a refresh still running keeps out the next one.
+    """
+    for key in [key for key, lock in _round_locks.items() if key[0] == tournament_id and not lock.locked()]:
+        del _round_locks[key]
+
+
+async def _refresh(bot, tournament, round_num: int, note) -> set:
+    views = await run_query(_render_all, tournament.id, tournament.title, round_num, note)
+    await asyncio.gather(*(_edit(bot, *view) for view in views))
+    return {(admin_id, message_id) for admin_id, message_id, _, _ in views}
+
+
+async def refresh_consoles(bot, tournament, round_num: int, note=None) -> set:
+    """Re-renders every admin's console for a round in place. Returns the (chat_id, message_id) pairs edited."""
+    async with _round_lock(tournament.id, round_num):
+        return await _refresh(bot, tournament, round_num, note)
+
+
+async def update_consoles(bot, tournament, rounds, note=None) -> set:
+    """Refreshes the consoles of the given rounds and posts consoles for rounds that just got playable matches.
+
+    Returns the (chat_id, message_id) pairs edited.
+    """
+    edited = set()
+    for round_num in sorted(rounds):
+        async with _round_lock(tournament.id, round_num):
+            posted = await fetch_one(
+                "SELECT 1 FROM admin_consoles WHERE tournament_id = ? AND round = ? LIMIT 1", (tournament.id, round_num)
+            )
+            if posted:
+                edited |= await _refresh(bot, tournament, round_num, note)
+                continue
+            row = await fetch_one(
+                "SELECT 1 FROM matches WHERE tournament_id = ? AND round = ? AND is_bye = 0 AND winner_id IS NULL "
+                "AND double_dq = 0 AND pending_feeders = 0 LIMIT 1",
+                (tournament.id, round_num)
+            )
+            if row:
+                await post_consoles(bot, tournament, round_num)
+    return edited
+
+
+async def console_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles console navigation: cpage_<tournament>_<round>_<page> and cpick_<tournament>_<round>_<match_id>."""
+    query = update.callback_query
+    if not is_admin(query.from_user.id):
+        await query.answer("У вас нет прав для использования этой команды.", show_alert=True)
+        return
+    await query.answer()
+
+    action, tournament_id, round_num, value = query.data.split('_')
+    tournament = get_tournament(int(tournament_id))
+    if tournament is None:
+        await query.edit_message_text("Турнир не найден.")
+        return
+    round_num = int(round_num)
+    admin_id = query.from_user.id
+
+    row = await fetch_one(
+        "SELECT page FROM admin_consoles WHERE tournament_id = ? AND admin_id = ? AND round = ?",
+        (tournament.id, admin_id, round_num)
+    )
+    page = row['page'] if row else 0
+    if action == 'cpage':
+        page, selected_match_id = int(value), None
+    else:
+        selected_match_id = int(value)
+
+    text, reply_markup, page = await run_query(
+        _render_console, tournament.id, tournament.title, round_num, page, selected_match_id
+    )
+    if row:
+        await run_transaction(_set_view, tournament.id, admin_id, round_num, page, selected_match_id)
+    await _edit(context.bot, query.message.chat_id, query.message.message_id, text, reply_markup)
+
+
+@admin_required
+async def show_console(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends the admin a fresh console for every round that has matches to play.
+
+    With a tournament id only that tournament's rounds are sent, otherwise those of every running tournament.
+    """
+    if context.args and context.args[0].isdigit():
+        tournament = get_tournament(int(context.args[0]))
+        if tournament is None:
+            await update.message.reply_text(f"Турнир с ID {context.args[0]} не найден. Список турниров: /tournaments")
+            return
+        tournaments = [tournament]
+    else:
+        tournaments = [t for t in list_tournaments() if t.status == 'running']
+
+    posted = 0
+    for tournament in tournaments:
+        rows = await fetch_all(
+            "SELECT DISTINCT round FROM matches WHERE tournament_id = ? AND is_bye = 0 AND winner_id IS NULL "
+            "AND double_dq = 0 AND pending_feeders = 0 ORDER BY round",
+            (tournament.id,)
+        )
+        for row in rows:
+            await post_console(context.bot, tournament, update.effective_user.id, row['round'])
+            posted += 1
+    if not posted:
+        await update.message.reply_text("Сейчас нет матчей, ожидающих результата.")
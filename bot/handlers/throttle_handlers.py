@@ -0,0 +1,118 @@
+"""Throttling in front of every other handler (group -1 in bot.py).
+
+Stops floods before they turn into database work:
+- every non-admin user has a token bucket; updates beyond it are dropped
+- a repeat of /my_status or /bracket within REPEAT_WINDOW is answered with the reply the
+  user got last time, without running the handler
+- a second press of the same button within CALLBACK_WINDOW is only acknowledged
+- presses on matches whose result is already recorded never reach match_management_callback
+
+Dropping an update raises ApplicationHandlerStop, so no handler of a later group sees it.
+"""
+import re
+import time
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+from ..services import metrics
+from ..services.sender import TokenBucket
+from .admin_handlers import is_admin
+
+# Each user may send USER_BURST updates at once and USER_RATE per second after that.
+USER_RATE = 1
+USER_BURST = 5
+# Buckets and cached replies are kept for this many users; the least recently seen are dropped.
+MAX_TRACKED_USERS = 10000
+# Seconds for which a repeated command is answered with the previous reply.
+REPEAT_WINDOW = 5
+# Seconds within which a second press of the same button is ignored.
+CALLBACK_WINDOW = 2
+# Decided match IDs remembered; older ones fall back to the check in the database.
+MAX_DECIDED_MATCHES = 100000
+
+MATCH_CALLBACK = re.compile(r'^(win|dq)_(\d+)_')
+
+_buckets = OrderedDict()
+# (user_id, command text) -> (time, text, reply_markup)
+_replies = OrderedDict()
+# (user_id, message_id, data) -> time
+_presses = OrderedDict()
+_decided = OrderedDict()
+
+
+def _remember(cache: OrderedDict, key, value, limit: int):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > limit:
+        cache.popitem(last=False)
+
+
+def _bucket(user_id: int) -> TokenBucket:
+    bucket = _buckets.get(user_id)
+    if bucket is None:
+        bucket = TokenBucket(USER_RATE, USER_BURST)
+    _remember(_buckets, user_id, bucket, MAX_TRACKED_USERS)
+    return bucket
+
+
+def mark_decided(match_id: int):
+    """Records that a match has its result, so later presses on it are dropped early."""
+    _remember(_decided, match_id, True, MAX_DECIDED_MATCHES)
+
+
+def forget_decided(match_ids):
+    """Drops matches from the decided cache, e.g. after a restore brought back their open state."""
+    for match_id in match_ids:
+        _decided.pop(match_id, None)
+
+
+async def reply_and_remember(update: Update, text: str, reply_markup=None):
+    """Replies to a command and keeps the reply for repeats of the same command within REPEAT_WINDOW."""
+    key = (update.effective_user.id, update.message.text)
+    _remember(_replies, key, (time.monotonic(), text, reply_markup), MAX_TRACKED_USERS)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+def _drop(reason: str):
+    metrics.count_throttled(reason)
+    raise ApplicationHandlerStop
+
+
+async def throttle_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drops or answers flooding updates before the regular handlers run."""
+    user = update.effective_user
+    if user is None:
+        return
+    now = time.monotonic()
+    query = update.callback_query
+
+    if query is not None:
+        match = MATCH_CALLBACK.match(query.data or '')
+        if match and int(match.group(2)) in _decided:
+            await query.answer("Результат этого матча уже записан.", show_alert=True)
+            _drop('decided_match')
+        message_id = query.message.message_id if query.message else None
+        key = (user.id, message_id, query.data)
+        pressed = _presses.get(key)
+        _remember(_presses, key, now, MAX_TRACKED_USERS)
+        if pressed is not None and now - pressed < CALLBACK_WINDOW:
+            await query.answer()
+            _drop('repeated_press')
+
+    if is_admin(user.id):
+        return
+
+    if update.message and update.message.text:
+        cached = _replies.get((user.id, update.message.text))
+        if cached and now - cached[0] < REPEAT_WINDOW:
+            if _bucket(user.id).try_consume():
+                _drop('rate_limited')
+            await update.message.reply_text(cached[1], reply_markup=cached[2])
+            _drop('repeated_command')
+
+    if _bucket(user.id).try_consume():
+        if query is not None:
+            await query.answer("Слишком много запросов. Подождите немного.")
+        _drop('rate_limited')
@@ -1,281 +1,326 @@
+import json
 import random
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import ContextTypes
-from ..data.database import get_db_connection
-from .admin_handlers import admin_required
-from config import ADMIN_IDS
-
-async def send_management_panel(context: ContextTypes.DEFAULT_TYPE, match: dict):
-    """Sends a match management panel to all admins."""
-    match_id = match['id']
-    p1_id = match['p1_id']
-    p1_nick = match['p1_nick']
-    p2_id = match['p2_id']
-    p2_nick = match['p2_nick']
-
-    text = f"Управление матчем {match_id}: {p1_nick} vs {p2_nick}"
-
-    keyboard = [
-        [
-            InlineKeyboardButton(f"👑 Победил {p1_nick}", callback_data=f"win_{match_id}_{p1_id}"),
-            InlineKeyboardButton(f"👑 Победил {p2_nick}", callback_data=f"win_{match_id}_{p2_id}")
-        ],
-        [
-            InlineKeyboardButton(f"❌ ДК {p1_nick}", callback_data=f"dq_{match_id}_{p1_id}"),
-            InlineKeyboardButton(f"❌ ДК {p2_nick}", callback_data=f"dq_{match_id}_{p2_id}")
-        ],
-        [
-            InlineKeyboardButton("❌ ДК Обоим", callback_data=f"dq_{match_id}_both")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=text, reply_markup=reply_markup)
-        except Exception as e:
-            print(f"Failed to send management panel to admin {admin_id} for match {match_id}: {e}")
-
-
-async def notify_players_of_matches(context: ContextTypes.DEFAULT_TYPE, matches: list, round_num: int):
-    """Sends notifications to players about their upcoming matches."""
+from ..data.archive import (
+    archive_tournament as archive_rows, clear_tournament, discard_snapshot, list_snapshots, restore_snapshot,
+    snapshot_path, snapshot_tournament_id, write_snapshot,
+)
+from ..data.database import fetch_one, fetch_all, reclaim_space, run_query, run_transaction
+from .admin_handlers import admin_required, is_admin, tournament_command
+from .console_handlers import forget_rounds, update_consoles, refresh_consoles
+from .throttle_handlers import forget_decided, mark_decided
+from ..data.outbox import enqueue
+from ..data.player_status import refresh_matches, refresh_tournament
+from ..data.ratings import order_by_rating, record_match, record_participation, record_title, revert_tournament
+from ..services.outbox_worker import wake_outbox_worker
+from ..services.bracket_cache import invalidate_round, invalidate_all
+from ..services.tournament_state import add_tournament, get_tournament
+from ..services.formats import FORMATS, create_matches, record_match_result
+
+MATCH_ROWS_SQL = (
+    "SELECT m.id, m.round, t.title, "
+    "p1.id as p1_id, p1.nickname as p1_nick, u1.telegram_id as p1_tg_id, "
+    "p2.id as p2_id, p2.nickname as p2_nick, u2.telegram_id as p2_tg_id "
+    "FROM matches m "
+    "JOIN tournaments t ON m.tournament_id = t.id "
+    "JOIN registrations p1 ON m.player1_id = p1.id "
+    "JOIN users u1 ON p1.user_id = u1.id "
+    "JOIN registrations p2 ON m.player2_id = p2.id "
+    "JOIN users u2 ON p2.user_id = u2.id "
+    "WHERE m.id IN (SELECT value FROM json_each(?))"
+)
+
+def _queue_match_notifications(conn, match_ids: list):
+    """Queues notifications for both players of every newly ready match in the outbox."""
+    matches = conn.execute(MATCH_ROWS_SQL, (json.dumps(match_ids),)).fetchall()
+    notifications = []
     for match in matches:
         match_id = match['id']
-        p1_nick = match['p1_nick']
-        p2_nick = match['p2_nick']
-        p1_tg_id = match['p1_tg_id']
-        p2_tg_id = match['p2_tg_id']
-
-        try:
-            await context.bot.send_message(chat_id=p1_tg_id, text=f"🔔 Ваш следующий матч!\n\nРаунд {round_num}\nПротивник: {p2_nick}\nID матча: {match_id}")
-            await context.bot.send_message(chat_id=p2_tg_id, text=f"🔔 Ваш следующий матч!\n\nРаунд {round_num}\nПротивник: {p1_nick}\nID матча: {match_id}")
-        except Exception as e:
-            print(f"Failed to send match notification for match {match_id}: {e}")
+        round_num = match['round']
+        notifications.append((
+            match['p1_tg_id'],
+            f"🔔 Ваш следующий матч!\n\n{match['title']}, раунд {round_num}\nПротивник: {match['p2_nick']}\nID матча: {match_id}",
+            None,
+            f"match:{match_id}:notify:{match['p1_tg_id']}"
+        ))
+        notifications.append((
+            match['p2_tg_id'],
+            f"🔔 Ваш следующий матч!\n\n{match['title']}, раунд {round_num}\nПротивник: {match['p1_nick']}\nID матча: {match_id}",
+            None,
+            f"match:{match_id}:notify:{match['p2_tg_id']}"
+        ))
+
+    enqueue(conn, notifications, "match notifications")
+
+def _create_bracket(conn, tournament_id: int):
+    """Closes registration, builds the whole bracket from the registered players and queues the
+    first notifications.
+
+    Players are seeded at random, or by rating if the tournament is set to, with random order
+    among equal ratings. Returns (advancement, number of players); advancement is None if the
+    tournament already has a bracket, when the number is None too, or has fewer than two players.
+    Registrations still waiting in the batched writer check registration_open in their insert,
+    so none of them lands after this transaction.
+    """
+    if conn.execute("SELECT 1 FROM matches WHERE tournament_id = ? LIMIT 1", (tournament_id,)).fetchone():
+        return None, None
+    player_ids = [
+        row['id'] for row in conn.execute("SELECT id FROM registrations WHERE tournament_id = ?", (tournament_id,))
+    ]
+    if len(player_ids) < 2:
+        return None, len(player_ids)
+    random.shuffle(player_ids)
+    seeding = conn.execute("SELECT seeding FROM tournaments WHERE id = ?", (tournament_id,)).fetchone()['seeding']
+    if seeding == 'rating':
+        player_ids = order_by_rating(conn, player_ids)
+    record_participation(conn, tournament_id)
+    advancement = create_matches(conn, tournament_id, player_ids)
+    status = 'finished' if advancement.finished else 'running'
+    conn.execute(
+        "UPDATE tournaments SET status = ?, champion_id = ?, registration_open = 0 WHERE id = ?",
+        (status, advancement.champion_id, tournament_id)
+    )
+    refresh_tournament(conn, tournament_id)
+    _queue_match_notifications(conn, advancement.ready)
+    return advancement, len(player_ids)
+
+async def _publish_advancement(context: ContextTypes.DEFAULT_TYPE, tournament, advancement, note=None):
+    """Updates caches and admin consoles after the bracket changed."""
+    for round_num in advancement.rounds:
+        invalidate_round(tournament.id, round_num)
+    if advancement.finished:
+        tournament.status = 'finished'
+    wake_outbox_worker()
+    edited = await update_consoles(context.bot, tournament, advancement.rounds, note=note)
+    if advancement.finished:
+        forget_rounds(tournament.id)
+    return edited
 
 @admin_required
-async def start_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Starts the tournament and generates the first round."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) as match_count FROM matches")
-    if cursor.fetchone()['match_count'] > 0:
-        await update.message.reply_text("Турнир уже идет. Используйте /reset_tournament чтобы начать новый.")
-        cursor.close()
-        conn.close()
+@tournament_command("start_tournament")
+async def start_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Starts the tournament and builds the whole bracket."""
+    async with tournament.lock:
+        advancement, players = await run_transaction(_create_bracket, tournament.id)
+        if advancement is not None:
+            tournament.status = 'running'
+            tournament.registration_open = False
+    if players is None:
+        await update.message.reply_text(
+            f"Турнир уже идет. Используйте /reset_tournament {tournament.id} чтобы начать его заново."
+        )
         return
-
-    cursor.execute("SELECT id, nickname FROM registrations")
-    registrations = cursor.fetchall()
-
-    if len(registrations) < 2:
+    if advancement is None:
         await update.message.reply_text("Недостаточно игроков для начала турнира.")
-        cursor.close()
-        conn.close()
         return
 
-    random.shuffle(registrations)
-
-    bye_player = None
-    if len(registrations) % 2 != 0:
-        bye_player = registrations.pop()
-        cursor.execute(
-            "INSERT INTO matches (round, player1_id, is_bye, winner_id) VALUES (1, ?, 1, ?)",
-            (bye_player['id'], bye_player['id'])
-        )
-        conn.commit()
-        await update.message.reply_text(f"Игрок {bye_player['nickname']} пропускает первый раунд.")
-
-    round_num = 1
-    for i in range(0, len(registrations), 2):
-        player1 = registrations[i]
-        player2 = registrations[i+1]
-        cursor.execute(
-            "INSERT INTO matches (round, player1_id, player2_id) VALUES (?, ?, ?)",
-            (round_num, player1['id'], player2['id'])
-        )
-        conn.commit()
-
-    await update.message.reply_text("Сгенерированы матчи первого раунда.")
-
-    cursor.execute(
-        "SELECT m.id, "
-        "p1.id as p1_id, p1.nickname as p1_nick, u1.telegram_id as p1_tg_id, "
-        "p2.id as p2_id, p2.nickname as p2_nick, u2.telegram_id as p2_tg_id "
-        "FROM matches m "
-        "JOIN registrations p1 ON m.player1_id = p1.id "
-        "JOIN users u1 ON p1.user_id = u1.id "
-        "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
-        "LEFT JOIN users u2 ON p2.user_id = u2.id "
-        "WHERE m.round = 1 AND m.is_bye = 0"
+    await update.message.reply_text(
+        f"Сетка турнира «{tournament.title}» сгенерирована: {FORMATS[tournament.format].label}, "
+        f"{players} игроков, раундов: {advancement.total_rounds}.\n"
+        f"Готовы к игре матчей: {len(advancement.ready)}. Проходят без игры: {advancement.byes}."
     )
-    matches = cursor.fetchall()
-
-    match_list_text = [f"Матч {m['id']}: {m['p1_nick']} vs {m['p2_nick']}" for m in matches]
-    await update.message.reply_text(f"Матчи 1 раунда:\n" + "\n".join(match_list_text))
-
-    await notify_players_of_matches(context, matches, 1)
-    for match in matches:
-        await send_management_panel(context, match)
 
-    cursor.close()
-    conn.close()
+    await _publish_advancement(context, tournament, advancement)
 
-async def match_management_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handles button presses for match management (win/dq)."""
-    query = update.callback_query
-    await query.answer()
+def _record_result(conn, match_id: int, action: str, target: str):
+    """Resolves a win/dq button against the current match row and records the result atomically.
 
-    parts = query.data.split('_')
-    action = parts[0]
-    match_id = int(parts[1])
-
-    conn = get_db_connection()
-    if conn is None:
-        await query.edit_message_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT round, player1_id, player2_id FROM matches WHERE id = ?", (match_id,))
-    match = cursor.fetchone()
+    Returns (message_text, advancement, champion_nick), or None if the match is unknown or already decided.
+    """
+    match = conn.execute("SELECT tournament_id, player1_id, player2_id FROM matches WHERE id = ?", (match_id,)).fetchone()
     if not match:
-        await query.edit_message_text("Матч не найден.")
-        cursor.close()
-        conn.close()
-        return
-
-    current_round = match['round']
-    p1_id = match['player1_id']
-    p2_id = match['player2_id']
-
-    message_text = ""
+        return None
 
     if action == 'win':
-        winner_id = int(parts[2])
-        cursor.execute("UPDATE matches SET winner_id = ? WHERE id = ?", (winner_id, match_id))
-        conn.commit()
-        cursor.execute("SELECT nickname FROM registrations WHERE id = ?", (winner_id,))
-        winner_nick = cursor.fetchone()['nickname']
+        winner_id = int(target)
+    elif target == 'both':
+        winner_id = None
+    else:
+        dq_player_id = int(target)
+        winner_id = match['player2_id'] if dq_player_id == match['player1_id'] else match['player1_id']
+
+    advancement = record_match_result(conn, match_id, winner_id)
+    if advancement is None:
+        return None
+    if action == 'win':
+        loser_id = match['player2_id'] if winner_id == match['player1_id'] else match['player1_id']
+        record_match(conn, match['tournament_id'], match_id, winner_id, loser_id)
+    if advancement.finished:
+        conn.execute(
+            "UPDATE tournaments SET status = 'finished', champion_id = ? WHERE id = ?",
+            (advancement.champion_id, match['tournament_id'])
+        )
+        record_title(conn, advancement.champion_id)
+        # Everyone's state changes when the tournament ends, e.g. Swiss players stop waiting.
+        refresh_tournament(conn, match['tournament_id'])
+    else:
+        refresh_matches(conn, advancement.matches)
+    _queue_match_notifications(conn, advancement.ready)
+
+    def nickname(registration_id):
+        if registration_id is None:
+            return None
+        return conn.execute("SELECT nickname FROM registrations WHERE id = ?", (registration_id,)).fetchone()['nickname']
+
+    winner_nick = nickname(winner_id)
+    if action == 'win':
         message_text = f"✅ Матч {match_id}: {winner_nick} - победитель."
-    elif action == 'dq':
-        player_to_dq = parts[2]
-        if player_to_dq == 'both':
-            cursor.execute("UPDATE matches SET winner_id = -1 WHERE id = ?", (match_id,))
-            message_text = f"✅ Матч {match_id}: Оба игрока дисквалифицированы."
-        else:
-            dq_player_id = int(player_to_dq)
-            winner_id = p2_id if dq_player_id == p1_id else p1_id
-            cursor.execute("UPDATE matches SET winner_id = ? WHERE id = ?", (winner_id, match_id))
-            cursor.execute("SELECT nickname FROM registrations WHERE id = ?", (winner_id,))
-            winner_nick = cursor.fetchone()['nickname']
-            message_text = f"✅ Матч {match_id}: Игрок дисквалифицирован. {winner_nick} - победитель."
-        conn.commit()
-
-    await query.edit_message_text(message_text, reply_markup=None)
-
-    cursor.execute(
-        "SELECT COUNT(*) as remaining_matches FROM matches WHERE round = ? AND winner_id IS NULL",
-        (current_round,)
-    )
-    if cursor.fetchone()['remaining_matches'] == 0:
-        await query.message.reply_text(f"Раунд {current_round} завершен. Генерируется следующий раунд...")
-        await generate_next_round(query.message, context, current_round + 1)
-
-    cursor.close()
-    conn.close()
+    elif winner_id is None:
+        message_text = f"✅ Матч {match_id}: Оба игрока дисквалифицированы."
+    else:
+        message_text = f"✅ Матч {match_id}: Игрок дисквалифицирован. {winner_nick} - победитель."
+    return message_text, advancement, nickname(advancement.champion_id)
 
+async def match_management_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handles button presses for match management (win/dq).
 
-async def generate_next_round(message, context: ContextTypes.DEFAULT_TYPE, next_round_num: int):
-    """Generates the matches for the next round."""
-    conn = get_db_connection()
-    if conn is None:
-        await message.reply_text("Не удалось подключиться к базе данных при генерации следующего раунда.")
+    Registered as non-blocking so several admins can report results at once. Recording is a
+    single guarded transaction, so a second press on a decided match is rejected and each
+    result advances the bracket exactly once.
+    """
+    query = update.callback_query
+    if not is_admin(query.from_user.id):
+        await query.answer("У вас нет прав для использования этой команды.", show_alert=True)
         return
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "SELECT w.id, w.nickname FROM registrations w JOIN matches m ON w.id = m.winner_id WHERE m.round = ? AND m.winner_id != -1",
-        (next_round_num - 1,)
-    )
-    winners = cursor.fetchall()
+    action, match_id, target = query.data.split('_')
+    match_id = int(match_id)
 
-    if len(winners) == 1:
-        await message.reply_text(f"Турнир окончен! Победитель: {winners[0]['nickname']}!")
-        cursor.close()
-        conn.close()
+    row = await fetch_one("SELECT tournament_id, round FROM matches WHERE id = ?", (match_id,))
+    tournament = get_tournament(row['tournament_id']) if row else None
+    if tournament is None:
+        await query.answer()
+        await query.edit_message_text("Матч не найден.")
         return
 
-    if not winners:
-        await message.reply_text("Нет победителей для генерации следующего раунда. Турнир мог закончиться вничью.")
-        cursor.close()
-        conn.close()
+    async with tournament.lock:
+        result = await run_transaction(_record_result, match_id, action, target)
+
+    mark_decided(match_id)
+    if result is None:
+        await query.answer("Результат этого матча уже записан.", show_alert=True)
+        await refresh_consoles(context.bot, tournament, row['round'])
         return
+    await query.answer()
 
-    random.shuffle(winners)
+    message_text, advancement, champion_nick = result
+    edited = await _publish_advancement(context, tournament, advancement, note=message_text)
+    if (query.message.chat_id, query.message.message_id) not in edited:
+        # Pressed on a panel that is not a console, e.g. one sent before consoles existed.
+        await query.edit_message_text(message_text, reply_markup=None)
 
-    bye_player = None
-    if len(winners) % 2 != 0:
-        bye_player = winners.pop()
-        cursor.execute(
-            "INSERT INTO matches (round, player1_id, is_bye, winner_id) VALUES (?, ?, 1, ?)",
-            (next_round_num, bye_player['id'], bye_player['id'])
-        )
-        conn.commit()
-        await message.reply_text(f"Игрок {bye_player['nickname']} пропускает раунд {next_round_num}.")
-
-    for i in range(0, len(winners), 2):
-        player1 = winners[i]
-        player2 = winners[i+1]
-        cursor.execute(
-            "INSERT INTO matches (round, player1_id, player2_id) VALUES (?, ?, ?)",
-            (next_round_num, player1['id'], player2['id'])
+    if advancement.finished:
+        if champion_nick:
+            await query.message.reply_text(f"Турнир «{tournament.title}» окончен! Победитель: {champion_nick}!")
+        else:
+            await query.message.reply_text(
+                f"Турнир «{tournament.title}» окончен без победителя: в финале оба игрока выбыли."
+            )
+
+def _reset_tables(conn, tournament_id: int):
+    """Saves a snapshot of the tournament, takes it out of the ratings, deletes its matches and
+    registrations and resets its status.
+
+    Returns the snapshot's file name, or None if there was nothing to save.
+    """
+    name = None
+    if conn.execute("SELECT 1 FROM registrations WHERE tournament_id = ? LIMIT 1", (tournament_id,)).fetchone():
+        name = write_snapshot(conn, tournament_id, 'reset')
+    try:
+        revert_tournament(conn, tournament_id)
+        clear_tournament(conn, tournament_id)
+        conn.execute(
+            "UPDATE tournaments SET registration_open = 0, mode = 'nickname', status = 'registration' WHERE id = ?",
+            (tournament_id,)
         )
-        conn.commit()
-
-    cursor.execute(
-        "SELECT m.id, "
-        "p1.id as p1_id, p1.nickname as p1_nick, u1.telegram_id as p1_tg_id, "
-        "p2.id as p2_id, p2.nickname as p2_nick, u2.telegram_id as p2_tg_id "
-        "FROM matches m "
-        "JOIN registrations p1 ON m.player1_id = p1.id "
-        "JOIN users u1 ON p1.user_id = u1.id "
-        "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
-        "LEFT JOIN users u2 ON p2.user_id = u2.id "
-        "WHERE m.round = ? AND m.is_bye = 0",
-        (next_round_num,)
-    )
-    matches = cursor.fetchall()
+    except BaseException:
+        # The transaction rolls back, so the snapshot would describe a reset that never happened.
+        if name:
+            discard_snapshot(name)
+        raise
+    return name
 
-    match_list_text = [f"Матч {m['id']}: {m['p1_nick']} vs {m['p2_nick']}" for m in matches]
-    await message.reply_text(f"Матчи раунда {next_round_num}:\n" + "\n".join(match_list_text))
+@admin_required
+@tournament_command("reset_tournament")
+async def reset_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Resets a tournament: saves a snapshot, then deletes its matches and registrations."""
+    async with tournament.lock:
+        if tournament.status == 'archived':
+            await update.message.reply_text(
+                f"Турнир «{tournament.title}» в архиве. Верните его командой /restore {tournament.id}."
+            )
+            return
+        name = await run_transaction(_reset_tables, tournament.id)
+        invalidate_all(tournament.id)
+        forget_rounds(tournament.id)
+        await tournament.load()
+    await reclaim_space()
+
+    text = f"Турнир «{tournament.title}» был сброшен. Все регистрации и матчи этого турнира были удалены."
+    if name:
+        text += f"\nКопия сохранена: {name}\nВернуть турнир: /restore {name}"
+    await update.message.reply_text(text)
 
-    await notify_players_of_matches(context, matches, next_round_num)
-    for match in matches:
-        await send_management_panel(context, match)
+@admin_required
+@tournament_command("archive_tournament")
+async def archive_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Moves a finished tournament into a snapshot file and removes it from the live tables."""
+    if tournament.status != 'finished':
+        await update.message.reply_text("В архив можно перенести только завершенный турнир.")
+        return
 
-    cursor.close()
-    conn.close()
+    async with tournament.lock:
+        name = await run_transaction(archive_rows, tournament.id)
+        invalidate_all(tournament.id)
+        forget_rounds(tournament.id)
+        await tournament.load()
+    await reclaim_space()
+    await update.message.reply_text(
+        f"Турнир «{tournament.title}» перенесен в архив: {name}\nВернуть турнир: /restore {name}"
+    )
 
 @admin_required
-async def reset_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Resets the entire tournament."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
+@tournament_command("snapshot")
+async def snapshot_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Saves a snapshot of a tournament, e.g. before a risky change in the middle of the event."""
+    async with tournament.lock:
+        name = await run_query(write_snapshot, tournament.id, 'snapshot')
+    await update.message.reply_text(f"Снимок турнира «{tournament.title}» сохранен: {name}\nВосстановить: /restore {name}")
 
-    cursor.execute("DELETE FROM matches")
-    cursor.execute("DELETE FROM registrations")
-    # Reset autoincrement counters
-    cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('matches', 'registrations')")
-    cursor.execute("UPDATE tournament_status SET registration_open = 0, mode = 'nickname' WHERE id = 1")
+@admin_required
+async def restore_tournament(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Restores a tournament from a snapshot file, or from the newest snapshot of a tournament ID."""
+    if not context.args:
+        names = list_snapshots()[:10]
+        if not names:
+            await update.message.reply_text("Сохраненных снимков нет.")
+            return
+        await update.message.reply_text(
+            "Использование: /restore <файл или ID турнира>\nПоследние снимки:\n" + "\n".join(names)
+        )
+        return
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+    name = context.args[0]
+    if name.isdigit():
+        names = list_snapshots(int(name))
+        name = names[0] if names else name
+    path = snapshot_path(name)
+    if path is None:
+        await update.message.reply_text(f"Снимок {name} не найден. Список снимков: /restore")
+        return
 
-    await update.message.reply_text("Турнир был сброшен. Все регистрации и матчи были удалены.")
+    tournament_id = snapshot_tournament_id(name)
+    tournament = get_tournament(tournament_id) or add_tournament(tournament_id, "")
+    async with tournament.lock:
+        await run_transaction(restore_snapshot, path)
+        invalidate_all(tournament_id)
+        forget_rounds(tournament_id)
+        await tournament.load()
+        matches = await fetch_all("SELECT id FROM matches WHERE tournament_id = ?", (tournament_id,))
+        forget_decided(match['id'] for match in matches)
+
+    await update.message.reply_text(
+        f"Турнир «{tournament.title}» восстановлен из {name}: участников {len(tournament.registered_users)}, "
+        f"матчей {len(matches)}.\nПанели управления: /console {tournament_id}"
+    )
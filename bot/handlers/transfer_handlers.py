@@ -0,0 +1,125 @@
+"""Admin commands for bulk import and export.
+
+/import takes a CSV or JSON file sent with the command as its caption, or a reply to such
+a file. The file is saved to a temporary directory and read and written IMPORT_BATCH rows
+at a time, so other commands keep being answered while a large file goes in. /export
+pages through the rows the same way and sends them back as a file.
+"""
+import asyncio
+import csv
+import os
+import tempfile
+from itertools import islice
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from ..data.database import run_query, run_transaction
+from ..data.transfer import (
+    EXPORTS, FORMATS, IMPORT_BATCH, ExportWriter, TransferError, export_batch, import_batch, read_rows,
+)
+from ..services.tournament_state import resolve_tournament
+from .admin_handlers import admin_required, tournament_command
+
+# Bots cannot download larger files through the Bot API.
+MAX_FILE_SIZE = 20 * 1024 * 1024
+# Skipped rows listed in the reply; the rest are only counted.
+MAX_REPORTED_ERRORS = 20
+
+IMPORT_USAGE = (
+    "Использование: отправьте файл CSV или JSON с подписью /import [ID] или ответьте /import [ID] "
+    "на сообщение с файлом.\n"
+    "Столбцы: telegram_id, nickname, character (в режиме с персонажами), username (необязательно)."
+)
+
+
+async def _import(tournament_id: int, path: str, file_format: str) -> tuple:
+    """Imports a saved file batch by batch. Returns (imported, skipped, the first skipped rows, error text)."""
+    imported, skipped, reported = 0, 0, []
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        rows = read_rows(stream, file_format)
+        try:
+            # Parsing runs off the event loop too, one batch at a time.
+            while batch := await asyncio.to_thread(lambda: list(islice(rows, IMPORT_BATCH))):
+                count, errors = await run_transaction(import_batch, tournament_id, batch)
+                imported += count
+                skipped += len(errors)
+                reported += errors[:MAX_REPORTED_ERRORS - len(reported)]
+        except TransferError as e:
+            return imported, skipped, reported, str(e)
+        except UnicodeDecodeError:
+            return imported, skipped, reported, "Файл должен быть в кодировке UTF-8."
+        except csv.Error as e:
+            return imported, skipped, reported, f"Не удалось прочитать CSV: {e}."
+    return imported, skipped, reported, None
+
+
+@admin_required
+async def import_registrations(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Registers players from an uploaded CSV or JSON file."""
+    message = update.message
+    if message.document:
+        document, args = message.document, (message.caption or "").split()[1:]
+    else:
+        document = message.reply_to_message.document if message.reply_to_message else None
+        args = context.args
+    if document is None:
+        await message.reply_text(IMPORT_USAGE)
+        return
+
+    tournament, error = resolve_tournament(args, "import")
+    if error:
+        await message.reply_text(error)
+        return
+    if tournament.status != 'registration':
+        await message.reply_text("Импортировать игроков можно только до начала турнира.")
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await message.reply_text("Файл больше 20 МБ. Разбейте его на части или используйте python -m bot.data.transfer.")
+        return
+
+    file_format = 'json' if (document.file_name or "").lower().endswith(('.json', '.jsonl')) else 'csv'
+    with tempfile.TemporaryDirectory(prefix="import-") as directory:
+        path = os.path.join(directory, "upload")
+        telegram_file = await context.bot.get_file(document.file_id)
+        await telegram_file.download_to_drive(path)
+        async with tournament.lock:
+            imported, skipped, reported, error = await _import(tournament.id, path, file_format)
+            await tournament.load()
+
+    lines = [f"Импорт в турнир «{tournament.title}»: зарегистрировано {imported}, пропущено {skipped}."]
+    if error:
+        lines.append(f"Импорт остановлен: {error}")
+    lines += [f"Строка {number}: {reason}" for number, reason in reported]
+    if skipped > len(reported):
+        lines.append(f"…и еще {skipped - len(reported)}.")
+    await message.reply_text("\n".join(lines))
+
+
+@admin_required
+@tournament_command("export")
+async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Sends the tournament's registrations or matches with results as a CSV or JSON file."""
+    args = context.args[1:] if context.args and context.args[0].isdigit() else context.args
+    kind = args[0] if args else None
+    file_format = args[1] if len(args) > 1 else 'csv'
+    if kind not in EXPORTS or file_format not in FORMATS or len(args) > 2:
+        await update.message.reply_text(
+            f"Использование: /export [ID] <{'|'.join(EXPORTS)}> [{'|'.join(FORMATS)}]"
+        )
+        return
+
+    name = f"tournament-{tournament.id}-{kind}.{file_format}"
+    with tempfile.TemporaryDirectory(prefix="export-") as directory:
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            writer = ExportWriter(stream, kind, file_format)
+            after_id = 0
+            while rows := await run_query(export_batch, kind, tournament.id, after_id):
+                writer.write(rows)
+                after_id = rows[-1][0]
+            writer.close()
+        with open(path, 'rb') as document:
+            await update.message.reply_document(
+                document, filename=name, caption=f"Турнир «{tournament.title}»: {kind}, записей: {writer.count}."
+            )
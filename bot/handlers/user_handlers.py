@@ -1,281 +1,366 @@
-from telegram import Update
+import json
+import sqlite3
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, ConversationHandler
 
-from ..data.database import get_db_connection
+from ..data.database import fetch_all, run_query, unique_columns
+from ..data.ratings import leaderboard
+from ..services.bracket_cache import get_bracket_pages
+from ..services.registration_writer import RegistrationClosed, register_player
+from ..services.tournament_state import get_tournament, list_tournaments
+from .admin_handlers import tournament_command
+from .throttle_handlers import reply_and_remember
 from config import CHARACTERS
 
+# Players shown by /leaderboard
+LEADERBOARD_SIZE = 20
+
 # States for conversation
 NICKNAME, CHARACTER = range(2)
 
-async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+# Character picker layout
+CHARACTER_PAGE_SIZE = 24
+CHARACTER_COLUMNS = 3
+
+STATUS_LABELS = {
+    'registration': "подготовка",
+    'running': "идет",
+    'finished': "завершен",
+    'archived': "в архиве",
+}
+
+async def show_tournaments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lists all tournaments with their status."""
+    tournaments = list_tournaments()
+    if not tournaments:
+        await update.message.reply_text("Турниров пока нет.")
+        return
+
+    lines = ["Турниры:"]
+    for tournament in tournaments:
+        status = STATUS_LABELS.get(tournament.status, tournament.status)
+        if tournament.registration_open:
+            status += ", регистрация открыта"
+        lines.append(f"{tournament.id}. {tournament.title} — {status}, участников: {len(tournament.registered_users)}")
+    await update.message.reply_text("\n".join(lines))
+
+def _current_tournament(context: ContextTypes.DEFAULT_TYPE):
+    """The tournament the user is registering for."""
+    return get_tournament(context.user_data.get('tournament_id'))
+
+@tournament_command("register")
+async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament) -> int:
     """Starts the registration conversation."""
     user = update.effective_user
 
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return ConversationHandler.END
-    cursor = conn.cursor()
-
     # Check if registration is open
-    cursor.execute("SELECT registration_open, mode FROM tournament_status WHERE id = 1")
-    status = cursor.fetchone()
-    if not status or not status['registration_open']:
-        await update.message.reply_text("Регистрация в данный момент закрыта.")
-        cursor.close()
-        conn.close()
+    if not tournament.registration_open:
+        await update.message.reply_text(f"Регистрация на турнир «{tournament.title}» в данный момент закрыта.")
         return ConversationHandler.END
 
     # Check if user is already registered
-    cursor.execute("SELECT u.id FROM users u JOIN registrations r ON u.id = r.user_id WHERE u.telegram_id = ?", (user.id,))
-    if cursor.fetchone():
-        await update.message.reply_text("Вы уже зарегистрированы на турнир.")
-        cursor.close()
-        conn.close()
+    if user.id in tournament.registered_users:
+        await update.message.reply_text(f"Вы уже зарегистрированы на турнир «{tournament.title}».")
         return ConversationHandler.END
 
-    # Ensure user is in the users table
-    cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (user.id,))
-    db_user = cursor.fetchone()
-    if not db_user:
-        cursor.execute("INSERT INTO users (telegram_id, username) VALUES (?, ?)", (user.id, user.username))
-        conn.commit()
-        cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (user.id,))
-        db_user = cursor.fetchone()
-
-    context.user_data['user_db_id'] = db_user['id']
-
-    await update.message.reply_text("Пожалуйста, введите ваш игровой никнейм.")
-
-    cursor.close()
-    conn.close()
+    context.user_data['tournament_id'] = tournament.id
+    await update.message.reply_text(f"Регистрация на турнир «{tournament.title}».\nПожалуйста, введите ваш игровой никнейм.")
     return NICKNAME
 
 async def received_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives and validates the nickname."""
+    user = update.effective_user
     nickname = update.message.text
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    tournament = _current_tournament(context)
+    if tournament is None or not tournament.registration_open:
+        await update.message.reply_text("Регистрация в данный момент закрыта.")
+        return ConversationHandler.END
 
     # Check if nickname is taken
-    cursor.execute("SELECT id FROM registrations WHERE nickname = ?", (nickname,))
-    if cursor.fetchone():
+    if nickname in tournament.nicknames:
         await update.message.reply_text("Этот никнейм уже занят. Пожалуйста, выберите другой.")
         return NICKNAME
 
     context.user_data['nickname'] = nickname
 
-    cursor.execute("SELECT mode FROM tournament_status WHERE id = 1")
-    status = cursor.fetchone()
-    registration_mode = status['mode']
-
-    if registration_mode == 'nickname':
-        user_db_id = context.user_data['user_db_id']
-        cursor.execute("INSERT INTO registrations (user_id, nickname) VALUES (?, ?)", (user_db_id, nickname))
-        conn.commit()
+    if tournament.mode == 'nickname':
+        try:
+            await register_player(tournament.id, user.id, user.username, nickname)
+        except RegistrationClosed:
+            context.user_data.clear()
+            await update.message.reply_text("Регистрация в данный момент закрыта.")
+            return ConversationHandler.END
+        except sqlite3.IntegrityError as e:
+            columns = unique_columns(e)
+            if 'registrations.user_id' in columns:
+                # A second registration of this account, e.g. from a repeated message
+                context.user_data.clear()
+                await update.message.reply_text(f"Вы уже зарегистрированы на турнир «{tournament.title}».")
+                return ConversationHandler.END
+            if 'registrations.nickname' not in columns:
+                raise
+            # Taken by someone else between the check and the insert
+            await update.message.reply_text("Этот никнейм уже занят. Пожалуйста, выберите другой.")
+            return NICKNAME
+        tournament.add_registration(user.id, nickname)
+        context.user_data.clear()
         await update.message.reply_text(f"Вы успешно зарегистрированы с никнеймом: {nickname}")
-        cursor.close()
-        conn.close()
         return ConversationHandler.END
 
     # Mode is 'character'
     if not CHARACTERS:
         await update.message.reply_text("Список персонажей не настроен в файле config.py. Обратитесь к администратору.")
-        cursor.close()
-        conn.close()
         return ConversationHandler.END
 
-    master_char_list = CHARACTERS
-
-    cursor.execute("SELECT character_name FROM registrations WHERE character_name IS NOT NULL")
-    taken_chars = [row['character_name'] for row in cursor.fetchall()]
-
-    available_chars = [char for char in master_char_list if char not in taken_chars]
-
-    if not available_chars:
+    if not tournament.free_characters:
         await update.message.reply_text("Свободных персонажей не осталось. Обратитесь к администратору.")
-        cursor.close()
-        conn.close()
         return ConversationHandler.END
 
-    context.user_data['available_chars'] = available_chars
-
-    response_text = "Теперь выберите персонажа из списка, отправив его номер:\n\n"
-    for i, char in enumerate(available_chars, 1):
-        response_text += f"{i}. {char}\n"
-
-    await update.message.reply_text(response_text)
+    context.user_data['character_page'] = 0
+    text, reply_markup = _character_picker(tournament, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+    return CHARACTER
 
-    cursor.close()
-    conn.close()
+def _character_picker(tournament, page: int):
+    """Builds one page of the character picker from the free characters. Returns (text, markup)."""
+    available = [(i, char) for i, char in enumerate(CHARACTERS) if char in tournament.free_characters]
+    if not available:
+        return "Свободных персонажей не осталось. Обратитесь к администратору.", None
+
+    pages = (len(available) + CHARACTER_PAGE_SIZE - 1) // CHARACTER_PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    chunk = available[page * CHARACTER_PAGE_SIZE:(page + 1) * CHARACTER_PAGE_SIZE]
+
+    keyboard = [
+        [InlineKeyboardButton(char, callback_data=f"char_{i}") for i, char in chunk[row:row + CHARACTER_COLUMNS]]
+        for row in range(0, len(chunk), CHARACTER_COLUMNS)
+    ]
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("◀️", callback_data=f"chpage_{page - 1}"))
+        navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"chpage_{page}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton("▶️", callback_data=f"chpage_{page + 1}"))
+        keyboard.append(navigation)
+
+    return "Теперь выберите персонажа:", InlineKeyboardMarkup(keyboard)
+
+async def _show_character_page(query, tournament, page: int):
+    text, reply_markup = _character_picker(tournament, page)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
+
+async def character_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Switches the character picker to another page."""
+    query = update.callback_query
+    await query.answer()
+    tournament = _current_tournament(context)
+    if tournament is None:
+        await query.edit_message_text("Регистрация в данный момент закрыта.")
+        return ConversationHandler.END
+    page = int(query.data.split('_')[1])
+    context.user_data['character_page'] = page
+    await _show_character_page(query, tournament, page)
     return CHARACTER
 
 async def received_character(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Receives and validates the character choice."""
-    choice = update.message.text
-    available_chars = context.user_data.get('available_chars')
+    """Reserves the picked character. The UNIQUE index decides races between simultaneous picks."""
+    query = update.callback_query
+    user = update.effective_user
+    page = context.user_data.get('character_page', 0)
+    tournament = _current_tournament(context)
+    if tournament is None or not tournament.registration_open:
+        await query.answer()
+        await query.edit_message_text("Регистрация в данный момент закрыта.")
+        return ConversationHandler.END
+
+    index = int(query.data.split('_')[1])
+    if not 0 <= index < len(CHARACTERS):
+        await query.answer()
+        await _show_character_page(query, tournament, page)
+        return CHARACTER
+    selected_char = CHARACTERS[index]
+
+    if selected_char not in tournament.free_characters:
+        await query.answer("Этот персонаж был выбран кем-то другим. Пожалуйста, выберите другого.", show_alert=True)
+        await _show_character_page(query, tournament, page)
+        return CHARACTER
+
+    nickname = context.user_data['nickname']
 
     try:
-        choice_index = int(choice) - 1
-        if 0 <= choice_index < len(available_chars):
-            selected_char = available_chars[choice_index]
-
-            conn = get_db_connection()
-            cursor = conn.cursor()
-
-            # Double-check if character was taken in the meantime
-            cursor.execute("SELECT id FROM registrations WHERE character_name = ?", (selected_char,))
-            if cursor.fetchone():
-                await update.message.reply_text("Этот персонаж был выбран кем-то другим, пока вы думали. Пожалуйста, попробуйте снова.")
-                # Resend the list
-                cursor.execute("SELECT character_name FROM registrations WHERE character_name IS NOT NULL")
-                taken_chars = [row['character_name'] for row in cursor.fetchall()]
-                current_available = [char for char in CHARACTERS if char not in taken_chars]
-                context.user_data['available_chars'] = current_available
-                response_text = "Выберите персонажа из обновленного списка:\n\n"
-                for i, char in enumerate(current_available, 1):
-                    response_text += f"{i}. {char}\n"
-                await update.message.reply_text(response_text)
-                cursor.close()
-                conn.close()
-                return CHARACTER
-
-            user_db_id = context.user_data['user_db_id']
-            nickname = context.user_data['nickname']
-
-            cursor.execute("INSERT INTO registrations (user_id, nickname, character_name) VALUES (?, ?, ?)",
-                           (user_db_id, nickname, selected_char))
-            conn.commit()
-
-            await update.message.reply_text(f"Вы успешно зарегистрированы с никнеймом '{nickname}' и персонажем '{selected_char}'.")
-
-            cursor.close()
-            conn.close()
+        await register_player(tournament.id, user.id, user.username, nickname, selected_char)
+    except RegistrationClosed:
+        context.user_data.clear()
+        await query.answer()
+        await query.edit_message_text("Регистрация в данный момент закрыта.")
+        return ConversationHandler.END
+    except sqlite3.IntegrityError as e:
+        columns = unique_columns(e)
+        if 'registrations.user_id' in columns:
+            context.user_data.clear()
+            await query.answer()
+            await query.edit_message_text(f"Вы уже зарегистрированы на турнир «{tournament.title}».")
             return ConversationHandler.END
-        else:
-            await update.message.reply_text("Неверный номер. Пожалуйста, выберите номер из списка.")
+        if 'registrations.character_name' in columns:
+            tournament.free_characters.discard(selected_char)
+            await query.answer("Этот персонаж был выбран кем-то другим. Пожалуйста, выберите другого.", show_alert=True)
+            await _show_character_page(query, tournament, page)
             return CHARACTER
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, отправьте число.")
-        return CHARACTER
+        if 'registrations.nickname' not in columns:
+            raise
+        # The nickname was taken by someone else while this user picked a character
+        await query.answer()
+        await query.edit_message_text("Этот никнейм уже занят. Пожалуйста, введите другой никнейм.")
+        return NICKNAME
+    tournament.add_registration(user.id, nickname, selected_char)
+    context.user_data.clear()
+
+    await query.answer()
+    await query.edit_message_text(f"Вы успешно зарегистрированы с никнеймом '{nickname}' и персонажем '{selected_char}'.")
+    return ConversationHandler.END
+
+async def character_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Reminds the user to pick a character with the buttons."""
+    await update.message.reply_text("Пожалуйста, выберите персонажа кнопкой в сообщении выше.")
+    return CHARACTER
 
 async def cancel_registration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels and ends the conversation."""
+    context.user_data.clear()
     await update.message.reply_text('Регистрация отменена.')
     return ConversationHandler.END
 
+async def registration_expired(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answers character buttons pressed outside a registration, e.g. after it was cancelled or finished."""
+    query = update.callback_query
+    await query.answer("Эта регистрация устарела. Начните заново командой /register.", show_alert=True)
+
+PATH_RESULTS = {
+    'win': "победа над {opponent}",
+    'loss': "поражение от {opponent}",
+    'bye': "проход без игры",
+    'dq': "дисквалификация",
+}
+
+def _format_path(path: list) -> str:
+    return " → ".join(
+        f"Р{round_num}: " + PATH_RESULTS[result].format(opponent=opponent) for round_num, result, opponent in path
+    )
+
+def _format_status(status) -> str:
+    state = status['state']
+    if state == 'registered':
+        return "Текущий матч: Турнир еще не начался."
+    if state == 'ready':
+        return f"Текущий матч: раунд {status['round']}, против {status['opponent']} (ID матча: {status['match_id']})"
+    if state == 'waiting' and status['match_id'] is None:
+        return "Текущий матч: ожидание жеребьевки следующего тура."
+    if state == 'waiting':
+        return f"Текущий матч: раунд {status['round']}, ожидание соперника (ID матча: {status['match_id']})"
+    if state == 'champion':
+        return "🏆 Вы победитель турнира!"
+    if state == 'finished':
+        return "Турнир завершен."
+    return "Вы выбыли из турнира."
+
 async def my_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Shows the user their registration status and current match."""
+    """Shows the user their registrations, current match and path in every tournament they entered.
+
+    Reads the materialized player_status rows, kept up to date by every bracket change.
+    """
     user = update.effective_user
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
 
-    cursor.execute(
-        "SELECT r.nickname, r.character_name "
-        "FROM registrations r "
-        "JOIN users u ON r.user_id = u.id "
-        "WHERE u.telegram_id = ?",
+    statuses = await fetch_all(
+        "SELECT tournament_title, nickname, character_name, state, match_id, round, opponent, path "
+        "FROM player_status WHERE telegram_id = ? ORDER BY tournament_id",
         (user.id,)
     )
-    registration = cursor.fetchone()
 
-    if not registration:
-        await update.message.reply_text("Вы не зарегистрированы на турнир.")
-        cursor.close()
-        conn.close()
+    if not statuses:
+        await reply_and_remember(update, "Вы не зарегистрированы ни на один турнир.")
         return
 
-    nickname = registration['nickname']
-    character_name = registration['character_name'] if registration['character_name'] else 'N/A'
-
-    cursor.execute(
-        "SELECT m.id, p1.nickname as p1_nick, p2.nickname as p2_nick, m.is_bye "
-        "FROM matches m "
-        "JOIN registrations r ON r.nickname = ? "
-        "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
-        "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
-        "WHERE (m.player1_id = r.id OR m.player2_id = r.id) AND m.winner_id IS NULL",
-        (nickname,)
-    )
-    match = cursor.fetchone()
-
-    status_text = f"Никнейм: {nickname}\nПерсонаж: {character_name}\n"
+    blocks = []
+    for status in statuses:
+        character_name = status['character_name'] if status['character_name'] else 'N/A'
+        status_text = (
+            f"Турнир: {status['tournament_title']}\nНикнейм: {status['nickname']}\nПерсонаж: {character_name}\n"
+            + _format_status(status)
+        )
+        path = json.loads(status['path'])
+        if path:
+            status_text += f"\nПуть: {_format_path(path)}"
+        blocks.append(status_text)
+
+    await reply_and_remember(update, "\n\n".join(blocks))
+
+async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows the top rated players across all tournaments."""
+    rows = await run_query(leaderboard, LEADERBOARD_SIZE)
+    if not rows:
+        await reply_and_remember(update, "Рейтинг пока пуст: еще не сыграно ни одного матча.")
+        return
 
-    if match:
-        if match['is_bye']:
-            status_text += "Текущий матч: У вас нет матча в этом раунде."
-        else:
-            opponent = match['p2_nick'] if match['p1_nick'] == nickname else match['p1_nick']
-            status_text += f"Текущий матч: против {opponent} (ID матча: {match['id']})"
-    else:
-        status_text += "Текущий матч: Нет активного матча."
+    lines = ["🏅 Рейтинг игроков:"]
+    for place, row in enumerate(rows, start=1):
+        win_rate = round(100 * row['wins'] / row['matches'])
+        line = (
+            f"{place}. {row['name']} — {row['rating']:.0f} "
+            f"(победы: {row['wins']} из {row['matches']}, {win_rate}%, турниров: {row['tournaments']}"
+        )
+        if row['titles']:
+            line += f", 🏆 {row['titles']}"
+        lines.append(line + ")")
+    await reply_and_remember(update, "\n".join(lines))
+
+def _bracket_keyboard(tournament_id: int, page: int, total: int):
+    """Previous/next buttons for a bracket page, or None for a single page."""
+    if total <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"bpage_{tournament_id}_{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{total}", callback_data=f"bpage_{tournament_id}_{page}"))
+    if page < total - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"bpage_{tournament_id}_{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+@tournament_command("bracket")
+async def display_bracket(update: Update, context: ContextTypes.DEFAULT_TYPE, tournament):
+    """Displays a tournament bracket."""
+    if tournament.status == 'archived':
+        await update.message.reply_text(f"Турнир «{tournament.title}» перенесен в архив.")
+        return
 
-    await update.message.reply_text(status_text)
+    pages = await get_bracket_pages(tournament)
+    if not pages:
+        await update.message.reply_text("Турнир еще не начался. Сетка пуста.")
+        return
 
-    cursor.close()
-    conn.close()
+    await reply_and_remember(update, pages[0], reply_markup=_bracket_keyboard(tournament.id, 0, len(pages)))
 
-async def display_bracket(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Displays the current tournament bracket."""
-    conn = get_db_connection()
-    if conn is None:
-        await update.message.reply_text("Не удалось подключиться к базе данных.")
-        return
-    cursor = conn.cursor()
+async def bracket_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows another page of the bracket in the same message."""
+    query = update.callback_query
+    await query.answer()
 
-    cursor.execute("SELECT MAX(round) as max_round FROM matches")
-    max_round_row = cursor.fetchone()
-    if not max_round_row or not max_round_row['max_round']:
-        await update.message.reply_text("Турнир еще не начался. Сетка пуста.")
-        cursor.close()
-        conn.close()
+    _, tournament_id, page = query.data.split('_')
+    tournament = get_tournament(int(tournament_id))
+    pages = await get_bracket_pages(tournament) if tournament else []
+    if not pages:
+        await query.edit_message_text("Турнир еще не начался. Сетка пуста.")
         return
 
-    max_round = max_round_row['max_round']
-    bracket_text = "🏆 **Турнирная сетка** 🏆\n"
-
-    for i in range(1, max_round + 1):
-        bracket_text += f"\n--- **Раунд {i}** ---\n"
-        cursor.execute(
-            "SELECT m.id, m.winner_id, p1.nickname as p1_nick, p2.nickname as p2_nick, w.nickname as winner_nick, m.is_bye "
-            "FROM matches m "
-            "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
-            "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
-            "LEFT JOIN registrations w ON m.winner_id = w.id "
-            "WHERE m.round = ? "
-            "ORDER BY m.id",
-            (i,)
-        )
-        matches = cursor.fetchall()
-
-        if not matches:
-            bracket_text += "_Матчи еще не сгенерированы._\n"
-            continue
-
-        for match in matches:
-            if match['is_bye']:
-                bracket_text += f"Матч {match['id']}: {match['p1_nick']} получает техническую победу.\n"
-                continue
-
-            p1 = match['p1_nick'] if match['p1_nick'] else '?'
-            p2 = match['p2_nick'] if match['p2_nick'] else '?'
-
-            if match['winner_nick']:
-                winner = match['winner_nick']
-                if winner == p1:
-                    bracket_text += f"Матч {match['id']}: **{p1}** vs {p2} -> 👑 {winner}\n"
-                else:
-                    bracket_text += f"Матч {match['id']}: {p1} vs **{p2}** -> 👑 {winner}\n"
-            elif match['winner_id'] == -1: # Both DQ'd
-                 bracket_text += f"Матч {match['id']}: ~~{p1} vs {p2}~~ (Оба дисквалифицированы)\n"
-            else:
-                bracket_text += f"Матч {match['id']}: {p1} vs {p2} (В процессе)\n"
-
-    await update.message.reply_text(bracket_text)
-
-    cursor.close()
-    conn.close()
+    page = min(int(page), len(pages) - 1)
+    try:
+        await query.edit_message_text(pages[page], reply_markup=_bracket_keyboard(tournament.id, page, len(pages)))
+    except BadRequest as e:
+        if "not modified" not in str(e):
+            raise
@@ -0,0 +1,153 @@
+"""In-memory cache of the rendered tournament brackets.
+
+Each tournament has its own cache. A round is rendered once and kept until something
+changes a match in it; callers invalidate a single round with invalidate_round(). The
+rendered rounds are split into pages that fit in one Telegram message, so /bracket is a
+cache lookup while nothing changes and a single-round query when something did.
+"""
+import asyncio
+
+from ..data.database import run_query
+
+# Telegram rejects messages longer than 4096 characters; leave room for the page footer.
+PAGE_LIMIT = 3900
+TITLE = "🏆 **Турнирная сетка: {title}** 🏆\n"
+# Round headings by the bracket the round belongs to; single elimination has no suffix.
+ROUND_HEADINGS = {
+    'winners': "Раунд {round} (верхняя сетка)",
+    'losers': "Раунд {round} (нижняя сетка)",
+    'final': "Гранд-финал",
+    'reset': "Гранд-финал, решающий матч",
+    'swiss': "Тур {round}",
+}
+
+
+class _BracketCache:
+    def __init__(self):
+        self.rounds = {}
+        self.max_round = None
+        self.pages = None
+        # Bumped on every invalidation so a render that raced with a change is not cached.
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+
+_caches = {}
+
+
+def _cache(tournament_id: int) -> _BracketCache:
+    return _caches.setdefault(tournament_id, _BracketCache())
+
+
+def invalidate_round(tournament_id: int, round_num: int):
+    """Drops the cached render of one round, e.g. after a result or when the round is generated."""
+    cache = _cache(tournament_id)
+    cache.generation += 1
+    cache.rounds.pop(round_num, None)
+    if cache.max_round is None or round_num > cache.max_round:
+        cache.max_round = None
+    cache.pages = None
+
+
+def invalidate_all(tournament_id: int):
+    """Drops the whole cache of a tournament, e.g. after it is reset."""
+    cache = _cache(tournament_id)
+    cache.generation += 1
+    cache.rounds.clear()
+    cache.max_round = None
+    cache.pages = None
+
+
+def _render_round(conn, tournament_id: int, tournament_format: str, round_num: int) -> list:
+    matches = conn.execute(
+        "SELECT m.id, m.bracket, m.winner_id, p1.nickname as p1_nick, p2.nickname as p2_nick, w.nickname as winner_nick, m.is_bye, m.double_dq, m.pending_feeders "
+        "FROM matches m "
+        "LEFT JOIN registrations p1 ON m.player1_id = p1.id "
+        "LEFT JOIN registrations p2 ON m.player2_id = p2.id "
+        "LEFT JOIN registrations w ON m.winner_id = w.id "
+        "WHERE m.tournament_id = ? AND m.round = ? "
+        "ORDER BY m.id",
+        (tournament_id, round_num)
+    ).fetchall()
+
+    heading = "Раунд {round}"
+    if matches and tournament_format != 'single':
+        heading = ROUND_HEADINGS[matches[0]['bracket']]
+    lines = [f"\n--- **{heading.format(round=round_num)}** ---"]
+    if not matches:
+        lines.append("_Матчи еще не сгенерированы._")
+        return lines
+
+    for match in matches:
+        if match['is_bye'] and match['bracket'] == 'reset':
+            lines.append(f"Матч {match['id']}: не понадобился, {match['p1_nick']} не проиграл ни разу.")
+            continue
+        if match['is_bye']:
+            lines.append(f"Матч {match['id']}: {match['p1_nick']} получает техническую победу.")
+            continue
+
+        p1 = match['p1_nick'] if match['p1_nick'] else '?'
+        p2 = match['p2_nick'] if match['p2_nick'] else '?'
+
+        if match['winner_nick']:
+            winner = match['winner_nick']
+            if winner == p1:
+                lines.append(f"Матч {match['id']}: **{p1}** vs {p2} -> 👑 {winner}")
+            else:
+                lines.append(f"Матч {match['id']}: {p1} vs **{p2}** -> 👑 {winner}")
+        elif match['double_dq'] and not match['p1_nick'] and not match['p2_nick']:
+            lines.append(f"Матч {match['id']}: нет игроков")
+        elif match['double_dq']: # Both DQ'd
+            lines.append(f"Матч {match['id']}: ~~{p1} vs {p2}~~ (Оба дисквалифицированы)")
+        elif match['pending_feeders']:
+            lines.append(f"Матч {match['id']}: {p1} vs {p2} (Ожидание соперников)")
+        else:
+            lines.append(f"Матч {match['id']}: {p1} vs {p2} (В процессе)")
+    return lines
+
+
+def _render_missing(conn, tournament_id: int, tournament_format: str, max_round, cached: set):
+    if max_round is None:
+        max_round = conn.execute(
+            "SELECT MAX(round) as max_round FROM matches WHERE tournament_id = ?", (tournament_id,)
+        ).fetchone()['max_round'] or 0
+    return max_round, {
+        i: _render_round(conn, tournament_id, tournament_format, i) for i in range(1, max_round + 1) if i not in cached
+    }
+
+
+def _paginate(title: str, rounds: dict, max_round: int) -> list:
+    pages = []
+    header = TITLE.format(title=title)
+    current = header
+    for i in range(1, max_round + 1):
+        for line in rounds[i]:
+            line += "\n"
+            if len(current) + len(line) > PAGE_LIMIT and current != header:
+                pages.append(current)
+                current = header
+            current += line[:PAGE_LIMIT - len(header)]
+    pages.append(current)
+    return pages
+
+
+async def get_bracket_pages(tournament) -> list:
+    """Returns a tournament's bracket split into message-sized pages, or an empty list before it starts."""
+    cache = _cache(tournament.id)
+    if cache.pages is not None:
+        return cache.pages
+    async with cache.lock:
+        if cache.pages is not None:
+            return cache.pages
+        generation = cache.generation
+        cached = dict(cache.rounds)
+        max_round, rendered = await run_query(
+            _render_missing, tournament.id, tournament.format, cache.max_round, set(cached)
+        )
+        rounds = {**cached, **rendered}
+        pages = _paginate(tournament.title, rounds, max_round) if max_round else []
+        if generation == cache.generation:
+            cache.rounds.update(rendered)
+            cache.max_round = max_round
+            cache.pages = pages
+        return pages
@@ -0,0 +1,296 @@
+"""Elimination bracket trees: single and double elimination.
+
+start_tournament builds every match of the event up front. Each match knows the match
+its winner advances to (next_match_id) and which side of it (next_slot); in a double
+elimination bracket a winners' bracket match also knows where its loser drops to
+(loser_next_match_id, loser_next_slot). A later match counts how many feeder matches are
+still undecided (pending_feeders). Recording a result is an O(1) step through the tree:
+each player is written into the slot they move to, and once all feeders of a match are
+decided it is either ready to be played or, if only one player (or nobody) reached it,
+decided on the spot and advanced further.
+
+The double-elimination grand final feeds a reset match, the winners' bracket champion's
+second life. It is only played if the losers' bracket player wins the grand final;
+otherwise it is decided as a bye for the champion.
+
+All functions take a connection and must run inside a transaction on the database thread.
+"""
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Advancement:
+    """What changed in the tree after a result was recorded."""
+    ready: list = field(default_factory=list)
+    rounds: set = field(default_factory=set)
+    # Every match whose players or result changed.
+    matches: set = field(default_factory=set)
+    finished: bool = False
+    champion_id: int = None
+    # Set when a bracket is created.
+    total_rounds: int = 0
+    byes: int = 0
+
+
+def seed_order(size: int) -> list:
+    """Standard bracket order of seeds 1..size, e.g. [1, 8, 4, 5, 2, 7, 3, 6] for 8.
+
+    Pairing seed s with size + 1 - s spreads the byes (the missing highest seeds) so that
+    every bye is in its own first-round match.
+    """
+    order = [1]
+    while len(order) < size:
+        total = len(order) * 2
+        order = [seed for s in order for seed in (s, total + 1 - s)]
+    return order
+
+
+def _first_round(player_ids: list, size: int) -> list:
+    """(player1, player2) of every first-round match in bracket order; a missing player is None."""
+    order = seed_order(size)
+    return [
+        tuple(player_ids[s - 1] if s <= len(player_ids) else None for s in order[i:i + 2])
+        for i in range(0, size, 2)
+    ]
+
+
+def _next_match_id(conn) -> int:
+    """The first unused match id. sqlite_sequence remembers ids of deleted matches, so archived
+    and reset tournaments never share ids with new ones.
+    """
+    return conn.execute(
+        "SELECT MAX(COALESCE((SELECT MAX(id) FROM matches), 0), "
+        "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'matches'), 0)) AS max_id"
+    ).fetchone()['max_id'] + 1
+
+
+def _insert(conn, tournament_id: int, matches: list, first_round: list) -> Advancement:
+    """Inserts the matches and advances the byes of the first round.
+
+    matches are dicts with id, round, bracket, next, next_slot, loser_next, loser_next_slot
+    and pending, listed so that every match comes after the matches it points at, which
+    keeps the foreign keys valid. first_round pairs the ids of the first-round matches with
+    their players.
+    """
+    players = {match_id: pair for match_id, pair in first_round}
+    rows = []
+    for match in matches:
+        p1, p2 = players.get(match['id'], (None, None))
+        bye = match['id'] in players and (p1 is None or p2 is None)
+        if bye:
+            p1, p2 = (p1 if p1 is not None else p2), None
+        rows.append((
+            match['id'], tournament_id, match['round'], match['bracket'], p1, p2, p1 if bye else None, int(bye),
+            match['next'], match['next_slot'], match['loser_next'], match['loser_next_slot'], match['pending']
+        ))
+    conn.executemany(
+        "INSERT INTO matches (id, tournament_id, round, bracket, player1_id, player2_id, winner_id, is_bye, "
+        "next_match_id, next_slot, loser_next_match_id, loser_next_slot, pending_feeders) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+
+    advancement = Advancement(rounds={match['round'] for match in matches})
+    advancement.total_rounds = max(advancement.rounds)
+    for match_id, (p1, p2) in first_round:
+        if p1 is not None and p2 is not None:
+            advancement.ready.append(match_id)
+        else:
+            advancement.byes += 1
+            _advance(conn, match_id, p1 if p1 is not None else p2, None, advancement)
+    return advancement
+
+
+def _match(match_id, round_num, bracket, next_id=None, next_slot=None, pending=2):
+    return {
+        'id': match_id, 'round': round_num, 'bracket': bracket, 'next': next_id, 'next_slot': next_slot,
+        'loser_next': None, 'loser_next_slot': None, 'pending': pending,
+    }
+
+
+def create_bracket(conn, tournament_id: int, player_ids: list) -> Advancement:
+    """Builds the whole single-elimination tree for players given in seed order, and advances byes.
+
+    Returns the matches that are ready to be played.
+    """
+    rounds = max(1, (len(player_ids) - 1).bit_length())
+    size = 1 << rounds
+
+    # Ids are assigned up front so every match can point at its parent: round 1 first,
+    # then round 2 and so on, in bracket order within a round.
+    ids = {}
+    next_id = _next_match_id(conn)
+    for round_num in range(1, rounds + 1):
+        ids[round_num] = range(next_id, next_id + (size >> round_num))
+        next_id += size >> round_num
+
+    matches = []
+    for round_num in range(rounds, 0, -1):
+        for position, match_id in enumerate(ids[round_num]):
+            if round_num == rounds:
+                matches.append(_match(match_id, round_num, 'winners'))
+            else:
+                matches.append(_match(match_id, round_num, 'winners', ids[round_num + 1][position // 2], position % 2 + 1))
+    for match in matches[-(size >> 1):]:
+        match['pending'] = 0
+
+    return _insert(conn, tournament_id, matches, list(zip(ids[1], _first_round(player_ids, size))))
+
+
+def create_double_bracket(conn, tournament_id: int, player_ids: list) -> Advancement:
+    """Builds a double-elimination bracket for players given in seed order, and advances byes.
+
+    With R winners' rounds, winners' round k is round k, losers' round j is round R + j,
+    the grand final is round 3R - 1 and its reset round 3R. Losers' round 1 pairs the
+    losers of winners' round 1; every even losers' round brings in the losers of the next
+    winners' round, in reverse order so rematches come as late as possible; every odd one
+    halves the field. The grand final pairs the winners' bracket champion (slot 1) with the
+    losers' bracket winner (slot 2); both of its players move on to the reset, which
+    _advance settles at once unless the losers' bracket winner took the grand final.
+    """
+    rounds = max(1, (len(player_ids) - 1).bit_length())
+    size = 1 << rounds
+    losers_rounds = 2 * (rounds - 1)
+
+    next_id = _next_match_id(conn)
+    winners = {}
+    for k in range(1, rounds + 1):
+        winners[k] = range(next_id, next_id + (size >> k))
+        next_id += size >> k
+    losers = {}
+    for j in range(1, losers_rounds + 1):
+        count = size >> ((j + 1) // 2 + 1)
+        losers[j] = range(next_id, next_id + count)
+        next_id += count
+    final_id, reset_id = next_id, next_id + 1
+
+    # Inserted from the reset backwards so every match comes after its targets.
+    final = _match(final_id, rounds + losers_rounds + 1, 'final', reset_id, 1)
+    final['loser_next'], final['loser_next_slot'] = reset_id, 2
+    matches = [_match(reset_id, rounds + losers_rounds + 2, 'reset'), final]
+    for j in range(losers_rounds, 0, -1):
+        for position, match_id in enumerate(losers[j]):
+            if j == losers_rounds:
+                matches.append(_match(match_id, rounds + j, 'losers', final_id, 2))
+            elif j % 2:
+                matches.append(_match(match_id, rounds + j, 'losers', losers[j + 1][position], 1))
+            else:
+                matches.append(_match(match_id, rounds + j, 'losers', losers[j + 1][position // 2], position % 2 + 1))
+    for k in range(rounds, 0, -1):
+        for position, match_id in enumerate(winners[k]):
+            if k == rounds:
+                match = _match(match_id, k, 'winners', final_id, 1)
+            else:
+                match = _match(match_id, k, 'winners', winners[k + 1][position // 2], position % 2 + 1)
+            if rounds == 1:
+                match['loser_next'], match['loser_next_slot'] = final_id, 2
+            elif k == 1:
+                match['loser_next'], match['loser_next_slot'] = losers[1][position // 2], position % 2 + 1
+            else:
+                dropped = losers[2 * (k - 1)]
+                match['loser_next'], match['loser_next_slot'] = dropped[len(dropped) - 1 - position], 2
+            if k == 1:
+                match['pending'] = 0
+            matches.append(match)
+
+    return _insert(conn, tournament_id, matches, list(zip(winners[1], _first_round(player_ids, size))))
+
+
+def store_result(conn, match_id: int, winner_id) -> bool:
+    """Stores the result of a playable match that has no result yet. A winner_id of None means
+    both players were disqualified; otherwise it must be one of the match's players.
+
+    Returns False when the update did not apply, e.g. because another admin recorded the
+    result first, so whatever follows a result happens exactly once per match.
+    """
+    open_match = "id = ? AND winner_id IS NULL AND double_dq = 0 AND is_bye = 0 AND pending_feeders = 0"
+    if winner_id is None:
+        cursor = conn.execute(f"UPDATE matches SET double_dq = 1 WHERE {open_match}", (match_id,))
+    else:
+        cursor = conn.execute(
+            f"UPDATE matches SET winner_id = ? WHERE {open_match} AND ? IN (player1_id, player2_id)",
+            (winner_id, match_id, winner_id)
+        )
+    return cursor.rowcount > 0
+
+
+def record_result(conn, match_id: int, winner_id):
+    """Stores the result of a match and advances its players. A winner_id of None means both players were disqualified.
+
+    Returns None when the result did not apply (see store_result).
+    """
+    if not store_result(conn, match_id, winner_id):
+        return None
+
+    match = conn.execute("SELECT round, player1_id, player2_id FROM matches WHERE id = ?", (match_id,)).fetchone()
+    loser_id = None
+    if winner_id is not None:
+        loser_id = match['player2_id'] if winner_id == match['player1_id'] else match['player1_id']
+    advancement = Advancement(rounds={match['round']}, matches={match_id})
+    _advance(conn, match_id, winner_id, loser_id, advancement)
+    return advancement
+
+
+def _advance(conn, match_id: int, winner_id, loser_id, advancement: Advancement):
+    """Moves the players of a decided match into the matches they feed, deciding on the spot
+    every match that only one player (or nobody) reached, until only undecided matches are left.
+    """
+    decided = [(match_id, winner_id, loser_id)]
+    while decided:
+        match_id, winner_id, loser_id = decided.pop()
+        match = conn.execute(
+            "SELECT bracket, player1_id, next_match_id, next_slot, loser_next_match_id, loser_next_slot "
+            "FROM matches WHERE id = ?",
+            (match_id,)
+        ).fetchone()
+        if match['next_match_id'] is None:
+            advancement.finished = True
+            advancement.champion_id = winner_id
+            continue
+        if match['bracket'] == 'final' and winner_id is not None and winner_id == match['player1_id']:
+            # The winners' bracket champion has not lost, so the reset is not played.
+            reset_id = match['next_match_id']
+            conn.execute(
+                "UPDATE matches SET player1_id = ?, player2_id = NULL, winner_id = ?, is_bye = 1, "
+                "pending_feeders = 0 WHERE id = ?",
+                (winner_id, winner_id, reset_id)
+            )
+            reset = conn.execute("SELECT round FROM matches WHERE id = ?", (reset_id,)).fetchone()
+            advancement.rounds.add(reset['round'])
+            advancement.matches.add(reset_id)
+            decided.append((reset_id, winner_id, None))
+            continue
+
+        moves = [(match['next_match_id'], match['next_slot'], winner_id)]
+        if match['loser_next_match_id'] is not None:
+            moves.append((match['loser_next_match_id'], match['loser_next_slot'], loser_id))
+        for target_id, slot, player_id in moves:
+            column = 'player1_id' if slot == 1 else 'player2_id'
+            conn.execute(
+                f"UPDATE matches SET {column} = ?, pending_feeders = pending_feeders - 1 WHERE id = ?",
+                (player_id, target_id)
+            )
+            target = conn.execute(
+                "SELECT round, player1_id, player2_id, pending_feeders FROM matches WHERE id = ?", (target_id,)
+            ).fetchone()
+            advancement.rounds.add(target['round'])
+            advancement.matches.add(target_id)
+            if target['pending_feeders'] > 0:
+                continue
+
+            p1, p2 = target['player1_id'], target['player2_id']
+            if p1 is not None and p2 is not None:
+                advancement.ready.append(target_id)
+                continue
+
+            # At most one player reached this match, so it is decided without being played.
+            if p1 is None and p2 is None:
+                conn.execute("UPDATE matches SET double_dq = 1 WHERE id = ?", (target_id,))
+                decided.append((target_id, None, None))
+            else:
+                player = p1 if p1 is not None else p2
+                conn.execute(
+                    "UPDATE matches SET player1_id = ?, player2_id = NULL, winner_id = ?, is_bye = 1 WHERE id = ?",
+                    (player, player, target_id)
+                )
+                decided.append((target_id, player, None))
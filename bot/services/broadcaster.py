@@ -0,0 +1,140 @@
+"""Runs broadcast jobs in the background.
+
+Each job gets a task that queues the job's recipients chunk by chunk, waking the outbox
+worker after every chunk so sending starts before queueing ends, and then edits the
+admin's progress message every PROGRESS_INTERVAL seconds until every message has been
+sent or the job is cancelled. A job whose queueing fails is marked failed and its
+unsent messages are dropped. Jobs left unfinished by a shutdown are picked up again at
+startup.
+"""
+import asyncio
+import logging
+import time
+
+from telegram.error import TelegramError
+
+from ..data.broadcasts import active_broadcasts, fail_broadcast, progress, queue_chunk
+from ..data.database import run_query, run_transaction
+from . import metrics
+from .outbox_worker import wake_outbox_worker
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 3
+
+SEGMENT_LABELS = {
+    'all': "все участники",
+    'alive': "оставшиеся в турнире",
+    'unreported': "с матчем без результата",
+    'round': "игроки раунда {arg}",
+    'character': "игроки за {arg}",
+}
+STATUS_LABELS = {
+    'queueing': "подготовка списка",
+    'sending': "отправка",
+    'done': "завершена",
+    'cancelled': "отменена",
+    'failed': "ошибка",
+}
+# Why the messages still queued when a job stopped early were not sent.
+DROPPED_LABELS = {
+    'cancelled': "Не отправлено из-за отмены",
+    'failed': "Не отправлено из-за ошибки",
+}
+
+_bot = None
+_tasks = {}
+
+
+def segment_label(segment: str, arg) -> str:
+    return SEGMENT_LABELS[segment].format(arg=arg)
+
+
+def progress_text(job: dict) -> str:
+    """The text of a job's progress message."""
+    active = job['status'] in ('queueing', 'sending')
+    lines = [
+        f"📢 Рассылка #{job['id']}: «{job['title']}», {segment_label(job['segment'], job['segment_arg'])}",
+        f"Статус: {STATUS_LABELS[job['status']]}",
+        f"Получателей: {job['queued']}" + (f" из {job['total']}" if job['status'] in ('queueing', 'failed') else ""),
+        f"Доставлено: {job['delivered']}, ошибок: {job['failed']}, в очереди: {job['waiting']}",
+    ]
+    dropped = job['queued'] - job['delivered'] - job['failed'] - job['waiting']
+    if job['status'] in DROPPED_LABELS and dropped > 0:
+        lines.append(f"{DROPPED_LABELS[job['status']]}: {dropped}")
+    if active:
+        lines.append(f"Отменить: /cancel_broadcast {job['id']}")
+    return "\n".join(lines)
+
+
+async def start_broadcaster(bot):
+    """Resumes the jobs a previous run left unfinished."""
+    global _bot
+    _bot = bot
+    for job in await run_query(active_broadcasts):
+        logger.info("Resuming broadcast %d", job['id'])
+        run_broadcast(job['id'])
+
+
+def run_broadcast(broadcast_id: int):
+    """Starts the background task of a job that has just been created."""
+    if broadcast_id not in _tasks:
+        _tasks[broadcast_id] = asyncio.create_task(_run(broadcast_id))
+
+
+async def stop_broadcaster():
+    """Stops the job tasks; their state is in the database and they resume at the next start."""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+async def _report(broadcast_id: int, last_text: str):
+    """Edits the progress message if its text changed. Returns the job and the current text."""
+    job = await run_transaction(progress, broadcast_id)
+    text = progress_text(job)
+    if text != last_text and job['progress_message_id']:
+        try:
+            await _bot.edit_message_text(text, chat_id=job['chat_id'], message_id=job['progress_message_id'])
+        except TelegramError as e:
+            if "not modified" not in str(e):
+                logger.warning("Could not update the progress of broadcast %d: %s", broadcast_id, e)
+    return job, text
+
+
+async def _queue(broadcast_id: int):
+    """Queues the job's recipients chunk by chunk, reporting progress on the way. Returns the last text reported."""
+    text = None
+    reported_at = time.monotonic()
+    while await run_transaction(queue_chunk, broadcast_id):
+        wake_outbox_worker()
+        if time.monotonic() - reported_at >= PROGRESS_INTERVAL:
+            _, text = await _report(broadcast_id, text)
+            reported_at = time.monotonic()
+    return text
+
+
+async def _run(broadcast_id: int):
+    metrics.current_handler.set('broadcaster')
+    text = None
+    try:
+        try:
+            text = await _queue(broadcast_id)
+        except Exception:
+            logger.exception("Could not queue broadcast %d", broadcast_id)
+            await run_transaction(fail_broadcast, broadcast_id)
+        wake_outbox_worker()
+        while True:
+            job, text = await _report(broadcast_id, text)
+            # A cancelled or failed job still waits for the batch the outbox worker is sending.
+            if job['status'] not in ('queueing', 'sending') and not job['waiting']:
+                break
+            await asyncio.sleep(PROGRESS_INTERVAL)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Broadcast %d failed", broadcast_id)
+    finally:
+        _tasks.pop(broadcast_id, None)
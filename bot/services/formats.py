@@ -0,0 +1,45 @@
+"""Tournament formats and the engine behind each.
+
+A tournament's format is set with /set_format before it starts. Elimination formats build
+their whole bracket at the start (bracket_engine); Swiss pairs one round at a time from
+the standings (swiss_engine). Every engine reports what changed as an Advancement.
+
+All functions take a connection and must run inside a transaction on the database thread.
+"""
+from dataclasses import dataclass
+from typing import Callable
+
+from .bracket_engine import create_bracket, create_double_bracket, record_result
+from .swiss_engine import create_swiss, record_swiss_result
+
+
+@dataclass(frozen=True)
+class Format:
+    label: str
+    # create(conn, tournament_id, player_ids in seed order) -> Advancement
+    create: Callable
+    # record(conn, match_id, winner_id or None) -> Advancement, or None if it did not apply
+    record: Callable
+
+
+FORMATS = {
+    'single': Format("олимпийская система", create_bracket, record_result),
+    'double': Format("до двух поражений (double elimination)", create_double_bracket, record_result),
+    'swiss': Format("швейцарская система", create_swiss, record_swiss_result),
+}
+
+
+def create_matches(conn, tournament_id: int, player_ids: list):
+    """Creates the first matches of a tournament in its format."""
+    tournament_format = conn.execute("SELECT format FROM tournaments WHERE id = ?", (tournament_id,)).fetchone()['format']
+    return FORMATS[tournament_format].create(conn, tournament_id, player_ids)
+
+
+def record_match_result(conn, match_id: int, winner_id):
+    """Records a result with the engine of the match's tournament format."""
+    row = conn.execute(
+        "SELECT t.format FROM matches m JOIN tournaments t ON m.tournament_id = t.id WHERE m.id = ?", (match_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return FORMATS[row['format']].record(conn, match_id, winner_id)
@@ -0,0 +1,265 @@
+"""In-process metrics for finding slow commands during live events.
+
+Every registered handler is wrapped by instrument_handlers(): its latency goes into a
+histogram and its exceptions are counted. The name of the running handler is kept in a
+context variable, so the database layer charges SQL statements and time to the handler
+that ran them; work outside handlers is charged to the background task's label. The
+RateLimiter counts Bot API requests by outcome and reports its queue depth.
+
+Everything is exported in the Prometheus text format on an optional local HTTP port, with
+totals since start. The log summary at a fixed interval covers only that interval. Only
+the standard library is used.
+"""
+import asyncio
+import bisect
+import contextvars
+import logging
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# How many handlers the periodic summary lists.
+SUMMARY_TOP = 5
+
+current_handler = contextvars.ContextVar('current_handler', default='background')
+
+
+class Histogram:
+    """Counts observations per bucket, plus their sum."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th observation; inf if it is past the last bucket."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+_latency = defaultdict(Histogram)
+# Latency since the last log summary.
+_window = defaultdict(Histogram)
+_errors = Counter()
+_sql_calls = Counter()
+_sql_statements = Counter()
+_sql_seconds = defaultdict(float)
+_requests = Counter()
+_throttled = Counter()
+_gauges = {}
+# The counters as they stood at the end of the last summary interval; the summary reports the difference.
+_summarized = {}
+
+_server = None
+_summary_task = None
+
+
+def observe_sql(handler: str, statements: int, seconds: float):
+    """Records one trip to the database thread."""
+    _sql_calls[handler] += 1
+    _sql_statements[handler] += statements
+    _sql_seconds[handler] += seconds
+
+
+def count_request(endpoint: str, outcome: str):
+    """Records a Bot API request outcome: 'ok', 'failed' or 'retried'."""
+    _requests[endpoint, outcome] += 1
+
+
+def count_throttled(reason: str):
+    """Records an update dropped or answered early by the throttling handler."""
+    _throttled[reason] += 1
+
+
+def register_gauge(name: str, description: str, func):
+    """Exports func() as a gauge at every scrape."""
+    _gauges[name] = (description, func)
+
+
+def _instrument(callback):
+    name = callback.__name__
+
+    @wraps(callback)
+    async def wrapped(update, context, *args, **kwargs):
+        token = current_handler.set(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context, *args, **kwargs)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            _errors[name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _latency[name].observe(elapsed)
+            _window[name].observe(elapsed)
+            current_handler.reset(token)
+
+    return wrapped
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            _instrument_handler(inner)
+        for handlers in handler.states.values():
+            for inner in handlers:
+                _instrument_handler(inner)
+    elif hasattr(handler, 'callback'):
+        handler.callback = _instrument(handler.callback)
+
+
+def instrument_handlers(application):
+    """Wraps the callback of every handler registered on the application, including conversation states."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP bot_handler_duration_seconds Time spent in an update handler.",
+        "# TYPE bot_handler_duration_seconds histogram",
+    ]
+    for name, histogram in sorted(_latency.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.buckets):
+            cumulative += count
+            lines.append(f"bot_handler_duration_seconds_bucket{_labels(handler=name, le=bound)} {cumulative}")
+        lines.append(f"bot_handler_duration_seconds_sum{_labels(handler=name)} {histogram.sum}")
+        lines.append(f"bot_handler_duration_seconds_count{_labels(handler=name)} {histogram.count}")
+
+    counters = [
+        ("bot_handler_errors_total", "Exceptions raised by an update handler.", _errors),
+        ("bot_sql_calls_total", "Trips to the database thread.", _sql_calls),
+        ("bot_sql_statements_total", "SQL statements executed.", _sql_statements),
+        ("bot_sql_seconds_total", "Time spent executing SQL on the database thread.", _sql_seconds),
+    ]
+    for metric, description, values in counters:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+        lines += [f"{metric}{_labels(handler=name)} {value}" for name, value in sorted(values.items())]
+
+    lines += [
+        "# HELP bot_telegram_requests_total Bot API requests by outcome.",
+        "# TYPE bot_telegram_requests_total counter",
+    ]
+    lines += [
+        f"bot_telegram_requests_total{_labels(endpoint=endpoint, outcome=outcome)} {value}"
+        for (endpoint, outcome), value in sorted(_requests.items())
+    ]
+
+    lines += [
+        "# HELP bot_throttled_updates_total Updates dropped or answered early by the throttling handler.",
+        "# TYPE bot_throttled_updates_total counter",
+    ]
+    lines += [
+        f"bot_throttled_updates_total{_labels(reason=reason)} {value}" for reason, value in sorted(_throttled.items())
+    ]
+
+    for name, (description, func) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {func()}"]
+    return "\n".join(lines) + "\n"
+
+
+def _counters() -> dict:
+    return {
+        'errors': Counter(_errors), 'sql_statements': Counter(_sql_statements), 'sql_seconds': Counter(_sql_seconds),
+        'requests': Counter(_requests), 'throttled': Counter(_throttled),
+    }
+
+
+def summary() -> str:
+    """One log line per busiest handler since the last summary, slowest first. Every number,
+    counters included, covers only the time since the last summary.
+    """
+    counters = {name: values - _summarized.get(name, Counter()) for name, values in _counters().items()}
+    errors, statements, seconds = counters['errors'], counters['sql_statements'], counters['sql_seconds']
+    requests, throttled = counters['requests'], counters['throttled']
+    busiest = sorted(_window.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:SUMMARY_TOP]
+    lines = [
+        f"{name}: {h.count} calls, p50 {h.quantile(0.5) * 1000:.0f}ms, p99 {h.quantile(0.99) * 1000:.0f}ms, "
+        f"errors {errors[name]}, SQL {statements[name]} statements in {seconds[name]:.2f}s"
+        for name, h in busiest
+    ]
+    sent = sum(value for (_, outcome), value in requests.items() if outcome == 'ok')
+    failed = sum(value for (_, outcome), value in requests.items() if outcome == 'failed')
+    retried = sum(value for (_, outcome), value in requests.items() if outcome == 'retried')
+    lines.append(f"Bot API requests: ok {sent}, failed {failed}, retried {retried}")
+    if throttled:
+        lines.append("Throttled: " + ", ".join(f"{reason} {value}" for reason, value in sorted(throttled.items())))
+    return "\n".join(lines)
+
+
+async def _log_summaries(interval: float):
+    global _summarized
+    while True:
+        await asyncio.sleep(interval)
+        if _window:
+            logger.info("Metrics for the last %ds:\n%s", interval, summary())
+            _window.clear()
+        _summarized = _counters()
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics(listen: str, port: int, log_interval: float):
+    """Starts the scrape endpoint (if port is set) and the periodic log summary (if log_interval is set)."""
+    global _server, _summary_task
+    if port:
+        _server = await asyncio.start_server(_serve, listen, port)
+        logger.info("Metrics on http://%s:%s/metrics", listen, _server.sockets[0].getsockname()[1])
+    if log_interval:
+        _summary_task = asyncio.create_task(_log_summaries(log_interval))
+
+
+async def stop_metrics():
+    global _server, _summary_task
+    if _summary_task is not None:
+        _summary_task.cancel()
+        _summary_task = None
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -0,0 +1,108 @@
+"""Background worker that delivers messages queued in the outbox table."""
+import asyncio
+import json
+import logging
+import time
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden
+
+from ..data.database import run_transaction
+from ..data.outbox import claim_batch, record_results, requeue_interrupted
+from . import metrics
+from .sender import PRIORITY_BULK, SendJob
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+# How often the worker looks for due retries when nobody wakes it up.
+POLL_INTERVAL = 5
+MAX_ATTEMPTS = 8
+RETRY_BASE = 2
+RETRY_MAX = 600
+
+_task = None
+_wakeup = None
+_stopping = False
+
+
+def wake_outbox_worker():
+    """Tells the worker that new messages were queued."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def start_outbox_worker(bot):
+    """Requeues messages interrupted by a previous shutdown and starts draining the outbox."""
+    global _task, _wakeup, _stopping
+    requeued = await run_transaction(requeue_interrupted)
+    if requeued:
+        logger.info("Requeued %d interrupted outbox messages", requeued)
+    _stopping = False
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_run(bot))
+
+
+async def stop_outbox_worker():
+    """Lets the batch in flight finish, then stops the worker."""
+    global _task, _stopping
+    if _task is None:
+        return
+    _stopping = True
+    _wakeup.set()
+    await _task
+    _task = None
+
+
+async def _run(bot):
+    metrics.current_handler.set('outbox_worker')
+    while not _stopping:
+        _wakeup.clear()
+        try:
+            batch = await run_transaction(claim_batch, BATCH_SIZE, time.time())
+            if batch:
+                await _deliver(bot, batch)
+                continue
+        except Exception:
+            logger.exception("Outbox worker iteration failed")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _deliver(bot, batch: list):
+    job = SendJob("outbox")
+
+    async def send(row):
+        reply_markup = None
+        if row['reply_markup']:
+            reply_markup = InlineKeyboardMarkup.de_json(json.loads(row['reply_markup']), bot)
+        try:
+            await bot.send_message(
+                chat_id=row['chat_id'], text=row['text'], reply_markup=reply_markup,
+                rate_limit_args={'priority': PRIORITY_BULK, 'job': job}
+            )
+            return row, None, False
+        except (BadRequest, Forbidden) as e:
+            return row, e, True
+        except Exception as e:
+            return row, e, False
+
+    delivered, retries, failed = [], [], []
+    now = time.time()
+    for row, error, permanent in await asyncio.gather(*(send(row) for row in batch)):
+        if error is None:
+            delivered.append(row['id'])
+            job.sent += 1
+            continue
+        job.failed += 1
+        logger.warning("Failed to send %s message to %s: %s", row['job'], row['chat_id'], error)
+        attempts = row['attempts'] + 1
+        if permanent or attempts >= MAX_ATTEMPTS:
+            failed.append((row['id'], str(error)))
+        else:
+            retries.append((row['id'], str(error), now + min(RETRY_MAX, RETRY_BASE ** attempts)))
+
+    await run_transaction(record_results, delivered, retries, failed, time.time())
+    logger.info("Outbox batch: sent=%d failed=%d retried=%d", job.sent, job.failed, job.retried)
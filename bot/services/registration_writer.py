@@ -0,0 +1,114 @@
+"""Group commit for registrations.
+
+When registration opens, many players finish /register within seconds. Instead of one
+transaction per player, registrations arriving within BATCH_WINDOW seconds are written
+together in one transaction on the database thread. Each row runs in its own savepoint,
+so a taken nickname or character, or a second registration of the same account, only
+fails that row. The insert itself checks that the tournament still takes registrations,
+as /start_tournament or /close_registration may commit while a row waits for its batch. Every waiting
+handler gets its own outcome: None, or the sqlite3.IntegrityError for its row.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+
+from ..data.database import run_transaction
+from ..data.player_status import refresh_players
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long the first registration of a batch waits for others to join it.
+BATCH_WINDOW = 0.005
+# A batch this large is written at once without waiting for the window to end.
+MAX_BATCH = 500
+
+# (row, future) pairs waiting for the next batch.
+_pending = []
+_flush_task = None
+
+
+class RegistrationClosed(Exception):
+    """The tournament closed registration or started before the row was written."""
+
+
+def _insert_registrations(conn, rows: list) -> list:
+    """Inserts the registrations of one batch. Returns None, RegistrationClosed or the
+    IntegrityError for each row.
+    """
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (telegram_id, username) VALUES (?, ?)",
+        [(row[1], row[2]) for row in rows]
+    )
+    user_ids = {
+        r['telegram_id']: r['id']
+        for r in conn.execute(
+            "SELECT id, telegram_id FROM users WHERE telegram_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([row[1] for row in rows]),)
+        )
+    }
+
+    results = []
+    registered = []
+    for tournament_id, telegram_id, _, nickname, character_name in rows:
+        conn.execute("SAVEPOINT registration")
+        try:
+            cursor = conn.execute(
+                "INSERT INTO registrations (tournament_id, user_id, nickname, character_name) "
+                "SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM tournaments "
+                "WHERE id = ? AND registration_open = 1 AND status = 'registration')",
+                (tournament_id, user_ids[telegram_id], nickname, character_name, tournament_id)
+            )
+        except sqlite3.IntegrityError as e:
+            conn.execute("ROLLBACK TO registration")
+            results.append(e)
+        else:
+            if cursor.rowcount:
+                results.append(None)
+                registered.append(cursor.lastrowid)
+            else:
+                results.append(RegistrationClosed())
+        conn.execute("RELEASE registration")
+    refresh_players(conn, registered)
+    return results
+
+
+async def _flush():
+    global _flush_task
+    # The batch is written for many handlers; don't charge it to the one that started the task.
+    metrics.current_handler.set('registration_writer')
+    if len(_pending) < MAX_BATCH:
+        await asyncio.sleep(BATCH_WINDOW)
+    batch = _pending[:MAX_BATCH]
+    del _pending[:MAX_BATCH]
+    # Registrations that arrived meanwhile go into the next batch.
+    _flush_task = asyncio.create_task(_flush()) if _pending else None
+
+    try:
+        results = await run_transaction(_insert_registrations, [row for row, _ in batch])
+    except Exception as e:
+        logger.exception("Failed to write a batch of %d registrations", len(batch))
+        results = [e] * len(batch)
+    for (_, future), result in zip(batch, results):
+        if future.done():
+            continue
+        if result is None:
+            future.set_result(None)
+        else:
+            future.set_exception(result)
+
+
+async def register_player(tournament_id: int, telegram_id: int, username, nickname: str, character_name=None):
+    """Registers a player in the next batch and waits for it to be committed.
+
+    Raises sqlite3.IntegrityError if the nickname or character is already taken in the tournament,
+    or if the user is already registered in it; the message names the column that clashed.
+    Raises RegistrationClosed if the tournament no longer takes registrations.
+    """
+    global _flush_task
+    future = asyncio.get_running_loop().create_future()
+    _pending.append(((tournament_id, telegram_id, username, nickname, character_name), future))
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush())
+    await future
@@ -0,0 +1,205 @@
+"""Shared outbound scheduling for everything the bot sends to Telegram.
+
+Every Bot API call goes through RateLimiter (installed on the Application in bot.py),
+which enforces the global, per-chat and per-group message limits with token buckets, honors
+RetryAfter, retries transient network errors with backoff and lets interactive
+replies overtake bulk traffic. Bulk messages are queued in the outbox and sent by
+bot/services/outbox_worker.py on top of it.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per second per chat.
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+# Edits of a message already sent, e.g. admin consoles, have their own per-chat allowance,
+# so a burst of edits does not hold up new messages to the same chat.
+EDIT_RATE = 5
+EDIT_BURST = 10
+# Groups and channels allow about 20 new messages per minute on top of the per-chat limit.
+GROUP_RATE = 20 / 60
+GROUP_BURST = 3
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# Idle per-chat buckets are dropped once there are more than this many.
+MAX_CHAT_BUCKETS = 10000
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self) -> float:
+        """Takes a token if one is available. Returns 0, or how many seconds to wait for the next token."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class SendJob:
+    """Delivery counters for one group of sends, e.g. a broadcast or a round of notifications."""
+    name: str
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+
+
+def _seconds(delay) -> float:
+    return delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+
+
+class RateLimiter(BaseRateLimiter):
+    """Token-bucket rate limiter with priorities and retries for all Bot API requests.
+
+    Callers can pass rate_limit_args={'priority': PRIORITY_BULK, 'job': job} to any Bot method;
+    requests without it are treated as interactive replies.
+    """
+
+    def __init__(self):
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._chats = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._paused_until = 0.0
+        metrics.register_gauge(
+            "bot_send_queue_depth", "Bot API requests waiting for a global send token.", lambda: len(self._waiting)
+        )
+
+    async def initialize(self):
+        # Both the Application and its Updater initialize the bot, so this runs more than once.
+        if self._dispatcher is None:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    def _chat_bucket(self, key, rate: float, capacity: float) -> TokenBucket:
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_full()}
+            bucket = self._chats[key] = TokenBucket(rate, capacity)
+        return bucket
+
+    def _chat_buckets(self, chat_id, endpoint: str) -> list:
+        """The per-chat buckets a request takes a token from: the edit allowance for edits,
+        otherwise the chat's message bucket plus the per-minute one of a group or channel.
+        """
+        if endpoint.startswith('editMessage'):
+            return [self._chat_bucket(('edit', chat_id), EDIT_RATE, EDIT_BURST)]
+        buckets = [self._chat_bucket(('send', chat_id), CHAT_RATE, CHAT_BURST)]
+        # Group and channel ids are negative; a channel can also be addressed by its @username.
+        if str(chat_id).startswith(('-', '@')):
+            buckets.append(self._chat_bucket(('group', chat_id), GROUP_RATE, GROUP_BURST))
+        return buckets
+
+    async def _dispatch(self):
+        """Hands out global tokens to waiting requests, lowest priority value first."""
+        while True:
+            if not self._waiting:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            delay = self._global.try_consume()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                future.set_result(None)
+
+    async def _acquire(self, chat_id, endpoint: str, priority: int):
+        if chat_id is not None:
+            for bucket in self._chat_buckets(chat_id, endpoint):
+                while delay := bucket.try_consume():
+                    await asyncio.sleep(delay)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+        self._wakeup.set()
+        await future
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        options = rate_limit_args or {}
+        priority = options.get('priority', PRIORITY_INTERACTIVE)
+        job = options.get('job')
+        chat_id = data.get('chat_id')
+
+        for attempt in range(MAX_RETRIES + 1):
+            if chat_id is not None:
+                await self._acquire(chat_id, endpoint, priority)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == MAX_RETRIES:
+                    metrics.count_request(endpoint, 'failed')
+                    raise
+                delay = _seconds(exc.retry_after)
+                # Flood control applies to the whole bot, so everyone waits.
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                logger.warning("Flood control on %s, pausing sends for %.1fs", endpoint, delay)
+            except (BadRequest, Forbidden):
+                metrics.count_request(endpoint, 'failed')
+                raise
+            except NetworkError:
+                if attempt == MAX_RETRIES:
+                    metrics.count_request(endpoint, 'failed')
+                    raise
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+                await asyncio.sleep(delay)
+            else:
+                metrics.count_request(endpoint, 'ok')
+                return result
+            metrics.count_request(endpoint, 'retried')
+            if job is not None:
+                job.retried += 1
+
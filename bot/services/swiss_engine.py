@@ -0,0 +1,235 @@
+"""Swiss-system pairing.
+
+Every player plays every round; nobody is eliminated by losing. Players disqualified together
+in a double DQ are out: they keep their standings row but are not paired again, and the
+tournament ends early once fewer than two players are left. A single DQ is a loss for the
+disqualified player, who plays on. The standings table keeps each
+player's points, wins, losses and byes, and is updated in place as results come in. When
+the last match of a round is decided, the next round is paired from the standings:
+
+- players are ranked by points, then seed
+- with an odd number of players the lowest-ranked player who has not had a bye yet gets
+  one, worth a win
+- within each score group the top half plays the bottom half, each player taking the
+  first opponent they have not met yet; whoever cannot be paired that way floats down to
+  the next group
+- two players still left after the last group who have already met trade partners with
+  a pair from the lowest groups; only if no trade works do they play a rematch
+
+After the last round the champion is the leader by points, then Buchholz (the sum of the
+opponents' points), then seed.
+
+All functions take a connection and must run inside a transaction on the database thread.
+"""
+from collections import defaultdict
+from itertools import groupby
+
+from .bracket_engine import Advancement, store_result
+
+WIN_POINTS = 1
+BYE_POINTS = 1
+
+# Registrations disqualified in a double DQ; they take no part in later rounds.
+DISQUALIFIED_SQL = (
+    "SELECT player1_id FROM matches WHERE tournament_id = :tournament_id AND double_dq = 1 "
+    "UNION SELECT player2_id FROM matches WHERE tournament_id = :tournament_id AND double_dq = 1"
+)
+
+RANKING_SQL = (
+    "WITH disqualified AS (" + DISQUALIFIED_SQL + "), games AS ("
+    "SELECT player1_id AS player, player2_id AS opponent FROM matches "
+    "WHERE tournament_id = :tournament_id AND player2_id IS NOT NULL "
+    "UNION ALL SELECT player2_id, player1_id FROM matches "
+    "WHERE tournament_id = :tournament_id AND player2_id IS NOT NULL) "
+    "SELECT s.registration_id, r.nickname, s.points, s.wins, s.losses, s.byes, "
+    "COALESCE(SUM(o.points), 0) AS buchholz, "
+    "s.registration_id IN (SELECT player1_id FROM disqualified) AS disqualified "
+    "FROM standings s "
+    "JOIN registrations r ON s.registration_id = r.id "
+    "LEFT JOIN games g ON g.player = s.registration_id "
+    "LEFT JOIN standings o ON o.registration_id = g.opponent "
+    "WHERE s.tournament_id = :tournament_id "
+    "GROUP BY s.registration_id "
+    "ORDER BY disqualified, s.points DESC, buchholz DESC, s.seed"
+)
+
+
+def total_rounds(conn, tournament_id: int) -> int:
+    """The configured number of rounds, or enough rounds to leave a single unbeaten player."""
+    row = conn.execute(
+        "SELECT t.swiss_rounds, COUNT(s.registration_id) AS players FROM tournaments t "
+        "LEFT JOIN standings s ON s.tournament_id = t.id WHERE t.id = ?",
+        (tournament_id,)
+    ).fetchone()
+    rounds = row['swiss_rounds'] or (row['players'] - 1).bit_length()
+    return max(1, min(rounds, row['players'] - 1))
+
+
+def _pair_group(players: list, opponents: dict) -> tuple:
+    """Pairs players avoiding rematches, scanning forward for each. Returns (pairs, unpaired)."""
+    pairs = []
+    unpaired = []
+    remaining = list(players)
+    while remaining:
+        player = remaining.pop(0)
+        for i, candidate in enumerate(remaining):
+            if candidate not in opponents[player]:
+                pairs.append((player, remaining.pop(i)))
+                break
+        else:
+            unpaired.append(player)
+    return pairs, unpaired
+
+
+def pair_players(ranked: list, opponents: dict, had_bye: set) -> tuple:
+    """Pairs one round. ranked is [(player_id, points)] best first, opponents maps a player to
+    the set of players they have met. Returns (pairs, bye_player_id or None).
+    """
+    players = list(ranked)
+    bye = None
+    if len(players) % 2:
+        index = next((i for i in range(len(players) - 1, -1, -1) if players[i][0] not in had_bye), len(players) - 1)
+        bye = players.pop(index)[0]
+
+    pairs = []
+    floaters = []
+    for _, group in groupby(players, key=lambda player: player[1]):
+        pool = floaters + [player_id for player_id, _ in group]
+        floaters = [pool.pop()] if len(pool) % 2 else []
+        half = len(pool) // 2
+        top, bottom = pool[:half], pool[half:]
+        leftovers = []
+        for player in top:
+            for i, candidate in enumerate(bottom):
+                if candidate not in opponents[player]:
+                    pairs.append((player, bottom.pop(i)))
+                    break
+            else:
+                leftovers.append(player)
+        group_pairs, unpaired = _pair_group(leftovers + bottom, opponents)
+        pairs += group_pairs
+        floaters = unpaired + floaters
+
+    last_pairs, unpaired = _pair_group(floaters, opponents)
+    pairs += last_pairs
+    for first, second in zip(unpaired[::2], unpaired[1::2]):
+        pairs.append(_swap(pairs, first, second, opponents))
+    return pairs, bye
+
+
+def _swap(pairs: list, first: int, second: int, opponents: dict) -> tuple:
+    """Pairs two players who have met by trading partners with an existing pair, lowest pairs
+    first, so that nobody plays a rematch. Falls back to the rematch if no trade works.
+    """
+    for i in range(len(pairs) - 1, -1, -1):
+        a, b = pairs[i]
+        for x, y in ((a, b), (b, a)):
+            if x not in opponents[first] and y not in opponents[second]:
+                pairs[i] = (first, x)
+                return second, y
+    return first, second
+
+
+def _pair_round(conn, tournament_id: int, round_num: int, advancement: Advancement):
+    """Pairs a round from the current standings, leaving out disqualified players, and inserts its matches."""
+    ranked = conn.execute(
+        "SELECT registration_id, points, byes FROM standings WHERE tournament_id = :tournament_id "
+        "AND registration_id NOT IN (" + DISQUALIFIED_SQL + ") ORDER BY points DESC, seed",
+        {'tournament_id': tournament_id}
+    ).fetchall()
+    opponents = defaultdict(set)
+    for match in conn.execute(
+        "SELECT player1_id, player2_id FROM matches WHERE tournament_id = ? AND player2_id IS NOT NULL",
+        (tournament_id,)
+    ):
+        opponents[match['player1_id']].add(match['player2_id'])
+        opponents[match['player2_id']].add(match['player1_id'])
+
+    pairs, bye = pair_players(
+        [(row['registration_id'], row['points']) for row in ranked],
+        opponents,
+        {row['registration_id'] for row in ranked if row['byes']}
+    )
+    conn.executemany(
+        "INSERT INTO matches (tournament_id, round, bracket, player1_id, player2_id, pending_feeders) "
+        "VALUES (?, ?, 'swiss', ?, ?, 0)",
+        [(tournament_id, round_num, p1, p2) for p1, p2 in pairs]
+    )
+    if bye is not None:
+        conn.execute(
+            "INSERT INTO matches (tournament_id, round, bracket, player1_id, winner_id, is_bye, pending_feeders) "
+            "VALUES (?, ?, 'swiss', ?, ?, 1, 0)",
+            (tournament_id, round_num, bye, bye)
+        )
+        conn.execute(
+            "UPDATE standings SET points = points + ?, byes = byes + 1 WHERE registration_id = ?", (BYE_POINTS, bye)
+        )
+        advancement.byes += 1
+
+    matches = conn.execute(
+        "SELECT id, is_bye FROM matches WHERE tournament_id = ? AND round = ?", (tournament_id, round_num)
+    ).fetchall()
+    advancement.rounds.add(round_num)
+    advancement.matches.update(match['id'] for match in matches)
+    advancement.ready += [match['id'] for match in matches if not match['is_bye']]
+
+
+def create_swiss(conn, tournament_id: int, player_ids: list) -> Advancement:
+    """Adds the players, given in seed order, to the standings and pairs the first round."""
+    conn.executemany(
+        "INSERT INTO standings (registration_id, tournament_id, seed) VALUES (?, ?, ?)",
+        [(player_id, tournament_id, seed) for seed, player_id in enumerate(player_ids, start=1)]
+    )
+    advancement = Advancement(total_rounds=total_rounds(conn, tournament_id))
+    _pair_round(conn, tournament_id, 1, advancement)
+    return advancement
+
+
+def record_swiss_result(conn, match_id: int, winner_id):
+    """Stores the result of a Swiss match and updates the standings. A winner_id of None means both
+    players were disqualified, which counts as a loss for both and leaves them out of later rounds.
+
+    The last result of a round pairs the next one, or finishes the tournament after the last
+    round or when fewer than two players are left to pair. Returns None when the result did not apply, as bracket_engine.record_result does.
+    """
+    if not store_result(conn, match_id, winner_id):
+        return None
+
+    match = conn.execute(
+        "SELECT tournament_id, round, player1_id, player2_id FROM matches WHERE id = ?", (match_id,)
+    ).fetchone()
+    losers = [player for player in (match['player1_id'], match['player2_id']) if player != winner_id]
+    conn.executemany("UPDATE standings SET losses = losses + 1 WHERE registration_id = ?", [(p,) for p in losers])
+    if winner_id is not None:
+        conn.execute(
+            "UPDATE standings SET points = points + ?, wins = wins + 1 WHERE registration_id = ?",
+            (WIN_POINTS, winner_id)
+        )
+
+    advancement = Advancement(rounds={match['round']}, matches={match_id})
+    tournament_id = match['tournament_id']
+    if conn.execute(
+        "SELECT 1 FROM matches WHERE tournament_id = ? AND round = ? AND winner_id IS NULL AND double_dq = 0 LIMIT 1",
+        (tournament_id, match['round'])
+    ).fetchone():
+        return advancement
+
+    remaining = conn.execute(
+        "SELECT COUNT(*) AS players FROM standings WHERE tournament_id = :tournament_id "
+        "AND registration_id NOT IN (" + DISQUALIFIED_SQL + ")",
+        {'tournament_id': tournament_id}
+    ).fetchone()['players']
+    if match['round'] >= total_rounds(conn, tournament_id) or remaining < 2:
+        advancement.finished = True
+        leader = ranking(conn, tournament_id, limit=1)[0]
+        advancement.champion_id = None if leader['disqualified'] else leader['registration_id']
+    else:
+        _pair_round(conn, tournament_id, match['round'] + 1, advancement)
+    return advancement
+
+
+def ranking(conn, tournament_id: int, limit: int = -1) -> list:
+    """Standings rows ordered by points, Buchholz and seed, disqualified players last, with the players'
+    nicknames.
+    """
+    return conn.execute(RANKING_SQL + " LIMIT :limit", {'tournament_id': tournament_id, 'limit': limit}).fetchall()
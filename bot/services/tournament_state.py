@@ -0,0 +1,130 @@
+"""In-process copy of the tournament data the registration path reads on every message.
+
+The database stays the source of truth. Every tournament is loaded once at startup, and
+every handler that changes these values updates its TournamentState right after the
+transaction commits, so registration reads never touch SQL.
+"""
+import asyncio
+
+from ..data.database import run_query
+from config import CHARACTERS
+
+
+class TournamentState:
+    """Title, status, registration flag, mode, format, seeding, free characters and who is already registered.
+
+    lock serializes the transactions that change this tournament's bracket (start,
+    results, reset), so a reset never interleaves with a result that is being recorded.
+    Tournaments never wait on each other's locks.
+    """
+
+    def __init__(self, tournament_id: int, title: str):
+        self.id = tournament_id
+        self.title = title
+        self.status = 'registration'
+        self.registration_open = False
+        self.mode = 'nickname'
+        self.format = 'single'
+        self.swiss_rounds = None
+        self.seeding = 'random'
+        self.free_characters = set(CHARACTERS)
+        self.nicknames = set()
+        self.registered_users = set()
+        self.lock = asyncio.Lock()
+
+    def _apply(self, tournament, registrations):
+        self.title = tournament['title']
+        self.status = tournament['status']
+        self.registration_open = bool(tournament['registration_open'])
+        self.mode = tournament['mode']
+        self.format = tournament['format']
+        self.swiss_rounds = tournament['swiss_rounds']
+        self.seeding = tournament['seeding']
+        self.free_characters = set(CHARACTERS)
+        self.nicknames = set()
+        self.registered_users = set()
+        for row in registrations:
+            self.add_registration(row['telegram_id'], row['nickname'], row['character_name'])
+
+    @staticmethod
+    def _read(conn, tournament_id=None):
+        where = "" if tournament_id is None else "WHERE t.id = ?"
+        params = () if tournament_id is None else (tournament_id,)
+        tournaments = conn.execute(
+            "SELECT t.id, t.title, t.status, t.registration_open, t.mode, t.format, t.swiss_rounds, t.seeding "
+            f"FROM tournaments t {where}",
+            params
+        ).fetchall()
+        registrations = conn.execute(
+            "SELECT r.tournament_id, u.telegram_id, r.nickname, r.character_name "
+            f"FROM registrations r JOIN users u ON r.user_id = u.id JOIN tournaments t ON r.tournament_id = t.id {where}",
+            params
+        ).fetchall()
+        return tournaments, registrations
+
+    async def load(self):
+        """Reloads this tournament from the database."""
+        tournaments, registrations = await run_query(self._read, self.id)
+        self._apply(tournaments[0], registrations)
+
+    def add_registration(self, telegram_id: int, nickname: str, character_name=None):
+        """Records a registration that has just been committed."""
+        self.nicknames.add(nickname)
+        self.registered_users.add(telegram_id)
+        self.free_characters.discard(character_name)
+
+    @property
+    def active(self) -> bool:
+        return self.status not in ('finished', 'archived')
+
+
+_tournaments = {}
+
+
+async def load_tournaments():
+    """Loads every tournament from the database, replacing what is in memory."""
+    tournaments, registrations = await run_query(TournamentState._read)
+    by_tournament = {}
+    for row in registrations:
+        by_tournament.setdefault(row['tournament_id'], []).append(row)
+
+    _tournaments.clear()
+    for row in tournaments:
+        tournament = TournamentState(row['id'], row['title'])
+        tournament._apply(row, by_tournament.get(row['id'], []))
+        _tournaments[row['id']] = tournament
+
+
+def get_tournament(tournament_id: int):
+    """Returns the state of a tournament, or None if there is no such tournament."""
+    return _tournaments.get(tournament_id)
+
+
+def add_tournament(tournament_id: int, title: str) -> TournamentState:
+    """Registers a tournament that has just been created."""
+    tournament = TournamentState(tournament_id, title)
+    _tournaments[tournament_id] = tournament
+    return tournament
+
+
+def list_tournaments(active_only=False) -> list:
+    """Returns the tournaments ordered by id."""
+    return [t for _, t in sorted(_tournaments.items()) if t.active or not active_only]
+
+
+def resolve_tournament(args: list, command: str):
+    """Picks the tournament a command targets: the id given as its first argument, or the
+    only active tournament if there is exactly one. Returns (tournament, error_text).
+    """
+    if args and args[0].isdigit():
+        tournament = get_tournament(int(args[0]))
+        if tournament is None:
+            return None, f"Турнир с ID {args[0]} не найден. Список турниров: /tournaments"
+        return tournament, None
+
+    active = list_tournaments(active_only=True)
+    if len(active) == 1:
+        return active[0], None
+    if not active:
+        return None, "Сейчас нет активных турниров."
+    return None, f"Укажите ID турнира: /{command} <ID>. Список турниров: /tournaments"
@@ -0,0 +1,187 @@
+"""Built-in HTTP listener for webhook mode.
+
+Telegram POSTs every update as JSON to the webhook path. The listener checks the secret
+token, puts the update on the application's update queue and answers right away; the
+application then processes queued updates with its concurrent-update limit, exactly as
+with polling. Only the standard library is used, so no web framework is needed.
+
+Stopping closes the listening socket, drops idle keep-alive connections and lets
+requests that are already being read finish. The application then drains its queue
+when it is stopped.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from http import HTTPStatus
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are far smaller; anything bigger is not an update.
+MAX_BODY_SIZE = 1024 * 1024
+# Idle keep-alive connections are closed after this many seconds.
+KEEP_ALIVE_TIMEOUT = 75
+# How long stop() waits for requests in flight before closing their connections.
+DRAIN_TIMEOUT = 10
+
+
+class _BadRequest(Exception):
+    def __init__(self, status: HTTPStatus):
+        self.status = status
+
+
+class WebhookServer:
+    """Accepts updates over HTTP and feeds them to an Application's update queue."""
+
+    def __init__(self, application, listen: str, port: int, path: str, secret_token=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path if path.startswith('/') else f"/{path}"
+        self.secret_token = secret_token
+        self.ready = asyncio.Event()
+        self._server = None
+        self._closing = False
+        # Connection task -> whether it is between requests and can be closed at once.
+        self._connections = {}
+
+    async def start(self):
+        """Starts listening. With port 0 the chosen port is stored in self.port."""
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.ready.set()
+        logger.info("Webhook listener on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        """Stops accepting connections and waits for requests that are being handled."""
+        if self._server is None:
+            return
+        self._closing = True
+        self._server.close()
+        for task, idle in list(self._connections.items()):
+            if idle:
+                task.cancel()
+        if self._connections:
+            done, pending = await asyncio.wait(list(self._connections), timeout=DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._connections[task] = True
+        try:
+            while not self._closing:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                self._connections[task] = False
+                try:
+                    status = await self._handle(request_line, reader)
+                except _BadRequest as e:
+                    status = e.status
+                keep_alive = status is HTTPStatus.OK and not self._closing
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('ascii')
+                )
+                await writer.drain()
+                self._connections[task] = True
+                if not keep_alive:
+                    break
+        except (asyncio.CancelledError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _handle(self, request_line: bytes, reader: asyncio.StreamReader) -> HTTPStatus:
+        try:
+            method, target, _ = request_line.decode('latin-1').split()
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise _BadRequest(HTTPStatus.BAD_REQUEST)
+        if length > MAX_BODY_SIZE:
+            raise _BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        body = await reader.readexactly(length)
+
+        if target.split('?', 1)[0] != self.path:
+            return HTTPStatus.NOT_FOUND
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED
+        if self.secret_token:
+            received = headers.get('x-telegram-bot-api-secret-token', '')
+            if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+                return HTTPStatus.FORBIDDEN
+
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return HTTPStatus.BAD_REQUEST
+        if update is None:
+            return HTTPStatus.BAD_REQUEST
+
+        await self.application.update_queue.put(update)
+        return HTTPStatus.OK
+
+
+async def run_webhook(application, server: WebhookServer, webhook_url=None, max_connections: int = 40, stop_event=None):
+    """Runs the application behind the listener until SIGINT/SIGTERM or stop_event, then drains and shuts down.
+
+    Takes over what Application.run_webhook does, including the post_init, post_stop and
+    post_shutdown hooks. The webhook is registered with Telegram only if webhook_url is set.
+    """
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows or outside the main thread; Ctrl-C still interrupts.
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await server.start()
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                max_connections=max_connections,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            # Processes the updates that are still queued before returning.
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
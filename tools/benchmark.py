@@ -0,0 +1,321 @@
+"""Load test of the real handlers, run offline.
+
+Builds the Application from bot/bot.py with the Bot API replaced by an offline stub and a
+throwaway database, and pushes generated updates through Application.process_update.
+Telegram's send limits are lifted so the numbers show the bot's own cost.
+
+Scenarios, run in this order on one database:
+  register  every player sends /register and then a nickname
+  start     /start_tournament with --players registrations
+  status    every player of the running tournament sends /my_status
+  results   an admin reports every match with win_/dq_ buttons until there is a champion
+  bracket   many users request /bracket and flip its pages
+
+For each scenario it prints p50/p99 update latency, throughput, SQL statements and Bot
+API calls per update, and the peak RSS of the process so far. --save writes the numbers
+to a JSON baseline; --compare reports the change against one and fails on regressions.
+
+Usage: python -m tools.benchmark [--registrations 10000] [--players 4096] [--save baseline.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from telegram import Update
+
+from bot.bot import build_application, post_init, post_stop, post_shutdown
+from bot.data import database
+from bot.services import sender
+from bot.services.tournament_state import get_tournament
+from config import ADMIN_IDS
+
+from .offline import OfflineRequest, callback_update, message_update
+
+SCENARIOS = ("register", "start", "status", "results", "bracket")
+# Metrics compared against a baseline, and whether higher is better.
+COMPARED = {"p50_ms": False, "p99_ms": False, "updates_per_s": True, "sql_per_update": False}
+FIRST_PLAYER_ID = 1_000_000
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _percentile(latencies: list, q: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Bench:
+    def __init__(self, application, request: OfflineRequest, admin_id: int, concurrency: int):
+        self.application = application
+        self.request = request
+        self.admin_id = admin_id
+        self.concurrency = concurrency
+        self.results = {}
+        self._latencies = []
+
+    async def send(self, updates: list):
+        """Processes the updates with `concurrency` workers, like the Application's update processor."""
+        queue = [Update.de_json(data, self.application.bot) for data in reversed(updates)]
+
+        async def worker():
+            while queue:
+                update = queue.pop()
+                started = time.perf_counter()
+                await self.application.process_update(update)
+                self._latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def setup(self, text: str):
+        """Processes one admin command outside of any measurement."""
+        await self.application.process_update(Update.de_json(message_update(self.admin_id, text), self.application.bot))
+
+    async def measure(self, name: str, scenario):
+        """Runs scenario() and records its numbers under name."""
+        self._latencies = []
+        calls_before = sum(self.request.calls.values())
+        statements_before = database._statements
+        started = time.perf_counter()
+        await scenario()
+        elapsed = time.perf_counter() - started
+        count = len(self._latencies)
+        self.results[name] = {
+            "updates": count,
+            "seconds": round(elapsed, 3),
+            "updates_per_s": round(count / elapsed, 1),
+            "p50_ms": round(_percentile(self._latencies, 0.5) * 1000, 2),
+            "p99_ms": round(_percentile(self._latencies, 0.99) * 1000, 2),
+            "max_ms": round(max(self._latencies) * 1000, 2),
+            "mean_ms": round(statistics.fmean(self._latencies) * 1000, 2),
+            "sql_per_update": round((database._statements - statements_before) / count, 2),
+            "api_calls_per_update": round((sum(self.request.calls.values()) - calls_before) / count, 2),
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        await self.drain_outbox()
+
+    async def drain_outbox(self):
+        """Waits until the outbox worker has sent everything, so scenarios don't overlap."""
+        while (await database.fetch_one(
+            "SELECT COUNT(*) AS n FROM outbox WHERE status IN ('pending', 'sending')"
+        ))['n']:
+            await asyncio.sleep(0.05)
+
+    async def new_tournament(self, title: str):
+        await self.setup(f"/new_tournament {title}")
+        row = await database.fetch_one("SELECT MAX(id) AS id FROM tournaments")
+        return get_tournament(row['id'])
+
+
+def _insert_players(conn, tournament_id: int, count: int):
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (telegram_id, username) VALUES (?, ?)",
+        ((FIRST_PLAYER_ID + i, f"player{i}") for i in range(count))
+    )
+    conn.execute(
+        "INSERT INTO registrations (tournament_id, user_id, nickname) "
+        "SELECT ?, id, 'player' || (telegram_id - ?) FROM users "
+        "WHERE telegram_id BETWEEN ? AND ?",
+        (tournament_id, FIRST_PLAYER_ID, FIRST_PLAYER_ID, FIRST_PLAYER_ID + count - 1)
+    )
+
+
+async def run_register(bench: Bench, args):
+    tournament = await bench.new_tournament("Benchmark registration")
+    await bench.setup(f"/open_registration {tournament.id}")
+    users = range(FIRST_PLAYER_ID, FIRST_PLAYER_ID + args.registrations)
+
+    async def scenario():
+        await bench.send([message_update(user_id, f"/register {tournament.id}") for user_id in users])
+        await bench.send([message_update(user_id, f"Player {user_id}") for user_id in users])
+
+    await bench.measure("register", scenario)
+    registered = len(tournament.registered_users)
+    if registered != args.registrations:
+        raise SystemExit(f"register: expected {args.registrations} registrations, got {registered}")
+
+
+async def run_start(bench: Bench, args):
+    tournament = await bench.new_tournament("Benchmark bracket")
+    await database.run_transaction(_insert_players, tournament.id, args.players)
+    await tournament.load()
+
+    async def scenario():
+        await bench.send([message_update(bench.admin_id, f"/start_tournament {tournament.id}")])
+
+    await bench.measure("start", scenario)
+    if tournament.status == 'registration':
+        raise SystemExit("start: the tournament did not start")
+    return tournament
+
+
+async def run_status(bench: Bench, args):
+    users = range(FIRST_PLAYER_ID, FIRST_PLAYER_ID + args.players)
+
+    async def scenario():
+        await bench.send([message_update(user_id, "/my_status") for user_id in users])
+
+    await bench.measure("status", scenario)
+
+
+async def run_results(bench: Bench, args, tournament):
+    async def scenario():
+        reported = 0
+        while tournament.status != 'finished':
+            rows = await database.fetch_all(
+                "SELECT id, player1_id, player2_id FROM matches WHERE tournament_id = ? AND is_bye = 0 "
+                "AND winner_id IS NULL AND double_dq = 0 AND pending_feeders = 0",
+                (tournament.id,)
+            )
+            if not rows:
+                raise SystemExit("results: no playable matches left but the tournament is not finished")
+            updates = []
+            for row in rows:
+                reported += 1
+                if reported % 50 == 0:
+                    data = f"dq_{row['id']}_both"
+                elif reported % 10 == 0:
+                    data = f"dq_{row['id']}_{row['player2_id']}"
+                else:
+                    data = f"win_{row['id']}_{row['player1_id']}"
+                updates.append(callback_update(bench.admin_id, data))
+            await bench.send(updates)
+
+    await bench.measure("results", scenario)
+
+
+async def run_bracket(bench: Bench, args, tournament):
+    users = range(FIRST_PLAYER_ID, FIRST_PLAYER_ID + args.bracket_requests)
+
+    async def scenario():
+        updates = []
+        for i, user_id in enumerate(users):
+            if i % 2:
+                updates.append(callback_update(user_id, f"bpage_{tournament.id}_{i % 8}"))
+            else:
+                updates.append(message_update(user_id, f"/bracket {tournament.id}"))
+        await bench.send(updates)
+
+    await bench.measure("bracket", scenario)
+
+
+def print_results(results: dict, baseline=None):
+    columns = ["updates", "updates_per_s", "p50_ms", "p99_ms", "max_ms", "sql_per_update",
+               "api_calls_per_update", "peak_rss_mb"]
+    print(f"{'scenario':<10}" + "".join(f"{c:>21}" for c in columns))
+    for name, numbers in results.items():
+        print(f"{name:<10}" + "".join(f"{str(numbers[c]):>21}" for c in columns))
+        if baseline and name in baseline:
+            changes = []
+            for metric in COMPARED:
+                old = baseline[name].get(metric)
+                if old:
+                    changes.append(f"{metric} {(numbers[metric] - old) / old:+.0%}")
+            print(f"{'':<10}vs baseline: " + ", ".join(changes))
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Metrics that got worse than the baseline by more than tolerance."""
+    found = []
+    for name, numbers in results.items():
+        for metric, higher_is_better in COMPARED.items():
+            old = baseline.get(name, {}).get(metric)
+            if not old:
+                continue
+            change = (numbers[metric] - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                found.append(f"{name} {metric}: {old} -> {numbers[metric]}")
+    return found
+
+
+async def main(args):
+    database.DB_FILE = args.db or os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "tournament.db")
+    # Measure the bot, not Telegram's flood limits.
+    sender.GLOBAL_RATE = sender.GLOBAL_BURST = sender.CHAT_RATE = sender.CHAT_BURST = 1_000_000
+    sender.EDIT_RATE = sender.EDIT_BURST = sender.GROUP_RATE = sender.GROUP_BURST = 1_000_000
+    if not ADMIN_IDS:
+        ADMIN_IDS.append(1)
+    admin_id = ADMIN_IDS[0]
+
+    request = OfflineRequest()
+    application = build_application("123456:OFFLINE", request=request)
+    # process_update only starts non-blocking handlers; wait for them so latencies cover the whole
+    # update. The harness runs updates concurrently itself.
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.block = True
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    bench = Bench(application, request, admin_id, args.concurrency)
+    try:
+        if "register" in args.scenarios:
+            await run_register(bench, args)
+        if {"start", "status", "results", "bracket"} & set(args.scenarios):
+            tournament = await run_start(bench, args)
+            if "start" not in args.scenarios:
+                del bench.results["start"]
+            if "status" in args.scenarios:
+                await run_status(bench, args)
+            if "results" in args.scenarios:
+                await run_results(bench, args, tournament)
+            if "bracket" in args.scenarios:
+                await run_bracket(bench, args, tournament)
+    finally:
+        await application.stop()
+        await post_stop(application)
+        await application.shutdown()
+        await post_shutdown(application)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print(f"Database: {database.DB_FILE}")
+    print_results(bench.results, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "args": vars(args), "results": bench.results}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if baseline:
+        found = regressions(bench.results, baseline, args.tolerance)
+        if found:
+            print("Regressions beyond tolerance:\n  " + "\n  ".join(found))
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bot's handlers offline.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--registrations", type=int, default=10_000, help="players in the register scenario")
+    parser.add_argument("--players", type=int, default=4096, help="players in the bracket scenarios")
+    parser.add_argument("--bracket-requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64, help="updates processed at the same time")
+    parser.add_argument("--db", help="database file to use instead of a temporary one")
+    parser.add_argument("--save", help="write the results to this baseline file")
+    parser.add_argument("--compare", help="compare with this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression when comparing (default 0.25)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    asyncio.run(main(args))
@@ -0,0 +1,88 @@
+"""Offline stand-ins for talking to Telegram, shared by the tools in this package."""
+import itertools
+import json
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    "id": 1, "is_bot": True, "first_name": "Offline", "username": "offline_bot",
+    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False,
+}
+
+
+class OfflineRequest(BaseRequest):
+    """Answers every Bot API call locally with a plausible result and counts the calls by method."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit('/', 1)[-1]
+        self.calls[name] += 1
+        params = request_data.parameters if request_data else {}
+        if name == 'getMe':
+            result = BOT_USER
+        elif name in ('sendMessage', 'editMessageText'):
+            result = {
+                "message_id": params.get('message_id') or next(self._message_ids),
+                "date": 0,
+                "chat": {"id": int(params.get('chat_id', 0)), "type": "private"},
+                "text": params.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    """A private-chat text message from user_id, as Telegram would deliver it."""
+    update_id = next(_update_ids)
+    entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith('/') else []
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Player", "username": f"player{user_id}"},
+            "text": text,
+            "entities": entities,
+        },
+    }
+
+
+def callback_update(user_id: int, data: str, message_id: int = 1) -> dict:
+    """A button press by user_id on a bot message."""
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": "offline",
+            "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Player"},
+            "message": {
+                "message_id": message_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+                "from": BOT_USER,
+            },
+        },
+    }
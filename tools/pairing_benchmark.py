@@ -0,0 +1,153 @@
+"""Benchmark of the pairing engines on a large field, run offline on a throwaway database.
+
+Swiss: plays every round with random results and times the transaction of each round's
+last result, which updates the standings and pairs the next round, and within it the
+pairing itself. Double elimination: times building the bracket and playing it out.
+
+Fails if pairing a Swiss round takes longer than --max-seconds.
+
+Usage: python -m tools.pairing_benchmark [--players 5000] [--max-seconds 1]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from bot.data import database
+from bot.services import swiss_engine
+from bot.services.formats import create_matches, record_match_result
+
+FIRST_PLAYER_ID = 2_000_000
+
+
+def _new_tournament(conn, tournament_format: str, players: int) -> int:
+    tournament_id = conn.execute(
+        "INSERT INTO tournaments (title, format, status, created_at) VALUES (?, ?, 'registration', ?)",
+        (f"Pairing benchmark ({tournament_format})", tournament_format, time.time())
+    ).lastrowid
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (telegram_id, username) VALUES (?, ?)",
+        ((FIRST_PLAYER_ID + i, f"pairing{i}") for i in range(players))
+    )
+    conn.execute(
+        "INSERT INTO registrations (tournament_id, user_id, nickname) "
+        "SELECT ?, id, 'pairing' || (telegram_id - ?) FROM users WHERE telegram_id BETWEEN ? AND ?",
+        (tournament_id, FIRST_PLAYER_ID, FIRST_PLAYER_ID, FIRST_PLAYER_ID + players - 1)
+    )
+    return tournament_id
+
+
+def _start(conn, tournament_id: int):
+    player_ids = [row['id'] for row in conn.execute(
+        "SELECT id FROM registrations WHERE tournament_id = ?", (tournament_id,)
+    )]
+    random.shuffle(player_ids)
+    return create_matches(conn, tournament_id, player_ids)
+
+
+def _open_matches(conn, tournament_id: int) -> list:
+    return conn.execute(
+        "SELECT id, player1_id, player2_id FROM matches WHERE tournament_id = ? AND is_bye = 0 "
+        "AND winner_id IS NULL AND double_dq = 0 AND pending_feeders = 0",
+        (tournament_id,)
+    ).fetchall()
+
+
+def _play(conn, matches: list):
+    """Records a random winner for every match and returns the last Advancement."""
+    advancement = None
+    for match in matches:
+        advancement = record_match_result(conn, match['id'], random.choice((match['player1_id'], match['player2_id'])))
+    return advancement
+
+
+async def bench_swiss(players: int) -> list:
+    """Returns (round, result transaction seconds, pairing seconds) for every paired round."""
+    pairing_times = []
+    pair_players = swiss_engine.pair_players
+
+    def timed_pair_players(*args):
+        started = time.perf_counter()
+        try:
+            return pair_players(*args)
+        finally:
+            pairing_times.append(time.perf_counter() - started)
+
+    swiss_engine.pair_players = timed_pair_players
+    try:
+        tournament_id = await database.run_transaction(_new_tournament, 'swiss', players)
+        started = time.perf_counter()
+        await database.run_transaction(_start, tournament_id)
+        rounds = [(1, time.perf_counter() - started, pairing_times[-1])]
+        while True:
+            matches = await database.run_query(_open_matches, tournament_id)
+            if not matches:
+                break
+            await database.run_transaction(_play, matches[:-1])
+            started = time.perf_counter()
+            advancement = await database.run_transaction(_play, matches[-1:])
+            elapsed = time.perf_counter() - started
+            if advancement.finished:
+                break
+            rounds.append((max(advancement.rounds), elapsed, pairing_times[-1]))
+    finally:
+        swiss_engine.pair_players = pair_players
+
+    rematches = (await database.fetch_one(
+        "SELECT COUNT(*) - COUNT(DISTINCT MIN(player1_id, player2_id) || ':' || MAX(player1_id, player2_id)) AS n "
+        "FROM matches WHERE tournament_id = ? AND player2_id IS NOT NULL",
+        (tournament_id,)
+    ))['n']
+    print(f"Swiss, {players} players, {len(rounds)} rounds, rematches: {rematches}")
+    for round_num, elapsed, pairing in rounds:
+        print(f"  round {round_num:>2}: paired in {pairing * 1000:7.1f} ms, "
+              f"result + standings + pairing + insert {elapsed * 1000:7.1f} ms")
+    return rounds
+
+
+async def bench_double(players: int):
+    tournament_id = await database.run_transaction(_new_tournament, 'double', players)
+    started = time.perf_counter()
+    advancement = await database.run_transaction(_start, tournament_id)
+    created = time.perf_counter() - started
+
+    results = []
+    while True:
+        matches = await database.run_query(_open_matches, tournament_id)
+        if not matches:
+            break
+        for match in matches:
+            started = time.perf_counter()
+            await database.run_transaction(_play, [match])
+            results.append(time.perf_counter() - started)
+    print(f"Double elimination, {players} players, {advancement.total_rounds} rounds: "
+          f"bracket built in {created * 1000:.1f} ms, {len(results)} results, "
+          f"mean {statistics.fmean(results) * 1000:.2f} ms, max {max(results) * 1000:.2f} ms per result")
+
+
+async def main(args):
+    random.seed(args.seed)
+    database.DB_FILE = args.db or os.path.join(tempfile.mkdtemp(prefix="pairing-"), "tournament.db")
+    await database.open_database()
+    try:
+        rounds = await bench_swiss(args.players)
+        await bench_double(args.players)
+    finally:
+        await database.close_database()
+
+    slow = [round_num for round_num, elapsed, _ in rounds if elapsed > args.max_seconds]
+    if slow:
+        print(f"Rounds paired slower than {args.max_seconds}s: {', '.join(map(str, slow))}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Swiss and double-elimination pairing offline.")
+    parser.add_argument("--players", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the shuffles and results")
+    parser.add_argument("--max-seconds", type=float, default=1.0, help="fail if a Swiss round takes longer to pair")
+    parser.add_argument("--db", help="database file to use instead of a temporary one")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,162 @@
+"""Exercises webhook mode end to end without network access.
+
+Starts the real application behind the built-in listener on localhost, with the Bot API
+replaced by an offline stub and a throwaway database. Then POSTs fake updates over
+keep-alive connections, checks that bad requests are rejected, stops the bot while
+requests are still arriving and verifies every accepted update was answered.
+
+Usage: python -m tools.webhook_harness [--updates 200] [--connections 20] [--concurrent-updates 8]
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+from bot.bot import build_application
+from bot.data import database
+from bot.services.webhook import WebhookServer, run_webhook
+
+from .offline import OfflineRequest, message_update
+
+SECRET = "harness-secret"
+PATH = "/telegram"
+COMMANDS = ["/start", "/help", "/tournaments", "/my_status"]
+
+
+class Client:
+    """A minimal HTTP/1.1 client on one keep-alive connection."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self._reader = self._writer = None
+
+    async def post(self, path: str, body: bytes, secret=SECRET, method="POST") -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection("127.0.0.1", self.port)
+        headers = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        if secret is not None:
+            headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+        headers += f"Content-Length: {len(body)}\r\n\r\n"
+        self._writer.write(headers.encode() + body)
+        await self._writer.drain()
+
+        status_line = await self._reader.readline()
+        if not status_line:
+            self.close()
+            raise ConnectionError("connection closed by the listener")
+        status = int(status_line.split()[1])
+        keep_alive = True
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"connection:") and b"close" in line.lower():
+                keep_alive = False
+        if not keep_alive:
+            self.close()
+        return status
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+
+async def check_rejections(port: int) -> list:
+    """Sends requests the listener must refuse. Returns a list of failures."""
+    body = json.dumps(message_update(1, "/start")).encode()
+    cases = [
+        ("wrong secret", dict(path=PATH, body=body, secret="wrong"), 403),
+        ("missing secret", dict(path=PATH, body=body, secret=None), 403),
+        ("wrong path", dict(path="/other", body=body), 404),
+        ("GET", dict(path=PATH, body=b"", method="GET"), 405),
+        ("malformed JSON", dict(path=PATH, body=b"{not json"), 400),
+    ]
+    failures = []
+    for name, kwargs, expected in cases:
+        client = Client(port)
+        status = await client.post(**kwargs)
+        client.close()
+        if status != expected:
+            failures.append(f"{name}: expected {expected}, got {status}")
+    return failures
+
+
+async def send_updates(port: int, updates: list, connections: int) -> Counter:
+    """POSTs the updates over several keep-alive connections. Returns the count of each status."""
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(json.dumps(update).encode())
+
+    async def worker():
+        client = Client(port)
+        while not queue.empty():
+            body = queue.get_nowait()
+            try:
+                statuses[await client.post(PATH, body)] += 1
+            except (ConnectionError, OSError):
+                statuses["refused"] += 1
+        client.close()
+
+    await asyncio.gather(*(worker() for _ in range(connections)))
+    return statuses
+
+
+async def main(args):
+    database.DB_FILE = args.db or os.path.join(tempfile.mkdtemp(prefix="webhook-harness-"), "tournament.db")
+    request = OfflineRequest()
+    application = build_application("123456:OFFLINE", request=request, concurrent_updates=args.concurrent_updates)
+    server = WebhookServer(application, "127.0.0.1", 0, PATH, SECRET)
+    stop = asyncio.Event()
+    runner = asyncio.create_task(run_webhook(application, server, stop_event=stop))
+    ready = asyncio.create_task(server.ready.wait())
+    await asyncio.wait([runner, ready], return_when=asyncio.FIRST_COMPLETED)
+    if runner.done():
+        runner.result()
+
+    failures = await check_rejections(server.port)
+
+    updates = [
+        message_update(10_000 + i % args.users, COMMANDS[i % len(COMMANDS)])
+        for i in range(args.updates)
+    ]
+    started = time.perf_counter()
+    statuses = await send_updates(server.port, updates, args.connections)
+    accepted_at = time.perf_counter()
+
+    # Stop while a second batch is still being posted: accepted updates must still be answered.
+    late = asyncio.create_task(send_updates(server.port, updates, args.connections))
+    await asyncio.sleep(0.05)
+    stop.set()
+    late_statuses = await late
+    await runner
+    finished = time.perf_counter()
+
+    accepted = statuses[200] + late_statuses[200]
+    answered = request.calls["sendMessage"]
+    print(f"Database: {database.DB_FILE}")
+    print(f"Rejection checks: {'ok' if not failures else '; '.join(failures)}")
+    print(f"Posted {args.updates} updates over {args.connections} connections: {dict(statuses)}")
+    print(f"Accepted in {accepted_at - started:.2f}s ({args.updates / (accepted_at - started):.0f} updates/s)")
+    print(f"Posted during shutdown: {dict(late_statuses)}")
+    # Replies go through the rate limiter, so draining takes at least accepted / 30 seconds.
+    print(f"Drained and stopped after {finished - accepted_at:.2f}s")
+    print(f"Updates accepted: {accepted}, replies sent: {answered}")
+    print(f"Bot API calls: {dict(request.calls)}")
+
+    if failures or answered != accepted:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the webhook listener offline and POST fake updates to it.")
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--concurrent-updates", type=int, default=8)
+    parser.add_argument("--db", help="database file to use instead of a temporary one")
+    asyncio.run(main(parser.parse_args()))